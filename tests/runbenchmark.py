@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2014 Jeremy S. Sanders
+#    Email: Jeremy Sanders <jeremy@jeremysanders.net>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""A program to benchmark Veusz.
+
+The example documents and a set of synthetic documents with large
+datasets, large 2D grids and many widgets are timed. Each of these
+stages is timed separately:
+
+ load:   running the document script (including any imports)
+ eval:   evaluating all the datasets (expressions, plugins, etc)
+ paint:  painting each page to recorded layers
+ bitmap: exporting each page to PNG
+ svg:    exporting each page to SVG
+
+With --startup, the time to start new Python processes which import
+the document code, create a document, import the user interface and
+export an example from the command line is also measured.
+
+The reload_links benchmark times reloading many linked CSV files
+serially, in threads and in processes.
+
+Each stage is repeated and the times are written to a JSON file, so
+that runs can be compared. If a previous results file is given with
+--compare, stages which are significantly slower (using Welch's t
+test) are reported and the program returns 1 if there are any.
+
+This program requires the veusz module to be on the PYTHONPATH.
+
+On Unix/Linux, Qt requires the DISPLAY environment to be set to an X11
+server. In a non graphical environment Xvfb can be used to create a
+hidden X11 server.
+"""
+
+from __future__ import print_function, division
+import glob
+import json
+import math
+import optparse
+import os
+import os.path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import datetime
+
+import numpy as N
+
+from veusz.compat import cexec, citems
+import veusz.qtall as qt4
+import veusz.utils as utils
+import veusz.document as document
+import veusz.setting as setting
+from veusz.document import export
+from veusz.document import linked
+
+# required to get structures initialised
+import veusz.windows.mainwindow
+
+# programs run in a new process for the startup stages
+startupstages = (
+    ('import', 'import veusz.document'),
+    ('document',
+     'import veusz.qtall as qt4, veusz.document as document; '
+     'import veusz.widgets; '
+     'app = qt4.QApplication([]); document.Document()'),
+    ('gui',
+     'import veusz.qtall as qt4; app = qt4.QApplication([]); '
+     'import veusz.windows.mainwindow'),
+    )
+
+# directory for temporary files
+tempdir = None
+
+###############################################################################
+# synthetic documents
+# these are functions taking a size scale and command interface
+
+def synthPoints(scale, ifc):
+    """xy plot of many random points."""
+    num = int(1e6*scale)
+    ifc.SetData('x', N.random.normal(size=num))
+    ifc.SetData('y', N.random.normal(size=num))
+    ifc.To(ifc.Add('page'))
+    ifc.To(ifc.Add('graph'))
+    ifc.Add('xy', xData='x', yData='y', marker='dot')
+
+def synthLine(scale, ifc):
+    """Line through many points, with expressions."""
+    num = int(1e6*scale)
+    ifc.SetData('t', N.linspace(0, 100, num))
+    ifc.SetDataExpression('s', 'sin(t)*exp(-t/50)', linked=True)
+    ifc.To(ifc.Add('page'))
+    ifc.To(ifc.Add('graph'))
+    ifc.Add('xy', xData='t', yData='s', marker='none')
+
+def writeImportFile(scale):
+    """Write the file for synthImport (not timed)."""
+    num = int(1e5*scale)
+    N.random.seed(42)
+    N.savetxt(os.path.join(tempdir, 'synth_import.dat'),
+              N.random.normal(size=(num, 3)))
+
+def synthImport(scale, ifc):
+    """Import of a large text file."""
+    ifc.ImportFile(os.path.join(tempdir, 'synth_import.dat'), 'a b c')
+    ifc.To(ifc.Add('page'))
+    ifc.To(ifc.Add('graph'))
+    ifc.Add('xy', xData='a', yData='b', marker='dot')
+
+def synthImage(scale, ifc):
+    """Large 2D grid as an image and contours."""
+    size = int(1000*math.sqrt(scale))
+    y, x = N.indices((size, size)) / size
+    ifc.SetData2D('img', N.sin(x*20)*N.cos(y*13),
+                  xrange=(0, 1), yrange=(0, 1))
+    ifc.To(ifc.Add('page'))
+    ifc.To(ifc.Add('graph'))
+    ifc.Add('image', data='img')
+    ifc.Add('contour', data='img', numLevels=10)
+
+def synthWidgets(scale, ifc):
+    """Many widgets, each with few points."""
+    num = int(200*scale)
+    ifc.SetData('x', N.arange(20))
+    ifc.To(ifc.Add('page'))
+    ifc.To(ifc.Add('grid', columns=10))
+    for i in range(num):
+        ifc.To(ifc.Add('graph'))
+        ifc.SetData('y%i' % i, N.random.normal(size=20))
+        ifc.Add('xy', xData='x', yData='y%i' % i)
+        ifc.Add('label', label='graph %i' % i)
+        ifc.To('..')
+
+synthetic = {
+    'synth_points': synthPoints,
+    'synth_line': synthLine,
+    'synth_import': synthImport,
+    'synth_image': synthImage,
+    'synth_widgets': synthWidgets,
+}
+
+###############################################################################
+
+def makeInterface():
+    """Return a new document, command interface and command dict."""
+    doc = document.Document()
+    ifc = document.CommandInterface(doc)
+    cmds = doc.eval_context
+    for cmd in document.CommandInterface.safe_commands:
+        cmds[cmd] = getattr(ifc, cmd)
+    for cmd in document.CommandInterface.unsafe_commands:
+        cmds[cmd] = getattr(ifc, cmd)
+    return doc, ifc, cmds
+
+def touchDatasets(doc):
+    """Evaluate all the datasets in the document."""
+    for name, ds in citems(doc.data):
+        ds.data
+        if ds.dimensions == 1:
+            ds.serr, ds.perr, ds.nerr
+
+def timeDocument(loadfn):
+    """Time stages of a document, loaded by loadfn(ifc, cmds).
+    Returns dict of stage names to times."""
+
+    times = {}
+    t0 = time.time()
+    doc, ifc, cmds = makeInterface()
+    loadfn(ifc, cmds)
+    times['load'] = time.time() - t0
+
+    t0 = time.time()
+    touchDatasets(doc)
+    times['eval'] = time.time() - t0
+
+    pages = list(range(doc.getNumberPages()))
+    t0 = time.time()
+    for page in pages:
+        size = doc.pageSize(page, dpi=(100, 100))
+        helper = document.PaintHelper(size, dpi=(100, 100))
+        doc.paintTo(helper, page)
+    times['paint'] = time.time() - t0
+
+    for stage, ext in (('bitmap', '.png'), ('svg', '.svg')):
+        filename = os.path.join(tempdir, 'bench' + ext)
+        t0 = time.time()
+        for page in pages:
+            # no export cache, as we want to time the painting
+            export.Export(doc, filename, page, cache=None).export()
+        times[stage] = time.time() - t0
+
+    return times
+
+def loadVsz(filename):
+    """Return function to load vsz file."""
+    def load(ifc, cmds):
+        cexec("from numpy import *", cmds)
+        ifc.AddImportPath(os.path.dirname(filename))
+        cexec(compile(open(filename).read(), filename, 'exec'), cmds)
+    return load
+
+def loadSynthetic(fn, scale):
+    """Return function to load synthetic document."""
+    def load(ifc, cmds):
+        N.random.seed(42)
+        fn(scale, ifc)
+    return load
+
+def timeProcess(args):
+    """Return time taken to run a process."""
+    t0 = time.time()
+    if subprocess.call(args) != 0:
+        raise RuntimeError('%s failed' % ' '.join(args))
+    return time.time() - t0
+
+def timeStartup():
+    """Time the startup stages in new processes.
+    Returns dict of stage names to times."""
+
+    times = {}
+    for stage, code in startupstages:
+        times[stage] = timeProcess([sys.executable, '-c', code])
+
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    times['export'] = timeProcess([
+            sys.executable,
+            os.path.join(thisdir, '..', 'veusz', 'veusz_main.py'),
+            '--export', os.path.join(tempdir, 'startup.png'),
+            os.path.join(thisdir, '..', 'examples', 'sin.vsz')])
+    return times
+
+def timeReload(scale):
+    """Time reloading many linked CSV files, serially, in threads and
+    in processes. Returns dict of stage names to times."""
+
+    numfiles = 300
+    numrows = int(2000*scale)
+    doc, ifc, cmds = makeInterface()
+    for i in range(numfiles):
+        filename = os.path.join(tempdir, 'reload_%i.csv' % i)
+        with open(filename, 'w') as f:
+            f.write('a,b,c\n')
+            for row in N.random.normal(size=(numrows, 3)):
+                f.write('%g,%g,%g\n' % tuple(row))
+        ifc.ImportFileCSV(filename, linked=True, dsprefix='f%i_' % i)
+
+    times = {}
+    links = doc.getLinkedFiles()
+    for stage, args in (
+        ('serial', {'numworkers': 1}),
+        ('threads', {'processes': False}),
+        ('processes', {'processes': True}) ):
+        t0 = time.time()
+        linked.reloadLinkedFiles(doc, links, **args)
+        times[stage] = time.time() - t0
+    return times
+
+def runBenchmarks(names, repeats, scale, startup):
+    """Run the benchmarks, returning dict of results."""
+
+    exampledir = os.path.join(os.path.dirname(__file__), '..', 'examples')
+    tests = {}
+    for vsz in glob.glob(os.path.join(exampledir, '*.vsz')):
+        tests[os.path.basename(vsz)] = loadVsz(vsz)
+    for name, fn in citems(synthetic):
+        tests[name] = loadSynthetic(fn, scale)
+
+    # tests timing their own stages
+    custom = {'reload_links': lambda: timeReload(scale)}
+    if startup:
+        custom['startup'] = timeStartup
+    tests.update(custom)
+
+    results = {}
+    for name in sorted(tests):
+        if names and name not in names:
+            continue
+        print(name)
+        times = {}
+        try:
+            for i in range(repeats):
+                if name in custom:
+                    run = tests[name]()
+                else:
+                    run = timeDocument(tests[name])
+                for stage, t in citems(run):
+                    times.setdefault(stage, []).append(t)
+        except Exception as ex:
+            print(' FAILED: %s' % ex)
+            continue
+        print(' ' + ', '.join(['%s %.3fs' % (s, min(times[s]))
+                               for s in sorted(times)]))
+        results[name] = times
+
+    return {
+        'date': datetime.datetime.utcnow().isoformat(),
+        'version': utils.version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeats': repeats,
+        'scale': scale,
+        'results': results,
+        }
+
+###############################################################################
+# comparison of runs
+
+def meanVar(vals):
+    """Return mean and sample variance of values."""
+    mean = sum(vals) / len(vals)
+    if len(vals) < 2:
+        return mean, 0.
+    return mean, sum([(v-mean)**2 for v in vals]) / (len(vals)-1)
+
+def welchT(old, new):
+    """Return Welch's t statistic for new being slower than old."""
+    m1, v1 = meanVar(old)
+    m2, v2 = meanVar(new)
+    err = math.sqrt(v1/len(old) + v2/len(new))
+    if err == 0:
+        return 0. if m1 == m2 else float('inf')*(m2-m1)
+    return (m2-m1) / err
+
+def compareResults(old, new, threshold, tcrit):
+    """Print stages which are significantly slower in new than old.
+    Returns number of slowdowns."""
+
+    slowdowns = 0
+    for name, times in sorted(citems(new['results'])):
+        oldtimes = old['results'].get(name)
+        if oldtimes is None:
+            continue
+        for stage in sorted(times):
+            o, n = oldtimes.get(stage), times.get(stage)
+            if not o or not n:
+                continue
+            ratio = meanVar(n)[0] / max(meanVar(o)[0], 1e-9)
+            t = welchT(o, n)
+            if ratio > 1+threshold and t > tcrit:
+                print('SLOWER: %s %s by %.0f%% (t=%.1f)' % (
+                        name, stage, (ratio-1)*100, t))
+                slowdowns += 1
+    return slowdowns
+
+def main():
+    parser = optparse.OptionParser(
+        usage='%prog [options] [benchmark names...]')
+    parser.add_option('--repeats', type='int', default=5,
+                      help='number of times to run each benchmark')
+    parser.add_option('--scale', type='float', default=1.,
+                      help='scale synthetic data sizes (1 gives 1e6 points,'
+                      ' 100 gives 1e8 points)')
+    parser.add_option('--output', default='benchmark.json',
+                      help='JSON file to write results to')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare with results in JSON file')
+    parser.add_option('--threshold', type='float', default=0.05,
+                      help='fractional slowdown to report')
+    parser.add_option('--tcrit', type='float', default=2.5,
+                      help='t statistic for a slowdown to be significant')
+    parser.add_option('--startup', action='store_true',
+                      help='also time program startup in new processes')
+    options, args = parser.parse_args()
+
+    global tempdir
+    tempdir = tempfile.mkdtemp(prefix='veusz_bench_')
+    try:
+        writeImportFile(options.scale)
+        results = runBenchmarks(set(args), options.repeats, options.scale,
+                                options.startup)
+    finally:
+        shutil.rmtree(tempdir)
+
+    with open(options.output, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as f:
+            old = json.load(f)
+        slowdowns = compareResults(old, results, options.threshold,
+                                   options.tcrit)
+        # exit codes are taken modulo 256, so do not return the count
+        sys.exit(min(slowdowns, 1))
+
+if __name__ == '__main__':
+    os.environ['LC_ALL'] = 'C'
+
+    app = qt4.QApplication([])
+    setting.transient_settings['unsafe_mode'] = True
+
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2014 Jeremy S. Sanders
+#    Email: Jeremy Sanders <jeremy@jeremysanders.net>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Test reloading linked text files.
+
+A linked file is appended to, which should only read the new lines,
+and edited before being appended to, which should read the whole file
+again. The program returns 0 if the tests succeeded, otherwise the
+number of tests failed.
+
+This program requires the veusz module to be on the PYTHONPATH.
+"""
+
+from __future__ import print_function
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+
+import veusz.qtall as qt4
+import veusz.document as document
+
+# required to get structures initialised
+import veusz.widgets
+
+def writeFile(filename, text, mode='w'):
+    with open(filename, mode) as f:
+        f.write(text)
+
+def checkReload(doc, expected, appending):
+    """Reload the document and check the values and whether only the
+    new part of the file was read."""
+    doc.reloadLinkedDatasets()
+    vals = [list(doc.data[n].data) for n in ('a', 'b')]
+    if vals != expected:
+        return 'values %s, expected %s' % (vals, expected)
+    if doc.data['a'].linked.appending != appending:
+        return 'appending was %s, expected %s' % (
+            doc.data['a'].linked.appending, appending)
+
+def testReload(tempdir):
+    """Append to a file, then edit and append."""
+    filename = os.path.join(tempdir, 'linked.dat')
+    writeFile(filename, '1 2\n3 4\n')
+
+    doc = document.Document()
+    ifc = document.CommandInterface(doc)
+    ifc.ImportFile(filename, 'a b', linked=True)
+
+    # first reload reads everything, as no state is known
+    error = checkReload(doc, [[1, 3], [2, 4]], False)
+    if error:
+        return 'first reload: ' + error
+
+    writeFile(filename, '5 6\n', mode='a')
+    error = checkReload(doc, [[1, 3, 5], [2, 4, 6]], True)
+    if error:
+        return 'append: ' + error
+
+    # change a value in the middle of the file, keeping its size
+    writeFile(filename, '1 2\n3 9\n5 6\n7 8\n')
+    error = checkReload(doc, [[1, 3, 5, 7], [2, 9, 6, 8]], False)
+    if error:
+        return 'edit and append: ' + error
+
+tests = (
+    ('reload', testReload),
+    )
+
+def runTests():
+    tempdir = tempfile.mkdtemp(prefix='veusz_linked_')
+    fails = 0
+    try:
+        for name, func in tests:
+            print(name)
+            error = func(tempdir)
+            if error:
+                print(' FAIL: %s' % error)
+                fails += 1
+            else:
+                print(' PASS')
+    finally:
+        shutil.rmtree(tempdir)
+
+    print()
+    if fails == 0:
+        print("All tests %i/%i PASSED" % (len(tests), len(tests)))
+    else:
+        print("%i/%i tests FAILED" % (fails, len(tests)))
+    sys.exit(fails)
+
+if __name__ == '__main__':
+    app = qt4.QApplication([])
+    runTests()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+#    Copyright (C) 2014 Jeremy S. Sanders
+#    Email: Jeremy Sanders <jeremy@jeremysanders.net>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Test the headless render server (veusz.render_server).
+
+Documents from the examples directory are rendered through
+renderRequest and a pool of worker processes. The program returns 0
+if the tests succeeded, otherwise the number of tests failed.
+
+This program requires the veusz module to be on the PYTHONPATH. As
+with runselftest.py, Qt may need an X11 server (e.g. Xvfb).
+"""
+
+from __future__ import print_function
+import os
+import os.path
+import sys
+
+import veusz.qtall as qt4
+import veusz.render_server as render_server
+
+# required to get structures initialised
+import veusz.widgets
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+exampledir = os.path.join(thisdir, '..', 'examples')
+
+pngsignature = b'\x89PNG\r\n\x1a\n'
+
+def testRender():
+    """Render an example document twice, using the cache."""
+    cache = render_server.DocumentCache(exampledir)
+    for i in range(2):
+        out = render_server.renderRequest(cache, {'file': 'sin.vsz'})
+        if not out.startswith(pngsignature):
+            return 'output is not a PNG file'
+    if cache.hits != 1 or cache.misses != 1:
+        return 'document was not cached: %s' % cache.stats()
+
+def testOutsideRoot():
+    """Files outside the document root should be rejected."""
+    cache = render_server.DocumentCache(exampledir)
+    for filename in ( os.path.join('..', 'tests', 'test_all_examples.vsz'),
+                      os.path.abspath(
+                          os.path.join(thisdir, 'test_all_examples.vsz')) ):
+        try:
+            render_server.renderRequest(cache, {'file': filename})
+        except render_server.RenderError:
+            pass
+        else:
+            return '%s was loaded' % filename
+
+def testWorkerRestart():
+    """Workers which die should be restarted."""
+    pool = render_server.RenderPool(exampledir, numworkers=1)
+    try:
+        ok, out = pool.render({'file': 'sin.vsz'})
+        if not ok:
+            return 'render failed: %s' % out
+
+        pool.workers[0].process.terminate()
+        pool.workers[0].process.join()
+        ok, out = pool.render({'file': 'sin.vsz'})
+        if ok:
+            return 'render with dead worker did not fail'
+
+        ok, out = pool.render({'file': 'sin.vsz'})
+        if not ok or not out.startswith(pngsignature):
+            return 'worker was not restarted: %s' % out
+    finally:
+        pool.close()
+
+tests = (
+    ('render', testRender),
+    ('outside root', testOutsideRoot),
+    ('worker restart', testWorkerRestart),
+    )
+
+def runTests():
+    fails = 0
+    for name, func in tests:
+        print(name)
+        error = func()
+        if error:
+            print(' FAIL: %s' % error)
+            fails += 1
+        else:
+            print(' PASS')
+
+    print()
+    if fails == 0:
+        print("All tests %i/%i PASSED" % (len(tests), len(tests)))
+    else:
+        print("%i/%i tests FAILED" % (fails, len(tests)))
+    sys.exit(fails)
+
+if __name__ == '__main__':
+    app = qt4.QApplication([])
+    runTests()
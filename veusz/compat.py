@@ -35,6 +35,10 @@ if cpy3:
     import builtins as cbuiltins
     from io import StringIO as CStringIO
     import urllib.request as curlrequest
+    import urllib.parse as curlparse
+    import http.server as chttpserver
+    import socketserver as csocketserver
+    import queue as cqueue
 
     # imports
     import pickle
@@ -90,6 +94,10 @@ else:
     import cPickle as pickle
     from cStringIO import StringIO as CStringIO
     import urllib2 as curlrequest
+    import urlparse as curlparse
+    import BaseHTTPServer as chttpserver
+    import SocketServer as csocketserver
+    import Queue as cqueue
 
     # range function
     crange = xrange
@@ -26,6 +26,7 @@ from ..compat import cstr
 from .. import qtall as qt4
 from .. import document
 from .. import setting
+from .. import utils
 from ..qtwidgets.datasetbrowser import DatasetBrowser
 from .veuszdialog import VeuszDialog
 
@@ -36,59 +37,115 @@ def _(text, disambiguation=None, context="DataEditDialog"):
     """Translate text."""
     return qt4.QCoreApplication.translate(context, text, disambiguation)
 
-class DatasetTableModel1D(qt4.QAbstractTableModel):
-    """Provides access to editing and viewing of datasets."""
+class _DatasetTableModelBase(qt4.QAbstractTableModel):
+    """Base class for table models showing datasets.
 
-    def __init__(self, parent, document, datasetname):
+    References to the dataset columns are kept, and values to display
+    are converted in blocks of rows which are cached. If only values
+    in some rows change, the view is only told about those rows."""
+
+    # number of rows to convert at once
+    blocksize = 256
+    # maximum number of blocks to cache
+    maxblocks = 256
+
+    def __init__(self, parent, document, dsnames):
         qt4.QAbstractTableModel.__init__(self, parent)
 
         self.document = document
+        self.dsnames = dsnames
+        self.blockcache = utils.LRUCache(self.maxblocks)
+        self.connect(document, qt4.SIGNAL('sigChanges'),
+                     self.slotDocumentChanges)
+
+    def updateColumns(self):
+        """Update references to datasets and columns. Override this."""
+
+    def modelRows(self, rows):
+        """Convert (start, stop) range of dataset rows to model rows."""
+        return rows
+
+    def cachedValue(self, column, row, convert):
+        """Get value to display for row in column.
+        convert(start, stop) returns a list of values for rows."""
+        start = row - row % self.blocksize
+        block = self.blockcache.get(
+            (column, start), lambda: convert(start, start+self.blocksize))
+        return block[row-start]
+
+    def slotDocumentChanges(self, changes):
+        """Called when document modified."""
+
+        if not changes.everything and not changes.datasets:
+            # datasets cannot depend on settings
+            return
+
+        self.updateColumns()
+        rows = changes.changedRows(self.dsnames)
+        numcols = self.columnCount(qt4.QModelIndex())
+        if rows is None or numcols == 0:
+            self.blockcache.clear()
+            self.emit( qt4.SIGNAL('layoutChanged()') )
+            return
+
+        # forget converted values in changed rows
+        start, stop = self.modelRows(rows)
+        self.blockcache.removeIf(
+            lambda key: key[1] < stop and key[1]+self.blocksize > start)
+
+        self.emit( qt4.SIGNAL('dataChanged(const QModelIndex &, '
+                              'const QModelIndex &)'),
+                   self.index(start, 0), self.index(stop-1, numcols-1) )
+
+class DatasetTableModel1D(_DatasetTableModelBase):
+    """Provides access to editing and viewing of datasets."""
+
+    def __init__(self, parent, document, datasetname):
+        _DatasetTableModelBase.__init__(self, parent, document,
+                                        (datasetname,))
         self.dsname = datasetname
-        self.connect(document, qt4.SIGNAL('sigModified'),
-                     self.slotDocumentModified)
+        self.updateColumns()
+
+    def updateColumns(self):
+        """Keep references to dataset and its columns."""
+        self.ds = self.document.data.get(self.dsname)
+        try:
+            self.cols = [getattr(self.ds, c) for c in self.ds.columns]
+            self.numrows = len(self.ds.data)+1
+        except (AttributeError, TypeError):
+            self.cols = []
+            self.numrows = 0
 
     def rowCount(self, parent):
         """Return number of rows."""
         if parent.isValid():
             # docs say we should return zero
             return 0
-
-        try:
-            return len(self.document.data[self.dsname].data)+1
-        except (KeyError, AttributeError):
-            return 0
-        
-    def slotDocumentModified(self):
-        """Called when document modified."""
-        self.emit( qt4.SIGNAL('layoutChanged()') )
+        return self.numrows
 
     def columnCount(self, parent):
         """Return number of columns."""
 
-        if parent.isValid():
+        if parent.isValid() or self.ds is None:
             return 0
-        try:
-            ds = self.document.data[self.dsname]
-        except KeyError:
-            return 0
-        return len( ds.column_descriptions )
+        return len( self.ds.column_descriptions )
 
     def data(self, index, role):
         """Return data for index."""
-        # get dataset
-        ds = self.document.data[self.dsname]
-        if ds is not None:
-            # select correct part of dataset
-            data = getattr(ds, ds.columns[index.column()])
-        if ds is not None and data is not None and role in (
-            qt4.Qt.DisplayRole, qt4.Qt.EditRole):
+
+        if role in (qt4.Qt.DisplayRole, qt4.Qt.EditRole):
+            column = index.column()
+            data = self.cols[column] if column < len(self.cols) else None
+
             # blank row at end of data
-            if index.row() == len(data):
+            if data is None or index.row() >= len(data):
                 return None
 
             # convert data to data
-            d = data[index.row()]
-            return ds.uiDataItemToData(d)
+            ds = self.ds
+            return self.cachedValue(
+                column, index.row(),
+                lambda start, stop: ds.uiDataItemsToData(data[start:stop]))
 
         # empty entry
         return None
@@ -96,17 +153,15 @@ class DatasetTableModel1D(qt4.QAbstractTableModel):
     def headerData(self, section, orientation, role):
         """Return row numbers or column names."""
 
-        try:
-            ds = self.document.data[self.dsname]
-        except KeyError:
+        if self.ds is None:
             return None
 
         if role == qt4.Qt.DisplayRole:
             if orientation == qt4.Qt.Horizontal:
                 # column names
-                return ds.column_descriptions[section]
+                return self.ds.column_descriptions[section]
             else:
-                if section == len(ds.data):
+                if section == self.numrows-1:
                     return "+"
                 # return row numbers
                 return section+1
@@ -117,8 +172,7 @@ class DatasetTableModel1D(qt4.QAbstractTableModel):
         """Update flags to say that items are editable."""
         if index.isValid():
             f = qt4.QAbstractTableModel.flags(self, index)
-            ds = self.document.data.get(self.dsname)
-            if ds is not None and ds.editable():
+            if self.ds is not None and self.ds.editable():
                 f |= qt4.Qt.ItemIsEditable
             return f
         return qt4.Qt.ItemIsEnabled
@@ -172,41 +226,39 @@ class DatasetTableModel1D(qt4.QAbstractTableModel):
             return False
         return True
 
-class DatasetTableModelMulti(qt4.QAbstractTableModel):
+class DatasetTableModelMulti(_DatasetTableModelBase):
     """Edit multiple datasets simultaneously with a spreadsheet-like style."""
 
     def __init__(self, parent, document, datasetnames):
-        qt4.QAbstractTableModel.__init__(self, parent)
-
-        self.document = document
-        self.dsnames = datasetnames
-        self.connect(document, qt4.SIGNAL('sigModified'),
-                     self.slotDocumentModified)
-
-        self.changeset = -1
-        self.rows = 0
+        _DatasetTableModelBase.__init__(self, parent, document,
+                                        datasetnames)
+        self.updateColumns()
 
-    def updateCounts(self):
-        """Count rows and columns."""
-
-        self.changeset = self.document.changeset
+    def updateColumns(self):
+        """Count rows and columns, keeping references to columns."""
 
         rows = 0
+        # these are indexed by the position of the dataset in dsnames
         rowcounts = self.rowcounts = []
+        datasets = self.datasets = []
         colcounts = self.colcounts = []
         colattrs = self.colattrs = []
+        coldata = self.coldata = []
 
         for dsidx, name in enumerate(self.dsnames):
-            if name not in self.document.data:
-                continue
-            dataset = self.document.data[name]
-            if (not hasattr(dataset, 'data') or
+            dataset = self.document.data.get(name)
+            if (dataset is None or
+                not hasattr(dataset, 'data') or
                 not hasattr(dataset, 'columns') or
                 dataset.dimensions != 1):
+                rowcounts.append(0)
+                datasets.append(None)
+                colcounts.append(0)
                 continue
 
             r = len(dataset.data)+1
             rowcounts.append(r)
+            datasets.append(dataset)
             rows = max(rows, r)
 
             attr = []
@@ -214,6 +266,7 @@ class DatasetTableModelMulti(qt4.QAbstractTableModel):
                 data = getattr(dataset, col)
                 if data is not None:
                     attr.append( (name, col, dsidx, colidx) )
+                    coldata.append(data)
             colcounts.append( len(attr) )
             colattrs += attr
 
@@ -222,33 +275,27 @@ class DatasetTableModelMulti(qt4.QAbstractTableModel):
     def rowCount(self, parent):
         if parent.isValid():
             return 0
-        if self.changeset != self.document.changeset:
-            self.updateCounts()
         return self.rows
 
     def columnCount(self, parent):
         if parent.isValid():
             return 0
-        if self.changeset != self.document.changeset:
-            self.updateCounts()
         return len(self.colattrs)
 
-    def slotDocumentModified(self):
-        self.updateCounts()
-        self.emit( qt4.SIGNAL('layoutChanged()') )
-
     def data(self, index, role):
         """Return data for index."""
 
-        dsname, colname, dsidx, colidx = self.colattrs[index.column()]
-        ds = self.document.data[dsname]
-        data = getattr(ds, colname)
-
         if role == qt4.Qt.DisplayRole:
+            column = index.column()
+            dsidx = self.colattrs[column][2]
             if index.row() < self.rowcounts[dsidx]-1:
                 # convert data to Data
-                d = data[index.row()]
-                return ds.uiDataItemToData(d)
+                ds = self.datasets[dsidx]
+                data = self.coldata[column]
+                return self.cachedValue(
+                    column, index.row(),
+                    lambda start, stop: ds.uiDataItemsToData(
+                        data[start:stop]))
 
         # empty entry
         return None
@@ -260,8 +307,7 @@ class DatasetTableModelMulti(qt4.QAbstractTableModel):
             if orientation == qt4.Qt.Horizontal:
                 # column names
                 dsname, colname, dsidx, colidx = self.colattrs[section]
-                ds = self.document.data[dsname]
-                descr = ds.column_descriptions[colidx]
+                descr = self.datasets[dsidx].column_descriptions[colidx]
                 header = dsname + '\n' + descr
                 return header
             else:
@@ -335,42 +381,43 @@ class DatasetTableModelMulti(qt4.QAbstractTableModel):
         self.document.applyOperation(
             document.OperationMultiple(ops, _('delete row(s)')))
 
-class DatasetTableModel2D(qt4.QAbstractTableModel):
+class DatasetTableModel2D(_DatasetTableModelBase):
     """A 2D dataset model."""
 
     def __init__(self, parent, document, datasetname):
-        qt4.QAbstractTableModel.__init__(self, parent)
-
-        self.document = document
+        _DatasetTableModelBase.__init__(self, parent, document,
+                                        (datasetname,))
         self.dsname = datasetname
-        self.connect(document, qt4.SIGNAL('sigModified'),
-                     self.slotDocumentModified)
+        self.updateColumns()
+
+    def updateColumns(self):
+        """Keep a reference to the dataset values."""
+        self.ds = self.document.data.get(self.dsname)
+        self.data2d = getattr(self.ds, 'data', None)
+
+    def modelRows(self, rows):
+        """Rows are shown in reverse order."""
+        num = self.data2d.shape[0]
+        return num-rows[1], num-rows[0]
 
     def rowCount(self, parent):
-        if parent.isValid():
-            return 0
-        ds = self.document.data[self.dsname].data
-        if ds is not None:
-            return ds.shape[0]
-        else:
+        if parent.isValid() or self.data2d is None:
             return 0
+        return self.data2d.shape[0]
 
     def columnCount(self, parent):
-        if parent.isValid():
-            return 0
-        ds = self.document.data[self.dsname].data
-        if ds is not None:
-            return ds.shape[1]
-        else:
+        if parent.isValid() or self.data2d is None:
             return 0
+        return self.data2d.shape[1]
 
     def data(self, index, role):
-        if role == qt4.Qt.DisplayRole:
+        if role == qt4.Qt.DisplayRole and self.data2d is not None:
             # get data (note y is reversed, sigh)
-            ds = self.document.data[self.dsname].data
-            if ds is not None:
-                num = ds[ds.shape[0]-index.row()-1, index.column()]
-                return float(num)
+            column = index.column()
+            data = self.data2d[::-1, column]
+            return self.cachedValue(
+                column, index.row(),
+                lambda start, stop: data[start:stop].tolist())
 
         return None
 
@@ -378,7 +425,7 @@ class DatasetTableModel2D(qt4.QAbstractTableModel):
         """Return headers at top."""
 
         if role == qt4.Qt.DisplayRole:
-            ds = self.document.data[self.dsname]
+            ds = self.ds
 
             if ds is not None:
                 # return a number for the top left of the cell
@@ -405,10 +452,6 @@ class DatasetTableModel2D(qt4.QAbstractTableModel):
                 f |= qt4.Qt.ItemIsEditable
             return f
 
-    def slotDocumentModified(self):
-        """Called when document modified."""
-        self.emit( qt4.SIGNAL('layoutChanged()') )
-
     def setData(self, index, value, role):
         """Called to set the data."""
 
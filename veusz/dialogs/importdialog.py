@@ -893,6 +893,7 @@ class ImportDialog(VeuszDialog):
 
         VeuszDialog.__init__(self, parent, 'import.ui')
         self.document = document
+        document.loadPlugins(registry='importpluginregistry')
 
         # whether file import looks likely to work
         self.filepreviewokay = False
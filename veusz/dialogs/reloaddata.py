@@ -67,6 +67,17 @@ class ReloadData(VeuszDialog):
         self.connect(self.intervalTimer, qt4.SIGNAL('timeout()'),
                      self.reloadIfChanged)
 
+        # watch files for changes where the system supports it, with
+        # the timer above as a fallback
+        self.watcher = qt4.QFileSystemWatcher(self)
+        self.connect(self.watcher, qt4.SIGNAL('fileChanged(const QString&)'),
+                     self.slotFileChanged)
+        # wait for writes to finish before reloading
+        self.watchTimer = qt4.QTimer(self)
+        self.watchTimer.setSingleShot(True)
+        self.connect(self.watchTimer, qt4.SIGNAL('timeout()'),
+                     self.reloadIfChanged)
+
         # manual reload
         self.reloadbutton = self.buttonBox.addButton(
             "&Reload again", qt4.QDialogButtonBox.ApplyRole)
@@ -96,8 +107,26 @@ class ReloadData(VeuszDialog):
         """Reload at intervals option toggled."""
         if self.intervalCheck.isChecked():
             self.intervalTimer.start( self.intervalTime.value()*1000 )
+            self.updateWatched()
         else:
             self.intervalTimer.stop()
+            self.watchTimer.stop()
+            if self.watcher.files():
+                self.watcher.removePaths(self.watcher.files())
+
+    def updateWatched(self):
+        """Watch the linked files for changes."""
+        files = set([f[0] for f in self.filestats])
+        # files replaced when saved stop being watched, so add again
+        watched = set(self.watcher.files())
+        if files-watched:
+            self.watcher.addPaths(sorted(files-watched))
+        if watched-files:
+            self.watcher.removePaths(sorted(watched-files))
+
+    def slotFileChanged(self, filename):
+        """A watched file has changed."""
+        self.watchTimer.start(200)
 
     def reloadIfChanged(self):
         """Reload linked data if it has changed."""
@@ -105,16 +134,29 @@ class ReloadData(VeuszDialog):
         if newstat != self.filestats:
             self.filestats = newstat
             self.reloadData()
+        if self.intervalCheck.isChecked():
+            self.updateWatched()
 
     def reloadData(self):
         """Reload linked data. Show the user what was done."""
 
+        progressdlg = qt4.QProgressDialog(
+            _('Reloading linked files...'), _('Cancel'), 0, 0, self)
+        progressdlg.setMinimumDuration(500)
+        progressdlg.setWindowModality(qt4.Qt.WindowModal)
+
+        def progress(numdone, numtotal):
+            progressdlg.setMaximum(numtotal)
+            progressdlg.setValue(numdone)
+            qt4.qApp.processEvents()
+            return not progressdlg.wasCanceled()
+
         text = ''
         self.document.suspendUpdates()
         try:
             # try to reload the datasets
             datasets, errors = self.document.reloadLinkedDatasets(
-                self.filenames)
+                self.filenames, progress=progress)
 
             # show errors in read data
             for var, count in citems(errors):
@@ -137,10 +179,15 @@ class ReloadData(VeuszDialog):
             text = _('Error reading file:\n') + cstr(e)
         except document.DescriptorError:
             text = _('Could not interpret descriptor. Reload failed.')
+        except document.linked.ReloadCancelled:
+            text = _('Reload cancelled.')
         except:
+            progressdlg.reset()
             self.document.enableUpdates()
             raise
 
+        progressdlg.reset()
+
         if text == '':
             text = _('Nothing to do. No linked datasets.')
 
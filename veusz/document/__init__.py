@@ -30,5 +30,6 @@ from .mime import *
 from .dataset_histo import *
 from .painthelper import *
 from .export import Export, printDialog
+from .exportcache import ExportCache, defaultExportCache
 from .dbusinterface import *
 from .importparams import *
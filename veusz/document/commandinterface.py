@@ -41,6 +41,7 @@ from . import operations
 from . import dataset_histo
 from . import mime
 from . import export
+from . import exportcache
 
 class CommandInterface(qt4.QObject):
     """Class provides command interface."""
@@ -60,6 +61,7 @@ class CommandInterface(qt4.QObject):
         'GetDataType',
         'GetDatasets',
         'ImportFITSFile',
+        'ImportFITSFileMulti',
         'ImportFile',
         'ImportFile2D',
         'ImportFileCSV',
@@ -69,6 +71,8 @@ class CommandInterface(qt4.QObject):
         'List',
         'NodeChildren',
         'NodeType',
+        'Profile',
+        'ProfileReport',
         'ReloadData',
         'Remove',
         'RemoveCustom',
@@ -96,6 +100,7 @@ class CommandInterface(qt4.QObject):
     unsafe_commands = (
         'Export',        
         'Print',
+        'ProfileTrace',
         'Save',
         )
 
@@ -268,6 +273,7 @@ class CommandInterface(qt4.QObject):
         if they are renamed. The new name None means dataset is deleted."""
 
         # lookup plugin (urgh)
+        self.document.loadPlugins(registry='datasetpluginregistry')
         plugin = None
         for pkls in plugins.datasetpluginregistry:
             if pkls.name == pluginname:
@@ -837,6 +843,31 @@ class CommandInterface(qt4.QObject):
         op = operations.OperationDataImportFITS(params)
         self.document.applyOperation(op)
 
+    def ImportFITSFileMulti(self, filename, items,
+                            prefix='', suffix='', linked=False):
+        """Import many datasets from a FITS file at once
+
+        filename is name of the fits file to open
+        items is a list of dicts, one per dataset, with the keys
+        dsname and hdu, and optionally datacol, symerrcol, poserrcol,
+        negerrcol and wcsmode, which have the same meanings as the
+        arguments to ImportFITSFile.
+
+        The file is only opened once and the data are memory mapped,
+        so this is faster than ImportFITSFile for many columns.
+
+        prefix and suffix are added to the dataset names
+        linked specfies that the datasets are linked to the file
+        """
+
+        realfilename = self.findFileOnImportPath(filename)
+        params = importparams.ImportParamsFITSMulti(
+            filename=realfilename, items=[dict(i) for i in items],
+            prefix=prefix, suffix=suffix,
+            linked=linked)
+        op = operations.OperationDataImportFITSMulti(params)
+        self.document.applyOperation(op)
+
     def ImportFilePlugin(self, plugin, filename, **args):
         """Import file using a plugin.
 
@@ -874,6 +905,23 @@ class CommandInterface(qt4.QObject):
 
         return self.document.reloadLinkedDatasets()
 
+    def Profile(self, enable=True):
+        """Enable or disable recording of the time taken drawing
+        widgets, doing operations, importing and evaluating
+        expressions. Enabling clears previously recorded times."""
+        utils.profiler.enable(enable)
+
+    def ProfileReport(self, maxlines=50):
+        """Return a text report of the profiled items taking the
+        most time."""
+        return utils.profiler.report(maxlines=maxlines)
+
+    def ProfileTrace(self, filename):
+        """Write profiled times to filename in Chrome trace event
+        (JSON) format."""
+        with open(filename, 'w') as f:
+            utils.profiler.writeTrace(f)
+
     def Action(self, action, widget='.'):
         """Performs action on current widget."""
 
@@ -905,7 +953,8 @@ class CommandInterface(qt4.QObject):
         e = export.Export(self.document, filename, page, color=color,
                           bitmapdpi=dpi, antialias=antialias,
                           quality=quality, backcolor=backcolor,
-                          pdfdpi=pdfdpi, svgtextastext=svgtextastext)
+                          pdfdpi=pdfdpi, svgtextastext=svgtextastext,
+                          cache=exportcache.defaultExportCache())
         e.export()
 
     def Rename(self, widget, newname):
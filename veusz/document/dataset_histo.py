@@ -18,14 +18,42 @@
 
 from __future__ import division
 import numpy as N
-from .datasets import Dataset, evalDatasetExpression
+from ..compat import crange
+from .datasets import Dataset, evalDatasetExpression, expressionDatasetNames
+from . import dependencies
 from .. import qtall as qt4
 
 def _(text, disambiguation=None, context="Datasets"):
     """Translate text."""
     return qt4.QCoreApplication.translate(context, text, disambiguation)
 
+def chunkedRange(data, chunksize):
+    """Return minimum and maximum of data, ignoring NaNs, in a single
+    pass over chunks of chunksize values."""
+    mins, maxs = [], []
+    for i in crange(0, len(data), chunksize):
+        chunk = data[i:i+chunksize]
+        finite = chunk[~N.isnan(chunk)]
+        if len(finite) > 0:
+            mins.append(finite.min())
+            maxs.append(finite.max())
+    if not mins:
+        return N.nan, N.nan
+    return min(mins), max(maxs)
+
+def chunkedHistogram(data, edges, chunksize):
+    """Return counts of data in bins with edges, in a single pass over
+    chunks of chunksize values."""
+    counts = N.zeros(len(edges)-1, dtype=N.int64)
+    for i in crange(0, len(data), chunksize):
+        counts += N.histogram(data[i:i+chunksize], bins=edges)[0]
+    return counts
+
 class DatasetHistoGenerator(object):
+
+    # number of values to histogram at once, to bound temporary memory
+    chunksize = 1048576
+
     def __init__(self, document, inexpr,
                  binmanual = None, binparams = None,
                  method = 'counts',
@@ -40,8 +68,6 @@ class DatasetHistoGenerator(object):
         errors = True/False
         """
 
-        self.changeset = -1
-
         self.document = document
         self.inexpr = inexpr
         self.binmanual = binmanual
@@ -50,31 +76,41 @@ class DatasetHistoGenerator(object):
         self.cumulative = cumulative
         self.errors = errors
 
+        # the histogram is recalculated when the input datasets change
+        self.node = dependencies.DependencyNode(
+            self._inputDatasets, self._calculate,
+            descr=_("Histogram of '%s'") % inexpr)
+        self._results = None
+
+    def _inputDatasets(self):
+        """Return names of datasets used by input expression."""
+        return expressionDatasetNames(self.inexpr)
+
     def getData(self):
-        """Get data from input expression, caching result."""
-        if self.document.changeset != self.changeset:
-            d = evalDatasetExpression(self.document, self.inexpr)
-            if d is not None:
-                d = d.data
-            self._cacheddata = d
-            self.changeset = self.document.changeset
-        return self._cacheddata
-
-    def binLocations(self):
-        """Compute locations of bins edges, giving N+1 items."""
+        """Get data from input expression."""
+        d = evalDatasetExpression(self.document, self.inexpr)
+        if d is not None:
+            d = d.data
+        return d
+
+    def binLocations(self, data=None):
+        """Compute locations of bins edges, giving N+1 items.
+        data is the input data if already evaluated."""
         if self.binmanual:
             return N.array(self.binmanual)
         else:
             numbins, minval, maxval, islog = self.binparams
 
             if minval == 'Auto' or maxval == 'Auto':
-                data = self.getData()
+                if data is None:
+                    data = self.getData()
                 if data is None:
                     return N.array([])
+                dmin, dmax = chunkedRange(data, self.chunksize)
                 if minval == 'Auto':
-                    minval = N.nanmin(data)
+                    minval = dmin
                 if maxval == 'Auto':
-                    maxval = N.nanmax(data)
+                    maxval = dmax
 
             if not islog:
                 delta = (maxval - minval) / numbins
@@ -88,13 +124,43 @@ class DatasetHistoGenerator(object):
                 delta = (lmax - lmin) / numbins
                 return N.exp( N.arange(numbins+1)*delta + lmin )
 
+    def _cumulative(self, hist):
+        """Compute cumulative values if wanted."""
+        if self.cumulative == 'smalltolarge':
+            hist = N.cumsum(hist)
+        elif self.cumulative == 'largetosmall':
+            hist = N.cumsum(hist[::-1])[::-1]
+        return hist
+
+    def _calculate(self):
+        """Calculate the bins and values of the histogram.
+
+        The data are read in at most two passes: one to find the
+        range of automatic bins and one to count the values in the
+        bins. The counts are used for the values and errors."""
+
+        self._results = None
+        data = self.getData()
+        if data is None:
+            return
+
+        binlocs = self.binLocations(data=data)
+        counts = chunkedHistogram(data, binlocs, self.chunksize)
+        self._results = (binlocs, counts, data.size)
+
+    def _getResults(self):
+        """Return (bin edges, counts, size of data) or None on error."""
+        self.node.update(self.document)
+        return self._results
+
     def getBinLocations(self):
         """Return bin centre, -ve bin width, +ve bin width."""
 
-        if self.getData() is None:
+        results = self._getResults()
+        if results is None:
             return (N.array([]), None, None)
 
-        binlocs = self.binLocations()
+        binlocs = results[0]
 
         if self.binparams and self.binparams[3]:
             # log bins
@@ -109,24 +175,19 @@ class DatasetHistoGenerator(object):
         perr = binlocs[1:] - data
         return data, nerr, perr
 
-    def getErrors(self, data, binlocs):
-        """Compute error bars if requried."""
-
-        hist, edges = N.histogram(data, bins=binlocs)
+    def getErrors(self, counts, edges, size):
+        """Compute error bars from the counts in the bins."""
 
         # calculate scaling values for error bars
         if self.method == 'density':
-            ratio = 1. / (hist.size*(edges[1]-edges[0]))
+            ratio = 1. / (counts.size*(edges[1]-edges[0]))
         elif self.method == 'fractions':
-            ratio = 1. / data.size
+            ratio = 1. / size
         else:
             ratio = 1.
 
         # compute cumulative values (errors correlated)
-        if self.cumulative == 'smalltolarge':
-            hist = N.cumsum(hist)
-        elif self.cumulative == 'largetosmall':
-            hist = N.cumsum(hist[::-1])[::-1]
+        hist = self._cumulative(counts)
 
         # Gehrels 1986 ApJ 303 336
         perr = 1. + N.sqrt(hist + 0.75)
@@ -137,25 +198,24 @@ class DatasetHistoGenerator(object):
     def getBinVals(self):
         """Return results for each bin."""
 
-        data = self.getData()
-        if data is None:
+        results = self._getResults()
+        if results is None:
             return (N.array([]), None, None)
+        binlocs, counts, size = results
 
-        normed = self.method == 'density'
-        binlocs = self.binLocations()
-        hist, edges = N.histogram(data, bins=binlocs, normed=normed)
-        
-        if self.method == 'fractions':
-            hist = hist * (1./data.size)
+        if self.method == 'density':
+            # normalise so that integral is 1
+            hist = counts / (counts.sum() * N.diff(binlocs))
+        elif self.method == 'fractions':
+            hist = counts * (1./size)
+        else:
+            hist = counts
 
         # if cumulative wanted
-        if self.cumulative == 'smalltolarge':
-            hist = N.cumsum(hist)
-        elif self.cumulative == 'largetosmall':
-            hist = N.cumsum(hist[::-1])[::-1]
+        hist = self._cumulative(hist)
 
         if self.errors:
-            nerr, perr = self.getErrors(data, binlocs)
+            nerr, perr = self.getErrors(counts, binlocs, size)
         else:
             nerr, perr = None, None
 
@@ -203,6 +263,7 @@ class DatasetHistoBins(Dataset):
     """A dataset for getting the bin positions for the histogram."""
 
     dstype = _('Histogram')
+    isderived = True
 
     def __init__(self, generator, document):
         Dataset.__init__(self, data=[])
@@ -210,15 +271,21 @@ class DatasetHistoBins(Dataset):
         self.document = document
         self.linked = None
         self._invalidpoints = None
-        self.changeset = -1
+        self.version = None
 
     def getData(self):
         """Get bin positions, caching results."""
-        if self.changeset != self.generator.document.changeset:
+        node = self.generator.node
+        node.update(self.generator.document)
+        if self.version != node.version:
             self.datacache = self.generator.getBinLocations()
-            self.changeset = self.generator.document.changeset
+            self.version = node.version
         return self.datacache
 
+    def dependencyNode(self):
+        """Return node which calculates the histogram."""
+        return self.generator.node
+
     def saveToFile(self, fileobj, name):
         """Save dataset (counterpart does this)."""
         pass
@@ -236,6 +303,7 @@ class DatasetHistoValues(Dataset):
     """A dataset for getting the height of the bins in a histogram."""
 
     dstype = _('Histogram')
+    isderived = True
 
     def __init__(self, generator, document):
         Dataset.__init__(self, data=[])
@@ -243,15 +311,21 @@ class DatasetHistoValues(Dataset):
         self.document = document
         self.linked = None
         self._invalidpoints = None
-        self.changeset = -1
+        self.version = None
 
     def getData(self):
         """Get bin heights, caching results."""
-        if self.changeset != self.generator.document.changeset:
+        node = self.generator.node
+        node.update(self.generator.document)
+        if self.version != node.version:
             self.datacache = self.generator.getBinVals()
-            self.changeset = self.generator.document.changeset
+            self.version = node.version
         return self.datacache
 
+    def dependencyNode(self):
+        """Return node which calculates the histogram."""
+        return self.generator.node
+
     def saveToFile(self, fileobj, name):
         """Save dataset and its counterpart to a file."""
         self.generator.saveToFile(fileobj)
@@ -28,6 +28,8 @@ from ..compat import czip, crange, citems, cbasestr, cstr
 from .. import qtall as qt4
 from .. import utils
 from .. import setting
+from . import dependencies
+from . import expressions
 
 def _(text, disambiguation=None, context="Datasets"):
     """Translate text."""
@@ -151,6 +153,10 @@ class DatasetBase(object):
     # changeset
     isstable = False
 
+    # whether the values are calculated from other datasets or the
+    # document, so can change without the dataset being set again
+    isderived = False
+
     def __init__(self, linked=None):
         """Initialise common members."""
         # document member set when this dataset is set in document
@@ -162,6 +168,11 @@ class DatasetBase(object):
         # tags applied to dataset
         self.tags = set()
 
+    def dependencyNode(self):
+        """Return the DependencyNode which calculates this dataset,
+        or None if there is none."""
+        return None
+
     def saveLinksToSavedDoc(self, fileobj, savedlinks, relpath=None):
         '''Save the link to the saved document, if this dataset is linked.
 
@@ -209,6 +220,10 @@ class DatasetBase(object):
     def uiDataItemToData(self, val):
         """Return val converted to data."""
         return float(val)
+
+    def uiDataItemsToData(self, vals):
+        """Return a list of vals converted to data."""
+        return [self.uiDataItemToData(v) for v in vals]
     
     def _getItemHelper(self, key):
         """Help get arguments to constructor."""
@@ -507,10 +522,15 @@ class Dataset(DatasetBase):
         '''Is the data defined?'''
         return self.data is None or len(self.data) == 0
 
-    def changeValues(self, thetype, vals):
+    def uiDataItemsToData(self, vals):
+        """Return a list of vals converted to data."""
+        return N.asarray(vals, dtype=N.float64).tolist()
+
+    def changeValues(self, thetype, vals, rows=None):
         """Change the requested part of the dataset to vals.
 
         thetype == data | serr | perr | nerr
+        rows is an optional (start, stop) range of rows changed
         """
         self._invalidpoints = None
         if thetype in self.columns:
@@ -524,7 +544,7 @@ class Dataset(DatasetBase):
             assert x is None or x.shape == s
 
         # tell the document that we've changed
-        self.document.modifiedData(self)
+        self.document.modifiedData(self, rows=rows)
 
     def saveToFile(self, fileobj, name):
         '''Save data to file.
@@ -637,6 +657,10 @@ class DatasetDateTime(Dataset):
         """Return val converted to data."""
         return utils.dateFloatToString(val)
 
+    def uiDataItemsToData(self, vals):
+        """Return a list of vals converted to data."""
+        return utils.dateFloatsToStrings(vals)
+
     def saveToFile(self, fileobj, name):
         '''Save data to file.
         '''
@@ -686,13 +710,13 @@ class DatasetText(DatasetBase):
         """Size of dataset."""
         return str( len(self.data) )
 
-    def changeValues(self, type, vals):
+    def changeValues(self, type, vals, rows=None):
         if type == 'data':
             self.data = list(vals)
         else:
             raise ValueError('type does not contain an allowed value')
 
-        self.document.modifiedData(self)
+        self.document.modifiedData(self, rows=rows)
     
     def uiConvertToDataItem(self, val):
         """Return a value cast to this dataset data type."""
@@ -760,17 +784,17 @@ dataexpr_split_re = re.compile(r'(`.*?`|[\.+\-*/\(\)\[\],<>=!|%^~& ])')
 dataexpr_quote_re = re.compile(r'^`.*`$')
 dataexpr_columns = {'data':True, 'serr':True, 'perr':True, 'nerr':True}
 
-def _substituteDatasets(datasets, expression, thispart):
-    """Substitute the names of datasets with calls to a function which will
-    evaluate them.
+def _datasetReferences(datasets, expression, thispart):
+    """Find the names of datasets in an expression.
 
-    Returns (new expression, list of substituted datasets)
+    Returns (list of bits of split expression, list of (index of
+    bit, dataset name, part))
     """
 
     # split apart the expression to look for dataset names
     bits = dataexpr_split_re.split(expression)
 
-    dslist = []
+    refs = []
     for i, bit in enumerate(bits):
         # test whether there's an _data, _serr or such at the end of the name
         part = thispart
@@ -786,11 +810,71 @@ def _substituteDatasets(datasets, expression, thispart):
             bit = '_'.join(bitbits)
 
         if bit in datasets:
-            # replace name with a function to call
-            bits[i] = "_DS_(%s, %s)" % (repr(bit), repr(part))
-            dslist.append(bit)
+            refs.append( (i, bit, part) )
 
-    return ''.join(bits), dslist
+    return bits, refs
+
+def _substituteDatasets(datasets, expression, thispart):
+    """Substitute the names of datasets with calls to a function which will
+    evaluate them.
+
+    Returns (new expression, list of substituted datasets)
+    """
+
+    bits, refs = _datasetReferences(datasets, expression, thispart)
+    for i, name, part in refs:
+        # replace name with a function to call
+        bits[i] = "_DS_(%s, %s)" % (repr(name), repr(part))
+    return ''.join(bits), [r[1] for r in refs]
+
+def _expressionPlan(doc, expression, thispart, extranames=()):
+    """Return a plan to evaluate expression, where dataset names
+    are replaced by variables.
+
+    extranames are the names of any other variables to bind.
+    Returns (plan, list of (variable, dataset name, part)), or
+    (None, None) if the expression is invalid.
+    """
+
+    bits, refs = _datasetReferences(doc.data, expression, thispart)
+
+    # check the expression is safe (logging any errors)
+    checkbits = list(bits)
+    for i, name, part in refs:
+        checkbits[i] = "_DS_(%s, %s)" % (repr(name), repr(part))
+    if doc.compileCheckedExpression(
+        ''.join(checkbits), origexpr=expression) is None:
+        return None, None
+
+    variables = []
+    for i, name, part in refs:
+        bits[i] = expressions.datasetVariable(name, part)
+        variables.append( (bits[i], name, part) )
+
+    plan = doc.exprengine.plan(
+        ''.join(bits), [v[0] for v in variables] + list(extranames))
+    return plan, variables
+
+def _evaluatePlan(doc, plan, variables, extravalues=None):
+    """Evaluate plan, binding the variables to the datasets.
+    extravalues is a dict of values of any other variables."""
+
+    values = dict(extravalues or {})
+    versions = {}
+    for var, name, part in variables:
+        values[var] = _evaluateDataset(doc.data, name, part)
+        versions[var] = doc.datachangesets.get(name)
+    return plan.evaluate(values, versions)
+
+class _AnyName(object):
+    """Container which contains every name."""
+    def __contains__(self, name):
+        return True
+
+def expressionDatasetNames(expression, part='data'):
+    """Return list of names in expression which could be datasets,
+    whether or not they currently exist."""
+    return _substituteDatasets(_AnyName(), expression, part)[1]
 
 def _evaluateDataset(datasets, dsname, dspart):
     """Return the dataset given.
@@ -908,22 +992,16 @@ def evalDatasetExpression(doc, origexpr, datatype='numeric',
         # ignore blank names
         return None
 
-    # replace dataset names by calls to _DS_(name,part)
-    expr, subdatasets = _substituteDatasets(doc.data, origexpr, part)
-
-    comp = doc.compileCheckedExpression(expr, origexpr=origexpr)
-    if comp is None:
+    # replace dataset names by variables
+    plan, variables = _expressionPlan(doc, origexpr, part)
+    if plan is None:
         return
-
-    # set up environment for evaluation
-    env = doc.eval_context.copy()
-    def doeval(dsname, dspart):
-        return _evaluateDataset(doc.data, dsname, dspart)
-    env['_DS_'] = doeval
+    subdatasets = [v[1] for v in variables]
 
     # do evaluation
     try:
-        evalout = eval(comp, env)
+        with utils.profiler.record('expression', origexpr):
+            evalout = _evaluatePlan(doc, plan, variables)
     except Exception as ex:
         doc.log("Error evaluating '%s': '%s'" % (origexpr, cstr(ex)))
         return None
@@ -945,6 +1023,7 @@ class DatasetExpression(Dataset):
     """A dataset which is linked to another dataset by an expression."""
 
     dstype = _('Expression')
+    isderived = True
 
     def __init__(self, data=None, serr=None, nerr=None, perr=None,
                  parametric=None):
@@ -963,8 +1042,24 @@ class DatasetExpression(Dataset):
         self.expr['perr'] = perr
         self.parametric = parametric
 
-        self.docchangeset = -1
         self.evaluated = {}
+        self.evaluatedok = True
+        self.node = dependencies.DependencyNode(
+            self._inputDatasets, self._evaluateParts,
+            descr=_('Expression %s') % data)
+
+    def dependencyNode(self):
+        """Return node which evaluates the dataset."""
+        return self.node
+
+    def _inputDatasets(self):
+        """Return names of datasets used in expressions."""
+        names = set()
+        for part in self.columns:
+            expr = self.expr[part]
+            if expr is not None and expr.strip() != '':
+                names.update(expressionDatasetNames(expr, part))
+        return sorted(names)
 
     def editable(self):
         """Is the dataset editable?"""
@@ -978,37 +1073,17 @@ class DatasetExpression(Dataset):
         """
         return _evaluateDataset(self.document.data, dsname, dspart)
 
-    def _evaluatePart(self, expr, part):
-        """Evaluate expression expr for part part.
+    def _evaluatePart(self, expr, part, plan, variables, extravalues):
+        """Evaluate expression expr for part part, using plan.
 
         Returns True if succeeded
         """
-        # replace dataset names with calls
-        newexpr = _substituteDatasets(self.document.data, expr, part)[0]
-
-        comp = self.document.compileCheckedExpression(newexpr, origexpr=expr)
-        if comp is None:
-            return False
-
-        # set up environment to evaluate expressions in
-        environment = self.document.eval_context.copy()
-
-        # create dataset using parametric expression
-        if self.parametric:
-            p = self.parametric
-            if p[2] >= 2:
-                deltat = (p[1]-p[0]) / (p[2]-1)
-                t = N.arange(p[2])*deltat + p[0]
-            else:
-                t = N.array([p[0]])
-            environment['t'] = t
-
-        # this fn gets called to return the value of a dataset
-        environment['_DS_'] = self.evaluateDataset
 
         # actually evaluate the expression
         try:
-            result = eval(comp, environment)
+            with utils.profiler.record('expression', expr):
+                result = _evaluatePlan(self.document, plan, variables,
+                                       extravalues)
             evalout = N.array(result, N.float64)
 
             if len(evalout.shape) > 1:
@@ -1038,27 +1113,50 @@ class DatasetExpression(Dataset):
         self.evaluated[part] = evalout
         return True
 
-    def updateEvaluation(self):
-        """Update evaluation of parts of dataset.
+    def _evaluateParts(self):
+        """Evaluate all the parts of the dataset."""
 
-        Returns False if problem with any evaluation
-        """
-        ok = True
-        if self.docchangeset != self.document.changeset:
-            # avoid infinite recursion!
-            self.docchangeset = self.document.changeset
+        # zero out previous values
+        for part in self.columns:
+            self.evaluated[part] = None
 
-            # zero out previous values
-            for part in self.columns:
-                self.evaluated[part] = None
+        # create dataset using parametric expression
+        extravalues = {}
+        if self.parametric:
+            p = self.parametric
+            if p[2] >= 2:
+                deltat = (p[1]-p[0]) / (p[2]-1)
+                t = N.arange(p[2])*deltat + p[0]
+            else:
+                t = N.array([p[0]])
+            extravalues['t'] = t
+
+        # make the plans for all the parts before evaluating, so
+        # that subexpressions are shared between parts
+        plans = {}
+        for part in self.columns:
+            expr = self.expr[part]
+            if expr is not None and expr.strip() != '':
+                plans[part] = _expressionPlan(
+                    self.document, expr, part, extranames=list(extravalues))
+
+        # update all parts
+        ok = True
+        for part in self.columns:
+            if part in plans:
+                plan, variables = plans[part]
+                ok = ok and plan is not None and self._evaluatePart(
+                    self.expr[part], part, plan, variables, extravalues)
+        self.evaluatedok = ok
 
-            # update all parts
-            for part in self.columns:
-                expr = self.expr[part]
-                if expr is not None and expr.strip() != '':
-                    ok = ok and self._evaluatePart(expr, part)
+    def updateEvaluation(self):
+        """Update evaluation of parts of dataset, if the datasets
+        used in the expressions have changed.
 
-        return ok
+        Returns False if problem with any evaluation
+        """
+        self.node.update(self.document)
+        return self.evaluatedok
 
     def _propValues(self, part):
         """Check whether expressions need reevaluating,
@@ -1246,6 +1344,7 @@ class Dataset2DXYZExpression(Dataset2D):
     '''A 2d dataset with expressions for x, y and z.'''
 
     dstype = _('2D XYZ')
+    isderived = True
 
     def __init__(self, exprx, expry, exprz):
         """Initialise dataset.
@@ -1283,25 +1382,21 @@ class Dataset2DXYZExpression(Dataset2D):
 
         evaluated = {}
 
-        environment = self.document.eval_context.copy()
-        environment['_DS_'] = self.evaluateDataset
-
         # evaluate the x, y and z expressions
+        plans = {}
         for name in ('exprx', 'expry', 'exprz'):
-            origexpr = getattr(self, name)
-            expr = _substituteDatasets(self.document.data, origexpr,
-                                       'data')[0]
-
-            comp = self.document.compileCheckedExpression(
-                expr, origexpr=origexpr)
-            if comp is None:
+            plans[name] = _expressionPlan(
+                self.document, getattr(self, name), 'data')
+            if plans[name][0] is None:
                 return None
 
+        for name in ('exprx', 'expry', 'exprz'):
             try:
-                evaluated[name] = eval(comp, environment)
+                evaluated[name] = _evaluatePlan(self.document, *plans[name])
             except Exception as e:
                 self.document.log(_("Error evaluating expression: %s\n"
-                                    "Error: %s") % (expr, cstr(e)) )
+                                    "Error: %s") % (getattr(self, name),
+                                                     cstr(e)) )
                 return None
 
         minx, maxx, stepx, stepsx = getSpacing(evaluated['exprx'])
@@ -1379,6 +1474,7 @@ class Dataset2DExpression(Dataset2D):
     """Evaluate an expression of 2d datasets."""
 
     dstype = _('2D Expr')
+    isderived = True
 
     def __init__(self, expr):
         """Create 2d expression dataset."""
@@ -1440,6 +1536,7 @@ class Dataset2DXYFunc(Dataset2D):
     """
 
     dstype = _('2D f(x,y)')
+    isderived = True
 
     def __init__(self, xstep, ystep, expr):
         """Create 2d dataset:
@@ -1527,6 +1624,8 @@ class Dataset2DXYFunc(Dataset2D):
 class _DatasetPlugin(object):
     """Shared methods for dataset plugins."""
 
+    isderived = True
+
     def __init__(self, manager, ds):
         self.pluginmanager = manager
         self.pluginds = ds
@@ -1535,6 +1634,10 @@ class _DatasetPlugin(object):
         self.pluginmanager.update()
         return getattr(self.pluginds, attr)
 
+    def dependencyNode(self):
+        """Return node which runs the plugin."""
+        return self.pluginmanager.node
+
     def linkedInformation(self):
         """Return information about how this dataset was created."""
 
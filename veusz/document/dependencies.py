@@ -0,0 +1,319 @@
+#    Copyright (C) 2014 Jeremy S. Sanders
+#    Email: Jeremy Sanders <jeremy@jeremysanders.net>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Track dependencies between datasets calculated from other datasets.
+
+Dataset plugins and dataset expressions are nodes in a graph, with
+edges from the datasets they read. A node is only recalculated when
+the version of one of its inputs (or the custom definitions) has
+changed. Updating a node first updates the nodes it reads from, so
+stale nodes are recalculated in topological order.
+
+updateNodes() recalculates the stale nodes of a document, running
+independent branches of the graph in parallel threads.
+"""
+
+from __future__ import division
+import time
+import threading
+import multiprocessing
+
+from ..compat import citems, cvalues, cqueue, crange
+from .. import utils
+
+# threads updating each node, and nodes each thread is waiting to
+# update, to find out if waiting would deadlock
+_waitlock = threading.Lock()
+_updatingthread = {}
+_waitingnode = {}
+
+def _waitWouldDeadlock(node, thread):
+    """Would thread waiting to update node wait for itself?
+    _waitlock should be held."""
+    while True:
+        owner = _updatingthread.get(node)
+        if owner is None:
+            return False
+        if owner is thread:
+            return True
+        node = _waitingnode.get(owner)
+        if node is None:
+            return False
+
+class DependencyNode(object):
+    """A calculation of datasets from other datasets.
+
+    inputsfn() returns a list of names of datasets read by the
+    calculation, or None if it could read any dataset.
+    calcfn() does the calculation.
+    """
+
+    def __init__(self, inputsfn, calcfn, descr=''):
+        self.inputsfn = inputsfn
+        self.calcfn = calcfn
+        self.descr = descr
+
+        # state of inputs when last calculated
+        self.inputstate = None
+        # increased when outputs are recalculated
+        self.version = 0
+        # whether being calculated (to stop recursion)
+        self.calculating = False
+        self.lock = threading.RLock()
+
+        # timing information
+        self.numcalcs = 0
+        self.lasttime = 0.
+        self.totaltime = 0.
+
+    def inputNames(self, document):
+        """Return names of datasets read by node."""
+        names = self.inputsfn()
+        if names is None:
+            names = sorted(document.data)
+        return names
+
+    def inputNodes(self, document):
+        """Return nodes of datasets read by node."""
+        nodes = []
+        for name in self.inputNames(document):
+            ds = document.data.get(name)
+            node = None if ds is None else ds.dependencyNode()
+            if node is not None and node is not self and node not in nodes:
+                nodes.append(node)
+        return nodes
+
+    def inputState(self, document, update=True):
+        """Return state of inputs to node.
+
+        If update is set, stale input nodes are updated first."""
+        state = [document.evalcontextchangeset]
+        for name in self.inputNames(document):
+            state.append( (name, datasetVersion(document, name,
+                                                update=update)) )
+        return tuple(state)
+
+    def isStale(self, document):
+        """Does the node need recalculating, ignoring stale inputs?"""
+        return self.inputState(document, update=False) != self.inputstate
+
+    def update(self, document):
+        """Recalculate node if its inputs have changed.
+        Returns True if recalculated."""
+
+        thread = threading.current_thread()
+        with _waitlock:
+            if _updatingthread.get(self) is not thread:
+                if _waitWouldDeadlock(self, thread):
+                    # nodes being updated in other threads read each
+                    # other, so treat as a node depending on itself
+                    return False
+                _waitingnode[thread] = self
+        with self.lock:
+            with _waitlock:
+                _waitingnode.pop(thread, None)
+                # set unless this thread is already updating the node
+                first = self not in _updatingthread
+                _updatingthread[self] = thread
+            try:
+                return self._update(document)
+            finally:
+                if first:
+                    with _waitlock:
+                        del _updatingthread[self]
+
+    def _update(self, document):
+        """Recalculate node, holding its lock."""
+
+        if self.calculating:
+            # node depends on itself
+            return False
+        self.calculating = True
+        try:
+            state = self.inputState(document)
+            if state == self.inputstate:
+                return False
+
+            self.inputstate = state
+            start = time.time()
+            try:
+                with utils.profiler.record('dataset', self.descr):
+                    self.calcfn()
+            except:
+                self.inputstate = None
+                raise
+            finally:
+                self.version += 1
+                self.numcalcs += 1
+                self.lasttime = time.time() - start
+                self.totaltime += self.lasttime
+
+            # the inputs may only be known after calculation
+            self.inputstate = self.inputState(document)
+            return True
+        finally:
+            self.calculating = False
+
+def datasetVersion(document, name, update=True):
+    """Return a value which changes when the values of dataset name do.
+
+    If update is set and the dataset is calculated by a node, the
+    node is updated first."""
+
+    version = document.datachangesets.get(name)
+    ds = document.data.get(name)
+    if ds is not None and ds.isderived:
+        node = ds.dependencyNode()
+        if node is None:
+            # no dependency information, so assume anything can change it
+            return (version, document.changeset)
+        if update:
+            node.update(document)
+        return (version, node.version)
+    return version
+
+def changedDatasets(document, names):
+    """Return the set of names of datasets which change if the
+    datasets names change, including those calculated from them."""
+
+    changed = set(names)
+    derived = [ (n, ds) for n, ds in citems(document.data) if ds.isderived ]
+    added = True
+    while added:
+        added = False
+        for name, ds in derived:
+            if name in changed:
+                continue
+            node = ds.dependencyNode()
+            if node is None or changed.intersection(
+                node.inputNames(document)):
+                changed.add(name)
+                added = True
+    return changed
+
+def documentNodes(document):
+    """Return a list of the nodes for datasets in the document."""
+    nodes = []
+    seen = set()
+    for ds in cvalues(document.data):
+        node = ds.dependencyNode()
+        if node is not None and id(node) not in seen:
+            seen.add(id(node))
+            nodes.append(node)
+    return nodes
+
+def updateNodes(document, numthreads=None):
+    """Recalculate stale nodes in document.
+
+    Nodes are run in parallel by up to numthreads threads (default
+    is the number of CPUs) once the nodes they read from are up to
+    date. Messages logged by nodes are sent when all have finished.
+    """
+
+    nodes = documentNodes(document)
+
+    # work out which nodes are stale, including those with stale inputs
+    inputs = {}
+    for node in nodes:
+        inputs[node] = [n for n in node.inputNodes(document) if n in nodes]
+    stale = set()
+    def checkstale(node, visiting):
+        if node in stale:
+            return True
+        if node in visiting:
+            return False
+        visiting.add(node)
+        isstale = node.isStale(document)
+        for n in inputs[node]:
+            isstale = checkstale(n, visiting) or isstale
+        if isstale:
+            stale.add(node)
+        return isstale
+    for node in nodes:
+        checkstale(node, set())
+
+    if len(stale) < 2:
+        # nothing to gain from threads, so update lazily
+        return
+
+    # number of stale inputs waiting for each node, and reverse links
+    waiting = {}
+    outputs = dict([(node, []) for node in stale])
+    for node in stale:
+        ins = [n for n in inputs[node] if n in stale and n is not node]
+        waiting[node] = len(ins)
+        for n in ins:
+            outputs[n].append(node)
+
+    if numthreads is None:
+        numthreads = multiprocessing.cpu_count()
+    numthreads = max(1, min(numthreads, len(stale)))
+
+    ready = cqueue.Queue()
+    for node in stale:
+        if waiting[node] == 0:
+            ready.put(node)
+    done = cqueue.Queue()
+
+    def worker():
+        while True:
+            node = ready.get()
+            if node is None:
+                return
+            try:
+                node.update(document)
+            except Exception:
+                # errors are reported when the data are next used
+                pass
+            done.put(node)
+
+    document.deferLog(True)
+    threads = [threading.Thread(target=worker) for i in crange(numthreads)]
+    try:
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        # release nodes when their inputs are done
+        remaining = set(stale)
+        while remaining:
+            try:
+                node = done.get(timeout=0.1)
+            except cqueue.Empty:
+                if ready.empty() and all(
+                    [waiting[n] > 0 for n in remaining]):
+                    # a cycle in the graph, so leave the rest to be lazy
+                    break
+                continue
+            remaining.discard(node)
+            for n in outputs[node]:
+                waiting[n] -= 1
+                if waiting[n] == 0:
+                    ready.put(n)
+    finally:
+        for t in threads:
+            ready.put(None)
+        for t in threads:
+            t.join()
+        document.deferLog(False)
+
+def nodeTimings(document):
+    """Return a list of (description, number of calculations,
+    last time, total time) for nodes in document."""
+    return [ (n.descr, n.numcalcs, n.lasttime, n.totaltime)
+             for n in documentNodes(document) ]
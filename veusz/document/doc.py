@@ -24,18 +24,22 @@
 from __future__ import division
 import os.path
 import re
+import ast
 import traceback
 import datetime
 from collections import defaultdict
 
 import numpy as N
 
-from ..compat import crange, citems, cvalues, cstr, cexec
+from ..compat import crange, citems, cvalues, cstr, cexec, cbasestr
 from .. import qtall as qt4
 
 from . import widgetfactory
 from . import datasets
 from . import painthelper
+from . import linked
+from . import dependencies
+from . import expressions
 
 from .. import utils
 from .. import setting
@@ -62,6 +66,82 @@ function_re = re.compile(r'''
 (?: [ ]* ,? [ ]* \*\*[A-Za-z_][A-Za-z0-9_]* )? # **kwargs
 )\)$                           # endargs''', re.VERBOSE)
 
+def _historyMemorySize(obj, seen):
+    """Estimate number of bytes kept alive by an operation in the undo
+    history (obj), ignoring objects with ids in set seen.
+
+    Only datasets, numpy arrays, strings, containers and operations
+    are followed, so references to the document are not counted."""
+
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, N.ndarray):
+        return obj.nbytes
+    elif isinstance(obj, cbasestr):
+        return len(obj)
+    elif isinstance(obj, (list, tuple)):
+        return sum([_historyMemorySize(o, seen) for o in obj])
+    elif isinstance(obj, dict):
+        return sum([_historyMemorySize(o, seen) for o in cvalues(obj)])
+    elif ( isinstance(obj, datasets.DatasetBase) or
+           (hasattr(obj, 'do') and hasattr(obj, 'undo')) ):
+        # datasets and operations: look at their attributes
+        return sum([_historyMemorySize(o, seen)
+                    for o in cvalues(getattr(obj, '__dict__', {}))])
+    return 0
+
+_numpycontext = []
+def _numpyContext():
+    """Return dict of the numpy functions and constants available in
+    expressions. This is only built once, as numpy is large."""
+
+    if not _numpycontext:
+        # we try to avoid various bits and pieces for safety
+        c = {}
+        for name, val in citems(N.__dict__):
+            if ( (callable(val) or type(val)==float) and
+                 name not in __builtins__ and
+                 name[:1] != '_' and name[-1:] != '_' ):
+                c[name] = val
+        _numpycontext.append(c)
+    return _numpycontext[0]
+
+_pluginregistrycache = {}
+def _pluginRegistries(filename):
+    """Return set of plugin registries a plugin file adds to, found
+    without running it. None is returned if these are unknown."""
+
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError:
+        return None
+    cached = _pluginregistrycache.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        tree = ast.parse(open(filename).read(), filename)
+    except Exception:
+        # report errors when the plugin is run
+        return None
+    registries = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            name = node.id
+        elif isinstance(node, ast.Attribute):
+            name = node.attr
+        else:
+            continue
+        if name.endswith('pluginregistry'):
+            registries.add(name)
+    if not registries:
+        registries = None
+
+    _pluginregistrycache[filename] = (mtime, registries)
+    return registries
+
 def getSuitableParent(widgettype, initialwidget):
     """Find the nearest relevant parent for the widgettype given."""
 
@@ -73,29 +153,101 @@ def getSuitableParent(widgettype, initialwidget):
         parent = parent.parent
     return parent
 
+class DocumentChanges(object):
+    """Changes made to a document between sigChanges signals.
+
+    everything: True if changes were not described, so everything
+                should be updated
+    datasets: dict of changed dataset names to a list of (start, stop)
+              row ranges changed, or None if the whole dataset changed
+    settings: set of paths of changed settings
+    widgets: set of paths of widgets with changed settings
+
+    Note that changes to datasets and settings may affect datasets
+    and widgets which depend on them.
+    """
+
+    # after this many row ranges, treat the whole dataset as changed
+    maxranges = 64
+
+    def __init__(self):
+        self.everything = False
+        self.datasets = {}
+        self.settings = set()
+        self.widgets = set()
+
+    def isEmpty(self):
+        """Have no changes been made?"""
+        return not ( self.everything or self.datasets or self.settings )
+
+    def addDataset(self, name, rows=None):
+        """Note dataset name changed, optionally only (start, stop) rows."""
+        if rows is None:
+            self.datasets[name] = None
+        elif name not in self.datasets:
+            self.datasets[name] = [rows]
+        else:
+            ranges = self.datasets[name]
+            if ranges is not None:
+                ranges.append(rows)
+                if len(ranges) > self.maxranges:
+                    self.datasets[name] = None
+
+    def changedRows(self, names):
+        """If only rows in datasets with names have been changed,
+        return a (start, stop) range covering them, else None."""
+
+        if self.everything or self.settings or not self.datasets:
+            return None
+        start = stop = None
+        for name, ranges in citems(self.datasets):
+            if ranges is None or name not in names:
+                return None
+            for r in ranges:
+                start = r[0] if start is None else min(start, r[0])
+                stop = r[1] if stop is None else max(stop, r[1])
+        return start, stop
+
 class Document( qt4.QObject ):
     """Document class for holding the graph data.
 
     Emits: sigModified when the document has been modified
            sigWiped when document is wiped
+           sigChanges(DocumentChanges) with a summary of the changes
+             made, once per event loop iteration
     """
 
-    pluginsloaded = False
+    # plugin files from the settings which have been run
+    pluginsrun = set()
+    # have plugins adding to unknown registries been run?
+    unknownpluginsrun = False
 
     def __init__(self):
         """Initialise the document."""
         qt4.QObject.__init__( self )
 
-        if not Document.pluginsloaded:
-            Document.loadPlugins()
-            Document.pluginsloaded = True
+        # these plugins may add widget types, for example
+        if not Document.unknownpluginsrun:
+            Document.unknownpluginsrun = True
+            Document.loadPlugins(registry='')
 
         # change tracking of document as a whole
         self.changeset = 0            # increased when the document changes
 
         # change tracking of datasets
         self.datachangeset = 0        # increased whan any dataset changes
-        self.datachangesets = dict()  # each ds has an associated change set
+        # each ds has an associated change set, set to datachangeset
+        # when it changes, so it is never reused by another dataset
+        self.datachangesets = dict()
+
+        # changes to send in next sigChanges
+        self.pendingchanges = DocumentChanges()
+        # have changes been described since the last setModified?
+        self.changenoted = False
+        self.changetimer = qt4.QTimer(self)
+        self.changetimer.setSingleShot(True)
+        self.connect(self.changetimer, qt4.SIGNAL('timeout()'),
+                     self.slotSendChanges)
 
         # map tags to dataset names
         self.datasettags = defaultdict(list)
@@ -113,6 +265,12 @@ class Document( qt4.QObject ):
         # directories to examine when importing
         self.importpath = []
 
+        # log messages held back while datasets update in threads
+        self.deferredlog = None
+
+        # increased when the evaluation context changes
+        self.evalcontextchangeset = 0
+
         # store custom functions and constants
         # consists of tuples of (name, type, value)
         # type is constant or function
@@ -128,12 +286,18 @@ class Document( qt4.QObject ):
         self.exprfailed = set()
         self.exprfailedchangeset = -1
 
+        # plans of dataset expressions and cached subexpressions
+        self.exprengine = expressions.ExpressionEngine(self)
+
     def wipe(self):
         """Wipe out any stored data."""
         self.data = {}
+        # cache of full paths to widgets and settings
+        self.pathcache = {}
         self.basewidget = widgetfactory.thefactory.makeWidget(
             'document', None, None)
         self.basewidget.document = self
+        self.noteAllChanged()
         self.setModified(False)
         self.emit( qt4.SIGNAL("sigWiped") )
 
@@ -142,7 +306,42 @@ class Document( qt4.QObject ):
         self.historybatch = []
         self.historyundo = []
         self.historyredo = []
-        
+        # estimated memory used by each item in historyundo
+        self.historyundosizes = []
+
+    def operationMemorySize(self, operation):
+        """Estimate the memory in bytes used by an operation which
+        is not shared with the current datasets in the document."""
+
+        seen = set()
+        for ds in cvalues(self.data):
+            seen.add(id(ds))
+            for val in cvalues(ds.__dict__):
+                if isinstance(val, N.ndarray):
+                    seen.add(id(val))
+        return _historyMemorySize(operation, seen)
+
+    def _pushHistory(self, operation):
+        """Add operation to undo history, removing old entries
+        if there are too many or they use too much memory."""
+
+        self.historyundo.append(operation)
+        self.historyundosizes.append(self.operationMemorySize(operation))
+
+        maxsteps = max(1, setting.settingdb['undo_steps'])
+        maxsize = setting.settingdb['undo_memory_limit']*1024*1024
+
+        # always keep the most recent operation
+        while len(self.historyundo) > 1 and (
+                len(self.historyundo) > maxsteps or
+                sum(self.historyundosizes) > maxsize ):
+            del self.historyundo[0]
+            del self.historyundosizes[0]
+
+    def historyMemorySize(self):
+        """Return estimated memory used by undo history in bytes."""
+        return sum(self.historyundosizes)
+
     def suspendUpdates(self):
         """Holds sending update messages.
         This speeds up modification of the document and prevents the document
@@ -155,6 +354,8 @@ class Document( qt4.QObject ):
         if len(self.suspendupdates) == 0 and changeset != self.changeset:
             # bump this up as some watchers might ignore this otherwise
             self.changeset += 1
+            # changes made were recorded when they happened
+            self.changenoted = True
             self.setModified()
 
     def makeDefaultDoc(self):
@@ -167,7 +368,20 @@ class Document( qt4.QObject ):
 
     def log(self, message):
         """Log a message - this is emitted as a signal."""
-        self.emit( qt4.SIGNAL("sigLog"), message )
+        if self.deferredlog is not None:
+            self.deferredlog.append(message)
+        else:
+            self.emit( qt4.SIGNAL("sigLog"), message )
+
+    def deferLog(self, defer):
+        """If defer is True, hold back log messages until called with
+        False. This is used when messages may come from other threads."""
+        if defer:
+            self.deferredlog = []
+        else:
+            messages, self.deferredlog = self.deferredlog, None
+            for message in messages:
+                self.log(message)
 
     def applyOperation(self, operation):
         """Apply operation to the document.
@@ -180,9 +394,14 @@ class Document( qt4.QObject ):
 
         self.suspendUpdates()
         try:
-            retn = operation.do(self)
+            with utils.profiler.record(
+                'operation', getattr(operation, 'descr', '')):
+                retn = operation.do(self)
             self.changeset += 1
+            if not getattr(operation, 'describeschanges', False):
+                self.noteAllChanged()
         except:
+            self.noteAllChanged()
             self.enableUpdates()
             raise
         self.enableUpdates()
@@ -192,7 +411,7 @@ class Document( qt4.QObject ):
             self.historybatch[-1].addOperation(operation)
         else:
             # standard mode
-            self.historyundo = self.historyundo[-9:] + [operation]
+            self._pushHistory(operation)
         self.historyredo = []
 
         return retn
@@ -216,11 +435,15 @@ class Document( qt4.QObject ):
         """Undo the previous operation."""
 
         operation = self.historyundo.pop()
+        self.historyundosizes.pop()
         self.suspendUpdates()
         try:
             operation.undo(self)
             self.changeset += 1
+            if not getattr(operation, 'describeschanges', False):
+                self.noteAllChanged()
         except:
+            self.noteAllChanged()
             self.enableUpdates()
             raise
         self.enableUpdates()
@@ -241,33 +464,40 @@ class Document( qt4.QObject ):
         
     def resolveFullWidgetPath(self, path):
         """Translate the widget path given into the widget."""
-        
+
+        key = ('widget', path)
+        try:
+            return self.pathcache[key]
+        except KeyError:
+            pass
+
         widget = self.basewidget
         for p in [i for i in path.split('/') if i != '']:
-            for child in widget.children:
-                if p == child.name:
-                    widget = child
-                    break
-            else:
-                # break wasn't called
-                assert False
+            widget = widget.getChild(p)
+            assert widget is not None
+
+        self.pathcache[key] = widget
         return widget
         
     def resolveFullSettingPath(self, path):
         """Translate setting path into setting object."""
 
+        key = ('setting', path)
+        try:
+            return self.pathcache[key]
+        except KeyError:
+            pass
+
         # find appropriate widget
         widget = self.basewidget
         parts = [i for i in path.split('/') if i != '']
         while len(parts) > 0:
-            for child in widget.children:
-                if parts[0] == child.name:
-                    widget = child
-                    del parts[0]
-                    break
-            else:
+            child = widget.getChild(parts[0])
+            if child is None:
                 # no child with name
                 break
+            widget = child
+            del parts[0]
             
         # get Setting object
         s = widget.settings
@@ -276,6 +506,7 @@ class Document( qt4.QObject ):
             del parts[0]
             
         assert isinstance(s, setting.Setting)
+        self.pathcache[key] = s
         return s
 
     def isBlank(self):
@@ -288,10 +519,15 @@ class Document( qt4.QObject ):
         dataset.document = self
         
         # update the change tracking
-        cs = self.datachangesets.get(name, 0)
-        self.datachangesets[name] = cs + 1
-        self.datachangeset += 1
+        self._newDataChangeset(name)
         self.setModified()
+
+    def _newDataChangeset(self, name, rows=None):
+        """Record that dataset name has changed, optionally only
+        (start, stop) rows."""
+        self.datachangeset += 1
+        self.datachangesets[name] = self.datachangeset
+        self.noteDatasetChange(name, rows=rows)
     
     def deleteData(self, name):
         """Remove a dataset"""
@@ -299,16 +535,15 @@ class Document( qt4.QObject ):
             del self.data[name]
             
             # don't remove the changeset tracker, in case this action is later undone
-            self.datachangesets[name] += 1
-            self.datachangeset += 1
+            self._newDataChangeset(name)
             self.setModified()
 
-    def modifiedData(self, dataset):
-        """The named dataset was modified"""
+    def modifiedData(self, dataset, rows=None):
+        """The named dataset was modified.
+        rows is an optional (start, stop) range of rows modified."""
         for name, ds in citems(self.data):
             if ds is dataset:
-                self.datachangesets[name] += 1
-                self.datachangeset += 1
+                self._newDataChangeset(name, rows=rows)
                 self.setModified()
 
     def getLinkedFiles(self, filenames=None):
@@ -322,10 +557,18 @@ class Document( qt4.QObject ):
                 links.add(ds.linked)
         return list(links)
 
-    def reloadLinkedDatasets(self, filenames=None):
+    def reloadLinkedDatasets(self, filenames=None, progress=None):
         """Reload linked datasets from their files.
         If filenames is a set(), only reload from these filenames
 
+        The files are read in parallel. progress(numdone, numtotal) is
+        called while reading and can return False to cancel (raising
+        linked.ReloadCancelled).
+
+        This is not used when a document is loaded: its import
+        commands run one after another, as later commands in the
+        document may use the values they return or the datasets read.
+
         Returns a tuple of
         - List of datasets read
         - Dict of tuples containing dataset names and number of errors
@@ -338,10 +581,13 @@ class Document( qt4.QObject ):
 
         # load in the files, merging the vars read and errors
         if links:
-            for lf in links:
-                nread, nerrors = lf.reloadLinks(self)
-                read += nread
-                errors.update(nerrors)
+            self.suspendUpdates()
+            try:
+                read, errors = linked.reloadLinkedFiles(
+                    self, sorted(links, key=lambda lf: lf.filename),
+                    progress=progress)
+            finally:
+                self.enableUpdates()
             self.setModified()
 
         read.sort()
@@ -357,6 +603,7 @@ class Document( qt4.QObject ):
     def deleteDataset(self, name):
         """Remove the selected dataset."""
         del self.data[name]
+        self._newDataChangeset(name)
         self.setModified()
 
     def renameDataset(self, oldname, newname):
@@ -364,9 +611,9 @@ class Document( qt4.QObject ):
         d = self.data[oldname]
         del self.data[oldname]
         self.data[newname] = d
-        # transfer change set to new name
-        self.datachangesets[newname] = self.datachangesets[oldname]
-
+        # both names now refer to different values
+        self._newDataChangeset(oldname)
+        self._newDataChangeset(newname)
         self.setModified()
 
     def getData(self, name):
@@ -387,18 +634,70 @@ class Document( qt4.QObject ):
         self.modified = ismodified
         self.changeset += 1
 
+        # modifications which have not been described
+        if ismodified and not self.changenoted:
+            self.pendingchanges.everything = True
+        self.changenoted = False
+
         if len(self.suspendupdates) == 0:
             self.emit( qt4.SIGNAL("sigModified"), ismodified )
+            # temporary documents (e.g. used in other threads when
+            # reloading) have nobody listening
+            if ( not self.pendingchanges.isEmpty() and
+                 self.receivers(qt4.SIGNAL("sigChanges")) > 0 ):
+                self.changetimer.start(0)
+
+    def noteDatasetChange(self, name, rows=None):
+        """Record that dataset name has changed, optionally only
+        (start, stop) rows, for the next sigChanges."""
+        self.pendingchanges.addDataset(name, rows=rows)
+        self.changenoted = True
+
+    def noteSettingChange(self, setting):
+        """Record that the setting has changed."""
+        self.pendingchanges.settings.add(setting.path)
+        widget = setting.getWidget()
+        if widget is not None:
+            self.pendingchanges.widgets.add(widget.path)
+        self.changenoted = True
+
+    def noteAllChanged(self):
+        """Record that the document has changed in some unknown way."""
+        self.pendingchanges.everything = True
+        self.changenoted = True
+
+    def slotSendChanges(self):
+        """Emit the changes made since the last call."""
+        changes = self.pendingchanges
+        self.pendingchanges = DocumentChanges()
+        if not changes.isEmpty():
+            self.emit( qt4.SIGNAL("sigChanges"), changes )
 
     def isModified(self):
         """Return whether modified flag set."""
         return self.modified
 
     @classmethod
-    def loadPlugins(kls, pluginlist=None):
-        """Load plugins and catch exceptions."""
+    def loadPlugins(kls, pluginlist=None, registry=None):
+        """Load plugins and catch exceptions.
+
+        If pluginlist is None, the plugins in the settings are loaded
+        if they have not been loaded before. These are only loaded
+        when they are needed: if registry is given (e.g.
+        'importpluginregistry'), only the plugins which add to that
+        registry are loaded. If registry is '', only plugins where
+        the registries they add to are unknown are loaded.
+        """
         if pluginlist is None:
-            pluginlist = setting.settingdb.get('plugins', [])
+            pluginlist = []
+            for plugin in setting.settingdb.get('plugins', []):
+                if plugin in kls.pluginsrun:
+                    continue
+                registries = _pluginRegistries(plugin)
+                if ( registry is None or registries is None or
+                     registry in registries ):
+                    kls.pluginsrun.add(plugin)
+                    pluginlist.append(plugin)
 
         for plugin in pluginlist:
             try:
@@ -433,8 +732,19 @@ class Document( qt4.QObject ):
 
     def paintTo(self, painthelper, page):
         """Paint page specified to the paint helper."""
+        self.updateDerivedDatasets()
         self.basewidget.draw(painthelper, page)
 
+    def updateDerivedDatasets(self, numthreads=None):
+        """Recalculate datasets from plugins and expressions if their
+        input datasets have changed, in parallel where possible."""
+        dependencies.updateNodes(self, numthreads=numthreads)
+
+    def derivedDatasetTimings(self):
+        """Return a list of (description, number of calculations,
+        last time, total time) for dataset plugins and expressions."""
+        return dependencies.nodeTimings(self)
+
     def getNumberPages(self):
         """Return the number of pages in the document."""
         return len(self.basewidget.children)
@@ -495,6 +805,18 @@ class Document( qt4.QObject ):
             reldirname = os.path.dirname( os.path.abspath(fileobj.name) )
             fileobj.write('AddImportPath(%s)\n' % repr(reldirname))
 
+        self.saveDocumentText(fileobj, reldirname=reldirname)
+        self.setModified(False)
+
+    def saveDocumentText(self, fileobj, reldirname=None, savedataset=None):
+        """Write the commands representing the document to fileobj.
+
+        This does not write a header or change the modification
+        state, so the output only depends on the document contents.
+        If given, savedataset(fileobj, name, dataset) is called to
+        save each dataset, rather than its saveToFile method.
+        """
+
         # add custom definitions
         self.saveCustomDefinitions(fileobj)
 
@@ -507,15 +829,16 @@ class Document( qt4.QObject ):
 
         # save the remaining datasets
         for name, dataset in sorted(citems(self.data)):
-            dataset.saveToFile(fileobj, name)
+            if savedataset is not None:
+                savedataset(fileobj, name, dataset)
+            else:
+                dataset.saveToFile(fileobj, name)
 
         # save tags of datasets
         self.saveDatasetTags(fileobj)
 
         # save the actual tree structure
         fileobj.write(self.basewidget.getSaveText())
-        
-        self.setModified(False)
 
     def exportStyleSheet(self, fileobj):
         """Export the StyleSheet to a file."""
@@ -825,16 +1148,9 @@ class Document( qt4.QObject ):
         This sets up a safe environment where things can be evaluated
         """
         
-        self.eval_context = c = {}
+        self.eval_context = c = dict(_numpyContext())
+        self.evalcontextchangeset += 1
 
-        # add numpy things
-        # we try to avoid various bits and pieces for safety
-        for name, val in citems(N.__dict__):
-            if ( (callable(val) or type(val)==float) and
-                 name not in __builtins__ and
-                 name[:1] != '_' and name[-1:] != '_' ):
-                c[name] = val
-        
         # safe functions
         c['os_path_join'] = os.path.join
         c['os_path_dirname'] = os.path.dirname
@@ -956,9 +1272,8 @@ class Document( qt4.QObject ):
         if displaydatatype == 'text':
             return vals
         elif displaydatatype == 'numeric':
-            return [ utils.formatNumber(val, '%Vg', locale=self.locale)
-                     for val in vals ]
+            return utils.formatNumbers(vals, '%Vg', locale=self.locale)
         elif displaydatatype == 'date':
-            return [ utils.dateFloatToString(val) for val in vals ]
+            return utils.dateFloatsToStrings(vals)
         else:
             raise RuntimeError('Invalid data type')
@@ -69,7 +69,7 @@ class Export(object):
 
     def __init__(self, doc, filename, pagenumber, color=True, bitmapdpi=100,
                  antialias=True, quality=85, backcolor='#ffffff00',
-                 pdfdpi=150, svgtextastext=False):
+                 pdfdpi=150, svgtextastext=False, cache=None):
         """Initialise export class. Parameters are:
         doc: document to write
         filename: output filename
@@ -81,6 +81,7 @@ class Export(object):
         backcolor: background color default for bitmaps (default transparent).
         pdfdpi: dpi for pdf and eps files
         svgtextastext: write text in SVG as text, rather than curves
+        cache: optional ExportCache to reuse previously exported files
         """
 
         self.doc = doc
@@ -93,12 +94,34 @@ class Export(object):
         self.backcolor = backcolor
         self.pdfdpi = pdfdpi
         self.svgtextastext = svgtextastext
+        self.cache = cache
+
+    def cacheOptions(self):
+        """Options which affect the output, for the cache key."""
+        return {
+            'color': self.color, 'bitmapdpi': self.bitmapdpi,
+            'antialias': self.antialias, 'quality': self.quality,
+            'backcolor': self.backcolor, 'pdfdpi': self.pdfdpi,
+            'svgtextastext': self.svgtextastext,
+            }
 
     def export(self):
         """Export the figure to the filename."""
 
         ext = os.path.splitext(self.filename)[1].lower()
 
+        if self.cache is None:
+            self.exportFormat(ext)
+        else:
+            key = self.cache.makeKey(self.doc, self.pagenumber, ext,
+                                     self.cacheOptions())
+            if not self.cache.fetch(key, self.filename):
+                self.exportFormat(ext)
+                self.cache.store(key, self.filename)
+
+    def exportFormat(self, ext):
+        """Export the figure to the filename using format ext."""
+
         if ext in ('.eps', '.pdf'):
             self.exportPS(ext)
 
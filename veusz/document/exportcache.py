@@ -0,0 +1,220 @@
+#    Copyright (C) 2014 Jeremy S. Sanders
+#    Email: Jeremy Sanders <jeremy@jeremysanders.net>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""An on-disk cache of exported files.
+
+Files are keyed by a hash of the saved text of the document (with
+the values of datasets hashed directly), the size and modification
+time of any linked files, the page, the output format and the export
+options. Unchanged documents are therefore
+copied from the cache rather than being painted again.
+"""
+
+from __future__ import division
+import os
+import os.path
+import shutil
+import hashlib
+import tempfile
+
+import numpy as N
+
+from ..compat import cbytes
+from .. import utils
+from .. import setting
+from . import datasets
+
+# dataset types saved as their values in the document
+_valuetypes = ( datasets.Dataset, datasets.DatasetDateTime,
+                datasets.DatasetText, datasets.Dataset2D )
+
+class _HashWriter(object):
+    """File-like object which hashes everything written to it."""
+
+    def __init__(self):
+        self.hash = hashlib.sha1()
+
+    def write(self, text):
+        if not isinstance(text, cbytes):
+            text = text.encode('utf-8')
+        self.hash.update(text)
+
+    def writeValues(self, vals):
+        """Hash a numpy array or list of values."""
+        if isinstance(vals, N.ndarray):
+            self.write('array %s %s\n' % (vals.dtype.str, vals.shape))
+            self.hash.update(N.ascontiguousarray(vals).view(N.uint8))
+        else:
+            self.write('%s\n' % repr(vals))
+
+def _hashDataset(writer, name, dataset):
+    """Hash the values of datasets saved as values, rather than
+    formatting them as text, or save other datasets."""
+
+    if type(dataset) not in _valuetypes or dataset.linked is not None:
+        dataset.saveToFile(writer, name)
+        return
+
+    writer.write('dataset %s %s\n' % (repr(name), type(dataset).__name__))
+    if dataset.dimensions == 2:
+        writer.write('%s %s\n' % (repr(dataset.xrange), repr(dataset.yrange)))
+        writer.writeValues(dataset.data)
+    else:
+        for col in dataset.columns:
+            writer.writeValues(getattr(dataset, col))
+
+def documentHash(doc):
+    """Return a hash of the document contents and its linked files."""
+
+    writer = _HashWriter()
+    writer.write('version %s\n' % utils.version())
+    doc.saveDocumentText(writer, savedataset=_hashDataset)
+
+    for filename in sorted([lf.filename for lf in doc.getLinkedFiles()]):
+        try:
+            st = os.stat(filename)
+            info = (st.st_size, st.st_mtime)
+        except EnvironmentError:
+            info = None
+        writer.write('linked %s %s\n' % (repr(filename), repr(info)))
+
+    return writer.hash.hexdigest()
+
+class ExportCache(object):
+    """A size-limited cache of exported files in a directory.
+
+    The least recently used files are removed when the total size
+    of the cache goes over maxsize bytes. This is safe to share
+    between processes, as files are written atomically.
+    """
+
+    def __init__(self, directory, maxsize=256*1024*1024):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.hits = self.misses = self.evictions = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def makeKey(self, doc, pagenumber, ext, options):
+        """Make key for document, page, output extension and a
+        dict of export options."""
+        text = '%s %i %s %s' % (
+            documentHash(doc), pagenumber, ext,
+            repr(sorted(options.items())))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest() + ext
+
+    def fetch(self, key, filename):
+        """Copy the cached file with key to filename.
+        Returns True if the file was in the cache."""
+
+        cachefile = os.path.join(self.directory, key)
+        try:
+            shutil.copyfile(cachefile, filename)
+        except EnvironmentError:
+            self.misses += 1
+            return False
+
+        # mark as recently used
+        try:
+            os.utime(cachefile, None)
+        except EnvironmentError:
+            pass
+        self.hits += 1
+        return True
+
+    def store(self, key, filename):
+        """Store the exported file filename in the cache with key."""
+
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(filename, tmpname)
+            if os.path.exists(os.path.join(self.directory, key)):
+                os.remove(os.path.join(self.directory, key))
+            os.rename(tmpname, os.path.join(self.directory, key))
+        except EnvironmentError:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            return
+        self.evict()
+
+    def _entries(self):
+        """Return list of (mtime, size, filename) for cached files."""
+        out = []
+        for fname in os.listdir(self.directory):
+            if fname.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, fname)
+            try:
+                st = os.stat(path)
+            except EnvironmentError:
+                continue
+            out.append( (st.st_mtime, st.st_size, path) )
+        return out
+
+    def evict(self):
+        """Remove least recently used files until under maximum size."""
+        entries = sorted(self._entries())
+        total = sum([e[1] for e in entries])
+        while entries and total > self.maxsize:
+            mtime, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except EnvironmentError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all files in cache."""
+        for mtime, size, path in self._entries():
+            try:
+                os.remove(path)
+            except EnvironmentError:
+                pass
+
+    def stats(self):
+        """Return a dict of statistics about the cache."""
+        entries = self._entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'files': len(entries),
+            'size': sum([e[1] for e in entries]),
+            }
+
+_defaultcache = [None]
+def defaultExportCache():
+    """Return the export cache configured in the preferences, or None
+    if caching is disabled."""
+
+    if not setting.settingdb['export_cache']:
+        return None
+
+    directory = setting.settingdb['export_cache_dir']
+    if not directory:
+        directory = os.path.join(tempfile.gettempdir(),
+                                 'veusz_export_cache')
+    maxsize = int(setting.settingdb['export_cache_size']*1024*1024)
+
+    cache = _defaultcache[0]
+    if cache is None or cache.directory != directory:
+        cache = _defaultcache[0] = ExportCache(directory, maxsize=maxsize)
+    cache.maxsize = maxsize
+    return cache
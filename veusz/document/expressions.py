@@ -0,0 +1,487 @@
+#    Copyright (C) 2014 Jeremy S. Sanders
+#    Email: Jeremy Sanders <jeremy@jeremysanders.net>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Evaluation of dataset expressions.
+
+An expression is parsed once into an ExpressionPlan, which can be
+evaluated many times. References to datasets in the expression are
+replaced by variables, which are bound directly to the values of the
+datasets when the plan is evaluated.
+
+Subexpressions which only use arithmetic, comparisons and numpy
+ufuncs on datasets are "pure", as their values only depend on the
+datasets they use. The values of pure subexpressions are cached by
+the ExpressionEngine of the document, so they are shared between the
+parts of a dataset (e.g. data and serr) and between expressions.
+
+Pure subexpressions of large arrays are evaluated by numexpr if it is
+installed, or in chunks by numpy otherwise, so that large temporary
+arrays are not made.
+"""
+
+from __future__ import division
+import sys
+import ast
+import binascii
+import copy
+import numbers
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as N
+
+from ..compat import crange, czip
+from .. import utils
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# pure subexpressions of arrays with at least this many elements are
+# evaluated with numexpr or in chunks
+chunkminsize = 262144
+# number of elements in each chunk if evaluating in chunks
+chunksize = 65536
+
+# operators allowed in pure subexpressions, with numexpr equivalents
+_binops = {
+    ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/',
+    ast.Pow: '**', ast.Mod: '%', ast.FloorDiv: None,
+    }
+_unaryops = {ast.USub: '-', ast.UAdd: '+'}
+_cmpops = {
+    ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=',
+    ast.Eq: '==', ast.NotEq: '!=',
+    }
+
+# numpy ufuncs which numexpr can evaluate, with their numexpr names
+_numexprfuncs = {
+    'sin': 'sin', 'cos': 'cos', 'tan': 'tan',
+    'arcsin': 'arcsin', 'arccos': 'arccos', 'arctan': 'arctan',
+    'arctan2': 'arctan2', 'sinh': 'sinh', 'cosh': 'cosh', 'tanh': 'tanh',
+    'arcsinh': 'arcsinh', 'arccosh': 'arccosh', 'arctanh': 'arctanh',
+    'log': 'log', 'log10': 'log10', 'log1p': 'log1p',
+    'exp': 'exp', 'expm1': 'expm1', 'sqrt': 'sqrt',
+    'absolute': 'abs', 'conjugate': 'conj',
+    }
+
+# nodes which make a new scope, where names may not be datasets
+_scopenodes = tuple([ getattr(ast, n) for n in
+                      ('Lambda', 'GeneratorExp', 'ListComp',
+                       'SetComp', 'DictComp') if hasattr(ast, n) ])
+
+if sys.version_info >= (3, 8):
+    _numnode, _numattr = ast.Constant, 'value'
+else:
+    _numnode, _numattr = ast.Num, 'n'
+
+def _number(node):
+    """Return value of node if it is a number, else None."""
+    if isinstance(node, _numnode):
+        val = getattr(node, _numattr)
+        if isinstance(val, numbers.Number):
+            return val
+    return None
+
+def datasetVariable(name, part):
+    """Return name of variable for part of dataset in a plan."""
+    return '_DS_%s_%s' % (
+        binascii.hexlify(name.encode('utf-8')).decode('ascii'), part)
+
+class _Step(object):
+    """A pure subexpression evaluated by a plan."""
+
+    def __init__(self, var, key, node, inputs, names, numexprtext):
+        # variable the value is bound to
+        self.var = var
+        # key to cache value (a dump of the subexpression)
+        self.key = key
+        # datasets variables the value depends on
+        self.inputs = inputs
+        # variables used by node (including values of previous steps)
+        self.names = names
+        # text to evaluate by numexpr, or None if not possible
+        self.numexprtext = numexprtext
+
+        tree = ast.fix_missing_locations(ast.Expression(body=node))
+        self.code = compile(tree, '<expression>', 'eval')
+
+class ExpressionPlan(object):
+    """An expression parsed once to be evaluated many times.
+
+    text is the expression, where datasets have been replaced by the
+    variable names given. env is the environment to evaluate in, which
+    the variables are added to when evaluating.
+    """
+
+    def __init__(self, engine, text, variables, env):
+        self.engine = engine
+        self.text = text
+        self.variables = set(variables)
+        self.env = env
+        self.lock = threading.Lock()
+
+        self.tree = ast.parse(text, '<expression>', 'eval')
+        # keys of pure subexpressions which use variables
+        self.keys = []
+        self._findPure(self.tree.body)
+
+        # changeset of shared subexpressions in engine when built
+        self.builtchangeset = None
+        self.steps = []
+        self.code = None
+
+    def _findPure(self, node, cache=True):
+        """Mark pure subexpressions under node.
+
+        Returns (whether node is pure, set of variables used).
+        If cache is False, node is not cached."""
+
+        if isinstance(node, _scopenodes):
+            # names could be local to the scope
+            return False, set()
+
+        if isinstance(node, ast.Name):
+            if node.id in self.variables:
+                return True, set([node.id])
+            # constants like pi
+            return isinstance(self.env.get(node.id), float), set()
+
+        if _number(node) is not None:
+            return True, set()
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _binops:
+            operands = [node.left, node.right]
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in _unaryops:
+            operands = [node.operand]
+        elif ( isinstance(node, ast.Compare) and len(node.ops) == 1 and
+               type(node.ops[0]) in _cmpops ):
+            operands = [node.left] + node.comparators
+        elif ( isinstance(node, ast.Call) and self._isUfunc(node.func) and
+               not node.keywords and not getattr(node, 'starargs', None) and
+               not getattr(node, 'kwargs', None) ):
+            operands = node.args
+        else:
+            # not pure, but may contain pure subexpressions. Do not
+            # cache values whose attributes are used, as methods may
+            # modify them.
+            for child in ast.iter_child_nodes(node):
+                self._findPure(child, cache=not isinstance(
+                        node, ast.Attribute))
+            return False, set()
+
+        pure = True
+        names = set()
+        for operand in operands:
+            p, n = self._findPure(operand)
+            pure = pure and p
+            names |= n
+
+        if pure and names and cache:
+            node.purekey = ast.dump(node)
+            node.pureinputs = sorted(names)
+            self.keys.append(node.purekey)
+        return pure, names
+
+    def _isUfunc(self, func):
+        """Is the node a numpy ufunc?"""
+        return ( isinstance(func, ast.Name) and
+                 func.id not in self.variables and
+                 isinstance(self.env.get(func.id), N.ufunc) )
+
+    def _numexprText(self, node, names):
+        """Return text to evaluate node with numexpr, or None if this
+        is not possible. names are the variables which can be used."""
+
+        if isinstance(node, ast.Name):
+            if node.id in names:
+                return node.id
+            val = self.env.get(node.id)
+            return repr(val) if isinstance(val, float) else None
+
+        num = _number(node)
+        if num is not None:
+            return repr(num)
+
+        if isinstance(node, ast.BinOp):
+            op = _binops.get(type(node.op))
+            args = [node.left, node.right]
+        elif isinstance(node, ast.UnaryOp):
+            op = _unaryops.get(type(node.op))
+            args = [node.operand]
+        elif isinstance(node, ast.Compare) and len(node.ops) == 1:
+            op = _cmpops.get(type(node.ops[0]))
+            args = [node.left] + node.comparators
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            fname = node.func.id
+            if ( fname not in _numexprfuncs or
+                 self.env.get(fname) is not getattr(N, fname, None) ):
+                return None
+            args = [self._numexprText(a, names) for a in node.args]
+            if None in args:
+                return None
+            return '%s(%s)' % (_numexprfuncs[fname], ', '.join(args))
+        else:
+            return None
+
+        if op is None:
+            return None
+        args = [self._numexprText(a, names) for a in args]
+        if None in args:
+            return None
+        if len(args) == 1:
+            return '(%s%s)' % (op, args[0])
+        return '(%s %s %s)' % (args[0], op, args[1])
+
+    def _build(self):
+        """Split the expression into steps for the pure subexpressions
+        and the remaining code."""
+
+        builder = _StepBuilder(self, self.engine.sharedKeys())
+        tree = copy.deepcopy(self.tree)
+        tree.body = builder.visit(tree.body)
+        self.steps = builder.steps
+        self.code = compile(ast.fix_missing_locations(tree),
+                            '<expression>', 'eval')
+
+    def evaluate(self, values, versions):
+        """Evaluate the plan.
+
+        values is a dict of values of variables. versions is a dict
+        of versions of the variables, which change if their values are
+        modified in place.
+        """
+
+        with self.lock:
+            changeset = self.engine.sharedchangeset
+            if self.builtchangeset != changeset:
+                self._build()
+                self.builtchangeset = changeset
+
+            env = self.env
+            env.update(values)
+            try:
+                for step in self.steps:
+                    env[step.var] = self.engine.stepValue(
+                        step, env, versions)
+                return eval(self.code, env)
+            finally:
+                # do not keep references to the values
+                for name in values:
+                    env.pop(name, None)
+                for step in self.steps:
+                    env.pop(step.var, None)
+
+class _StepBuilder(ast.NodeTransformer):
+    """Replace pure subexpressions in a plan by steps.
+
+    At the top level, all pure subexpressions are replaced. Inside
+    these, only those in shared are replaced."""
+
+    def __init__(self, plan, shared):
+        self.plan = plan
+        self.shared = shared
+        self.steps = []
+        self.stepvars = {}
+        self.inside = False
+
+    def visit(self, node):
+        key = getattr(node, 'purekey', None)
+        if key is None or (self.inside and key not in self.shared):
+            return self.generic_visit(node)
+
+        if key not in self.stepvars:
+            inside = self.inside
+            self.inside = True
+            node = self.generic_visit(node)
+            self.inside = inside
+
+            var = '_CSE_%i' % len(self.steps)
+            names = set(self.plan.variables) | set(self.stepvars.values())
+            used = sorted(set([ n.id for n in ast.walk(node)
+                                if isinstance(n, ast.Name) and
+                                n.id in names ]))
+            self.steps.append( _Step(
+                    var, key, node, node.pureinputs, used,
+                    self.plan._numexprText(node, names)) )
+            self.stepvars[key] = var
+
+        return ast.copy_location(
+            ast.Name(id=self.stepvars[key], ctx=ast.Load()), node)
+
+class ExpressionEngine(object):
+    """Make plans for expressions in a document and cache the values
+    of pure subexpressions."""
+
+    # maximum total size of cached values in bytes
+    cachesize = 64*1024*1024
+
+    def __init__(self, document):
+        self.document = document
+        self.lock = threading.Lock()
+        self.plans = utils.LRUCache(
+            256, onevict=lambda key, plan: self._forgetPlan(plan))
+
+        # number of times each pure subexpression has been seen
+        self.keycounts = {}
+        # subexpressions seen more than once
+        self.shared = set()
+        self.sharedchangeset = 0
+
+        # cached values (key -> (input refs, versions, value))
+        self.values = OrderedDict()
+        self.valuessize = 0
+        self.hits = self.misses = 0
+
+    def plan(self, text, variables):
+        """Return plan for expression text, where datasets have been
+        replaced by variables."""
+
+        doc = self.document
+        key = (text, tuple(sorted(variables)), doc.evalcontextchangeset)
+        def makeplan():
+            plan = ExpressionPlan(
+                self, text, variables, dict(doc.eval_context))
+            for k in plan.keys:
+                self.keycounts[k] = count = self.keycounts.get(k, 0) + 1
+                if count == 2:
+                    self.shared.add(k)
+                    self.sharedchangeset += 1
+            return plan
+
+        with self.lock:
+            return self.plans.get(key, makeplan)
+
+    def _forgetPlan(self, plan):
+        """Stop counting the subexpressions of plan, when it is
+        removed from the cache."""
+        for k in plan.keys:
+            count = self.keycounts[k] - 1
+            if count > 0:
+                self.keycounts[k] = count
+            else:
+                del self.keycounts[k]
+            if count == 1:
+                self.shared.discard(k)
+                self.sharedchangeset += 1
+
+    def sharedKeys(self):
+        """Return set of keys of shared subexpressions."""
+        with self.lock:
+            return set(self.shared)
+
+    def clear(self):
+        """Remove cached values and plans."""
+        with self.lock:
+            self.plans.clear()
+            self.keycounts.clear()
+            if self.shared:
+                self.shared.clear()
+                self.sharedchangeset += 1
+            self.values.clear()
+            self.valuessize = 0
+
+    def stepValue(self, step, env, versions):
+        """Return value of step of plan, using the cache if possible."""
+
+        key = (step.key, self.document.evalcontextchangeset)
+        inputs = [env[v] for v in step.inputs]
+        invers = tuple([versions.get(v) for v in step.inputs])
+
+        with self.lock:
+            entry = self.values.pop(key, None)
+            if entry is not None:
+                self.values[key] = entry
+        if entry is not None:
+            refs, vers, value = entry
+            if vers == invers and all(
+                [r() is i for r, i in czip(refs, inputs)]):
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        value = self._evaluateStep(step, env)
+        self._store(key, inputs, invers, value)
+        return value
+
+    def _store(self, key, inputs, versions, value):
+        """Store value in cache, if possible."""
+
+        if ( not isinstance(value, N.ndarray) or
+             value.nbytes > self.cachesize or
+             not all([isinstance(i, N.ndarray) for i in inputs]) ):
+            return
+
+        # the value is shared, so should not be modified
+        value.flags.writeable = False
+        refs = [weakref.ref(i) for i in inputs]
+
+        with self.lock:
+            old = self.values.pop(key, None)
+            if old is not None:
+                self.valuessize -= old[2].nbytes
+            self.values[key] = (refs, versions, value)
+            self.valuessize += value.nbytes
+            while self.valuessize > self.cachesize:
+                k, old = self.values.popitem(last=False)
+                self.valuessize -= old[2].nbytes
+
+    def _evaluateStep(self, step, env):
+        """Evaluate step, using numexpr or chunks for large arrays."""
+
+        arrays = [env[n] for n in step.names]
+        if arrays and all([isinstance(a, N.ndarray) for a in arrays]):
+            size = max([a.size for a in arrays])
+            if size >= chunkminsize:
+                if numexpr is not None and step.numexprtext is not None:
+                    try:
+                        return numexpr.evaluate(
+                            step.numexprtext,
+                            local_dict=dict(czip(step.names, arrays)),
+                            global_dict={}, truediv=True)
+                    except Exception:
+                        pass
+                if all([a.ndim == 1 and len(a) == size for a in arrays]):
+                    out = self._evaluateChunked(step, env, arrays, size)
+                    if out is not None:
+                        return out
+
+        return eval(step.code, env)
+
+    def _evaluateChunked(self, step, env, arrays, size):
+        """Evaluate step in chunks of 1D arrays of the same size.
+        Returns None if the result is not the same size."""
+
+        out = None
+        try:
+            for start in crange(0, size, chunksize):
+                for name, a in czip(step.names, arrays):
+                    env[name] = a[start:start+chunksize]
+                val = eval(step.code, env)
+                if out is None:
+                    if ( not isinstance(val, N.ndarray) or
+                         val.shape != (min(size, chunksize),) ):
+                        return None
+                    out = N.empty(size, dtype=val.dtype)
+                out[start:start+chunksize] = val
+        finally:
+            for name, a in czip(step.names, arrays):
+                env[name] = a
+        return out
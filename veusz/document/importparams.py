@@ -164,6 +164,20 @@ class ImportParamsFITS(ImportParamsBase):
         }
     defaults.update(ImportParamsBase.defaults)
 
+class ImportParamsFITSMulti(ImportParamsBase):
+    """Parameters for importing many datasets from a FITS file.
+
+    Additional parameters:
+     items: list of dicts of ImportParamsFITS parameters (dsname, hdu,
+            datacol, symerrcol, poserrcol, negerrcol and wcsmode),
+            one for each dataset
+    """
+
+    defaults = {
+        'items': [],
+        }
+    defaults.update(ImportParamsBase.defaults)
+
 class ImportParamsPlugin(ImportParamsBase):
     """Parameters for import plugins.
 
@@ -20,9 +20,16 @@
 """Classes for linked files"""
 
 from __future__ import division
+import os
 import sys
+import codecs
+import hashlib
+import threading
+import multiprocessing
 
-from ..compat import citems, cstr
+import numpy as N
+
+from ..compat import citems, cvalues, czip, cstr, cqueue, crange
 from .. import utils
 
 class LinkedFileBase(object):
@@ -79,20 +86,34 @@ class LinkedFileBase(object):
                 ds.linked = self
         return read
 
-    def reloadLinks(self, document):
-        """Reload links using an operation"""
+    def makeReadOperation(self, document):
+        """Return a temporary document and operation to read the
+        linked file into it.
 
-        # get the operation for reloading
-        op = self.createOperation()(self.params)
+        The reading is done by tempdoc.applyOperation(op), which does
+        not touch document, so can be run in another thread or
+        process."""
+        return _ReadDocument(), self.createOperation()(self.params)
 
-        # load data into a temporary document
-        tempdoc = document.__class__()
+    def readState(self):
+        """Return state of self changed by reading the file, to be
+        passed back from another process."""
+        return None
 
-        try:
-            tempdoc.applyOperation(op)
-        except Exception as ex:
+    def setReadState(self, state):
+        """Set state returned by readState."""
+        pass
+
+    def applyRead(self, document, tempdoc, op, exception=None):
+        """Replace linked datasets in document with those read into
+        tempdoc by op. If exception is set, reading failed.
+
+        Returns a tuple of a list of names of datasets read and a
+        dict of the number of errors for each dataset."""
+
+        if exception is not None:
             # if something breaks, record an error and return nothing
-            document.log(cstr(ex))
+            document.log(cstr(exception))
 
             # find datasets which are linked using this link object
             # return errors for them
@@ -110,19 +131,427 @@ class LinkedFileBase(object):
 
         return (read, errors)
 
+    def reloadLinks(self, document):
+        """Reload links using an operation"""
+
+        # load data into a temporary document
+        tempdoc, op = self.makeReadOperation(document)
+
+        try:
+            tempdoc.applyOperation(op)
+        except Exception as ex:
+            return self.applyRead(document, tempdoc, op, exception=ex)
+        return self.applyRead(document, tempdoc, op)
+
+class ReloadCancelled(Exception):
+    """Raised if reloading linked files was cancelled."""
+
+class _ReadDocument(object):
+    """Datasets read from a linked file, before they are put into
+    the document.
+
+    This has the parts of the Document interface used by import
+    operations. It is not a QObject, so it can be used in other
+    threads, and its datasets can be sent back from other processes.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.customs = []
+
+    def setData(self, name, dataset):
+        self.data[name] = dataset
+        dataset.document = self
+
+    def deleteData(self, name):
+        del self.data[name]
+
+    def customDict(self):
+        """Return a dictionary mapping custom names to (idx, type, value)."""
+        return dict([ (name, (i, ctype, val))
+                      for i, (ctype, name, val) in enumerate(self.customs) ])
+
+    def updateEvalContext(self):
+        pass
+
+    def loadPlugins(self, pluginlist=None, registry=None):
+        from .doc import Document
+        Document.loadPlugins(pluginlist=pluginlist, registry=registry)
+
+    def applyOperation(self, operation):
+        with utils.profiler.record(
+            'operation', getattr(operation, 'descr', '')):
+            operation.do(self)
+
+# read jobs, inherited by forked processes
+_forkjobs = []
+
+def _readInProcess(i):
+    """Read job i of _forkjobs in a forked process.
+
+    Returns (True, (datasets, invalid conversions, read state of
+    link)) or (False, error message).
+    """
+
+    lf, tempdoc, op = _forkjobs[i]
+    try:
+        tempdoc.applyOperation(op)
+    except Exception as ex:
+        return (False, cstr(ex))
+
+    # these are set again when the datasets are put in the document
+    for ds in cvalues(tempdoc.data):
+        ds.document = ds.linked = None
+    return (True, (tempdoc.data, op.outinvalids, lf.readState()))
+
+def _forkPool(numprocs):
+    """Return a pool of forked processes, or None if forking is not
+    possible."""
+
+    if not hasattr(os, 'fork'):
+        return None
+    try:
+        ctx = multiprocessing.get_context('fork')
+    except AttributeError:
+        # python 2 always forks
+        ctx = multiprocessing
+    except ValueError:
+        return None
+    try:
+        return ctx.Pool(numprocs)
+    except EnvironmentError:
+        return None
+
+def _readInProcesses(links, jobs, numworkers, progress, exceptions):
+    """Read the jobs in a pool of forked processes.
+
+    The exception (or None) for each job read is put in exceptions.
+    Jobs whose datasets cannot be sent back are left out, to be read
+    in threads instead. Returns False if forking is not possible.
+    """
+
+    del _forkjobs[:]
+    _forkjobs.extend([ (lf, tempdoc, op)
+                       for lf, (tempdoc, op) in czip(links, jobs) ])
+    try:
+        pool = _forkPool(numworkers)
+    finally:
+        # the jobs have been copied into the processes
+        del _forkjobs[:]
+    if pool is None:
+        return False
+
+    try:
+        results = [ pool.apply_async(_readInProcess, (i,))
+                    for i in crange(len(jobs)) ]
+        pending = list(crange(len(jobs)))
+        while pending:
+            results[pending[0]].wait(0.05)
+            for i in [i for i in pending if results[i].ready()]:
+                pending.remove(i)
+                try:
+                    ok, retn = results[i].get()
+                except Exception:
+                    # could not be sent back, so read in a thread
+                    continue
+                if not ok:
+                    exceptions[i] = RuntimeError(retn)
+                    continue
+                data, invalids, state = retn
+                tempdoc, op = jobs[i]
+                tempdoc.data = data
+                op.outinvalids = invalids
+                links[i].setReadState(state)
+                exceptions[i] = None
+
+            if progress is not None and progress(
+                len(exceptions), len(jobs)) is False:
+                raise ReloadCancelled()
+    finally:
+        pool.terminate()
+        pool.join()
+    return True
+
+def _readInThreads(jobs, todo, numworkers, progress, exceptions):
+    """Read the jobs with indices todo in a set of threads.
+    The exception (or None) for each job is put in exceptions."""
+
+    queue = cqueue.Queue()
+    for i in todo:
+        queue.put(i)
+    done = cqueue.Queue()
+    cancel = threading.Event()
+
+    def worker():
+        while not cancel.is_set():
+            try:
+                i = queue.get_nowait()
+            except cqueue.Empty:
+                return
+            tempdoc, op = jobs[i]
+            try:
+                tempdoc.applyOperation(op)
+                done.put( (i, None) )
+            except Exception as ex:
+                done.put( (i, ex) )
+
+    threads = [ threading.Thread(target=worker)
+                for t in crange(max(1, min(numworkers, len(todo)))) ]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    # wait for results, keeping caller informed
+    try:
+        while len(exceptions) < len(jobs):
+            try:
+                i, ex = done.get(timeout=0.05)
+                exceptions[i] = ex
+            except cqueue.Empty:
+                pass
+            if progress is not None and progress(
+                len(exceptions), len(jobs)) is False:
+                raise ReloadCancelled()
+    finally:
+        cancel.set()
+        for t in threads:
+            t.join()
+
+def reloadLinkedFiles(document, links, numworkers=None, progress=None,
+                      processes=True):
+    """Reload the linked files links in document.
+
+    The files are read in parallel by up to numworkers (default is
+    the number of CPUs) processes, or threads if processes is False or
+    if processes cannot be forked on this platform. As reading text
+    files is mostly Python code, threads do not run it in parallel.
+    The datasets read are then put into the document together, in
+    the order of links.
+
+    progress(numdone, numtotal) is called regularly in the calling
+    thread. If it returns False, the remaining files are not read,
+    the document is left unchanged and ReloadCancelled is raised.
+
+    Returns a tuple of a list of names of datasets read and a dict of
+    the number of errors for each dataset.
+    """
+
+    links = list(links)
+    jobs = [lf.makeReadOperation(document) for lf in links]
+    if numworkers is None:
+        numworkers = multiprocessing.cpu_count()
+    numworkers = max(1, min(numworkers, len(links)))
+
+    exceptions = {}
+    if processes and numworkers > 1:
+        _readInProcesses(links, jobs, numworkers, progress, exceptions)
+    todo = [i for i in crange(len(jobs)) if i not in exceptions]
+    if todo:
+        _readInThreads(jobs, todo, numworkers, progress, exceptions)
+
+    # put the results into the document
+    read = []
+    errors = {}
+    for i, lf in enumerate(links):
+        tempdoc, op = jobs[i]
+        nread, nerrors = lf.applyRead(document, tempdoc, op,
+                                      exception=exceptions[i])
+        read += nread
+        errors.update(nerrors)
+    return read, errors
+
 class LinkedFile(LinkedFileBase):
     """Instead of reading data from a string, data can be read from
     a "linked file". This means the same document can be reloaded, and
     the data would be reread from the file.
 
     This class is used to store a link filename with the descriptor
+
+    If a file has only been appended to since it was last read, only
+    the new part of the file is read, and added to the datasets.
     """
 
+    # size of blocks read when checking the old part of the file
+    blocksize = 1024*1024
+
+    def __init__(self, params):
+        LinkedFileBase.__init__(self, params)
+        # (size, endsnewline, digest, (device, inode)) of file when
+        # last read
+        self.readstate = None
+        # state of file being read and whether appending
+        self.pendingstate = None
+        self.appending = False
+
     def createOperation(self):
         """Return operation to recreate self."""
         from . import operations
         return operations.OperationDataImport
 
+    def _canReadIncrementally(self):
+        """Can the file be read in parts?"""
+        p = self.params
+        try:
+            newline = u'\n'.encode(p.encoding)
+        except LookupError:
+            return False
+        # the file is split at newlines, and lines in blocks mode
+        # depend on earlier lines
+        return ( newline == b'\n' and not p.useblocks and
+                 p.filename != '{clipboard}' )
+
+    def _prefixHash(self, f, size):
+        """Return hash of the first size bytes of file f, leaving f
+        after them. Hashing is much faster than reading the values."""
+        h = hashlib.sha1()
+        f.seek(0)
+        while size > 0:
+            block = f.read(min(size, self.blocksize))
+            if not block:
+                break
+            h.update(block)
+            size -= len(block)
+        return h
+
+    def _readNew(self):
+        """Read the file, or only its new part if it has only been
+        appended to since the last read. Returns (text, appending)."""
+
+        state = self.readstate
+        appending = False
+        with open(self.params.filename, 'rb') as f:
+            st = os.fstat(f.fileno())
+            fileid = (st.st_dev, st.st_ino)
+
+            # is this the same file, unchanged up to the end of the
+            # last read, which was a complete line? (the change time
+            # cannot be used, as appending changes it)
+            if ( state is not None and state[1] and state[3] == fileid and
+                 st.st_size >= state[0] ):
+                h = self._prefixHash(f, state[0])
+                if h.hexdigest() == state[2]:
+                    data = f.read()
+                    appending = True
+
+            if not appending:
+                f.seek(0)
+                data = f.read()
+                h = hashlib.sha1()
+            h.update(data)
+
+        size = len(data) + (state[0] if appending else 0)
+        if appending and not data:
+            endsnewline = True
+        else:
+            endsnewline = data.endswith(b'\n')
+        self.pendingstate = (size, endsnewline, h.hexdigest(), fileid)
+
+        return codecs.decode(data, self.params.encoding, 'ignore'), appending
+
+    def readNew(self):
+        """Read the file, or only its new part if possible.
+
+        This is called by the operation reading the file, so may be
+        in another thread. Returns the text read, or None if the
+        operation should read the whole file itself."""
+
+        try:
+            text, appending = self._readNew()
+        except EnvironmentError:
+            # let the import report the error
+            self.pendingstate = None
+            return None
+
+        # descriptors inside the file change how later lines are read
+        if text.find('descriptor') >= 0:
+            self.pendingstate = None
+            return None
+
+        self.appending = appending
+        return text
+
+    def makeReadOperation(self, document):
+        """Return operation to read the file, or only its new part
+        if possible."""
+
+        self.appending = False
+        self.pendingstate = None
+        if not self._canReadIncrementally():
+            return LinkedFileBase.makeReadOperation(self, document)
+
+        from . import operations
+        return ( _ReadDocument(),
+                 operations.OperationDataImportLinked(self.params, self) )
+
+    def readState(self):
+        return (self.pendingstate, self.appending)
+
+    def setReadState(self, state):
+        self.pendingstate, self.appending = state
+
+    def _appendReadDatasets(self, tempdoc, document):
+        """Add values in datasets read in tempdoc to the datasets
+        linked to self in document.
+        Returns list of names, or None if the datasets do not match."""
+
+        linkednames = set([ name for name, ds in citems(document.data)
+                            if ds.linked is self ])
+        if not tempdoc.data:
+            return []
+        if set(tempdoc.data) != linkednames:
+            return None
+
+        for name, newds in citems(tempdoc.data):
+            oldds = document.data[name]
+            if type(oldds) is not type(newds):
+                return None
+            for col in newds.columns:
+                oldvals = getattr(oldds, col)
+                newvals = getattr(newds, col)
+                if (oldvals is None) != (newvals is None):
+                    return None
+
+        for name, newds in citems(tempdoc.data):
+            oldds = document.data[name]
+            for col in newds.columns:
+                oldvals = getattr(oldds, col)
+                newvals = getattr(newds, col)
+                if oldvals is None:
+                    continue
+                elif isinstance(oldvals, list):
+                    vals = oldvals + newvals
+                else:
+                    vals = N.concatenate( (oldvals, newvals) )
+                setattr(newds, col, vals)
+            if hasattr(newds, '_invalidpoints'):
+                newds._invalidpoints = None
+
+            newds.linked = self
+            document.setData(name, newds)
+        return sorted(tempdoc.data)
+
+    def applyRead(self, document, tempdoc, op, exception=None):
+        """Add new values if appending, or replace datasets."""
+
+        state, self.pendingstate = self.pendingstate, None
+        if exception is not None:
+            self.readstate = None
+            return LinkedFileBase.applyRead(
+                self, document, tempdoc, op, exception=exception)
+
+        if self.appending:
+            read = self._appendReadDatasets(tempdoc, document)
+            if read is None:
+                # the new values do not match, so read everything
+                self.readstate = None
+                return self.reloadLinks(document)
+            result = (read, op.outinvalids)
+        else:
+            result = LinkedFileBase.applyRead(self, document, tempdoc, op)
+
+        self.readstate = state
+        return result
+
     def saveToFile(self, fileobj, relpath=None):
         """Save the link to the document file.
         If relpath is set, save links relative to path given
@@ -193,6 +622,35 @@ class LinkedFileFITS(LinkedFileBase):
 
         fileobj.write("ImportFITSFile(%s)\n" % ", ".join(args))
 
+class LinkedFileFITSMulti(LinkedFileBase):
+    """Links a FITS file to several datasets, which are read together."""
+
+    def createOperation(self):
+        """Return operation to recreate self."""
+        from . import operations
+        return operations.OperationDataImportFITSMulti
+
+    def saveToFile(self, fileobj, relpath=None):
+        """Save the link to the document file."""
+
+        p = self.params
+        args = [ repr(self._getSaveFilename(relpath)) ]
+
+        # only write the item parameters which are set
+        items = []
+        for item in p.items:
+            items.append( dict([(k, v) for k, v in sorted(citems(item))
+                                if v is not None]) )
+        args.append(repr(items))
+
+        for param in ("prefix", "suffix"):
+            v = getattr(p, param)
+            if v:
+                args.append("%s=%s" % (param, repr(v)))
+        args.append("linked=True")
+
+        fileobj.write("ImportFITSFileMulti(%s)\n" % ", ".join(args))
+
 class LinkedFileCSV(LinkedFileBase):
     """A CSV file linked to datasets."""
 
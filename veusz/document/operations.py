@@ -37,6 +37,7 @@ from . import widgetfactory
 from . import simpleread
 from . import readcsv
 from . import linked
+from . import importparams
 
 from .. import utils
 from .. import plugins
@@ -53,6 +54,7 @@ class OperationSettingSet(object):
     """Set a variable to a value."""
 
     descr = _('change setting')
+    describeschanges = True
     
     def __init__(self, setting, value):
         """Set the setting to value.
@@ -73,11 +75,13 @@ class OperationSettingSet(object):
         else:
             self.oldvalue = setting.get()
         setting.set(self.value)
+        document.noteSettingChange(setting)
         
     def undo(self, document):
         """Return old value back..."""
         setting = document.resolveFullSettingPath(self.settingpath)
         setting.set(self.oldvalue)
+        document.noteSettingChange(setting)
 
 class OperationSettingPropagate(object):
     """Propagate setting to other widgets."""
@@ -330,12 +334,14 @@ class OperationWidgetMove(object):
             if self.newindex > self.oldchildindex:
                 self.newindex -= 1
             oldparent.children.insert(self.newindex, child)
+            oldparent.invalidateChildIndex()
         else:
             # moving to different parent
             self.movemode = 'differentparent'
 
             # remove from old parent
             del oldparent.children[self.oldchildindex]
+            oldparent.invalidateChildIndex()
 
             # current names of children
             childnames = newparent.childnames
@@ -343,6 +349,7 @@ class OperationWidgetMove(object):
             # record previous parent and position
             newparent.children.insert(self.newindex, child)
             child.parent = newparent
+            newparent.invalidateChildIndex()
 
             # set a new name, if required
             if child.name in childnames:
@@ -360,9 +367,11 @@ class OperationWidgetMove(object):
 
         # remove from new parent
         del newparent.children[self.newindex]
+        newparent.invalidateChildIndex()
         # restore parent
         oldparent.children.insert(self.oldchildindex, child)
         child.parent = oldparent
+        oldparent.invalidateChildIndex()
 
         # restore name
         if self.oldname is not None:
@@ -420,6 +429,7 @@ class OperationDatasetSet(object):
     """Set a dataset to that specified."""
     
     descr = _('set dataset')
+    describeschanges = True
     
     def __init__(self, datasetname, dataset):
         self.datasetname = datasetname
@@ -446,6 +456,7 @@ class OperationDatasetDelete(object):
     """Delete a dateset."""
     
     descr = _('delete dataset')
+    describeschanges = True
     
     def __init__(self, datasetname):
         self.datasetname = datasetname
@@ -856,7 +867,9 @@ class OperationDataImportBase(object):
         self.oldconst = None
 
         # do actual import
-        self.doImport(document)
+        with utils.profiler.record(
+            'import', '%s %s' % (self.descr, self.params.filename or '')):
+            self.doImport(document)
 
         # only remember the parts we need
         self.olddatasets = [ (n, olddatasets.get(n)) for n in self.outdatasets ]
@@ -893,6 +906,17 @@ class OperationDataImport(OperationDataImportBase):
         OperationDataImportBase.__init__(self, params)
         self.simpleread = simpleread.SimpleRead(params.descriptor)
 
+    def openStream(self):
+        """Return stream to import data from."""
+        p = self.params
+        if p.filename is not None:
+            return simpleread.FileStream(
+                utils.openEncoding(p.filename, p.encoding))
+        elif p.datastr is not None:
+            return simpleread.StringStream(p.datastr)
+        else:
+            raise RuntimeError("No filename or string")
+
     def doImport(self, document):
         """Import data.
         
@@ -900,14 +924,7 @@ class OperationDataImport(OperationDataImportBase):
         """
 
         p = self.params
-        # open stream to import data from
-        if p.filename is not None:
-            stream = simpleread.FileStream(
-                utils.openEncoding(p.filename, p.encoding))
-        elif p.datastr is not None:
-            stream = simpleread.StringStream(p.datastr)
-        else:
-            raise RuntimeError("No filename or string")
+        stream = self.openStream()
 
         # do the import
         self.simpleread.clearState()
@@ -925,6 +942,22 @@ class OperationDataImport(OperationDataImportBase):
             document, linkedfile=LF, prefix=p.prefix, suffix=p.suffix)
         self.outinvalids = self.simpleread.getInvalidConversions()
 
+class OperationDataImportLinked(OperationDataImport):
+    """Reread a linked text file, only reading its new part if it
+    has only been appended to since it was last read."""
+
+    def __init__(self, params, linkedfile):
+        OperationDataImport.__init__(self, params)
+        self.linkedfile = linkedfile
+
+    def openStream(self):
+        """Read the file (or its new part) here, so that it is read
+        in the thread doing the import."""
+        text = self.linkedfile.readNew()
+        if text is None:
+            return OperationDataImport.openStream(self)
+        return simpleread.StringStream(text)
+
 class OperationDataImportCSV(OperationDataImportBase):
     """Import data from a CSV file."""
 
@@ -973,12 +1006,35 @@ class OperationDataImport2D(OperationDataImportBase):
             sr.readData(stream)
             self.outdatasets += sr.setInDocument(document, linkedfile=LF)
 
+def _openFITS(filename):
+    """Open FITS file filename, memory mapping the data."""
+    try:
+        import pyfits
+    except ImportError:
+        raise RuntimeError( 'PyFITS is required to import '
+                              'data from FITS files')
+    return pyfits.open( str(filename), 'readonly', memmap=True )
+
+def _fitsArray(a):
+    """Return FITS data array a as doubles.
+
+    A memory mapped view is returned if the data are already native
+    doubles, otherwise the data are converted (FITS data are stored
+    big endian, so this is normally needed on little endian systems).
+    """
+    if a is None:
+        return None
+    elif a.dtype == N.float64 and a.dtype.isnative:
+        return a.view(N.ndarray)
+    else:
+        return N.array(a, dtype=N.float64)
+
 class OperationDataImportFITS(OperationDataImportBase):
     """Import 1d or 2d data from a fits file."""
 
     descr = _('import FITS file')
     
-    def _import1d(self, hdu):
+    def _import1d(self, hdu, p):
         """Import 1d data from hdu."""
 
         data = hdu.data
@@ -988,34 +1044,32 @@ class OperationDataImportFITS(OperationDataImportBase):
         negv = None
 
         # read the columns required
-        p = self.params
         if p.datacol is not None:
-            datav = data.field(p.datacol)
+            datav = _fitsArray(data.field(p.datacol))
         if p.symerrcol is not None:
-            symv = data.field(p.symerrcol)
+            symv = _fitsArray(data.field(p.symerrcol))
         if p.poserrcol is not None:
-            posv = data.field(p.poserrcol)
+            posv = _fitsArray(data.field(p.poserrcol))
         if p.negerrcol is not None:
-            negv = data.field(p.negerrcol)
+            negv = _fitsArray(data.field(p.negerrcol))
 
         # actually create the dataset
         return datasets.Dataset(data=datav, serr=symv, perr=posv, nerr=negv)
 
-    def _import1dimage(self, hdu):
+    def _import1dimage(self, hdu, p):
         """Import 1d image data form hdu."""
-        return datasets.Dataset(data=hdu.data)
+        return datasets.Dataset(data=_fitsArray(hdu.data))
 
-    def _import2dimage(self, hdu):
+    def _import2dimage(self, hdu, p):
         """Import 2d image data from hdu."""
 
-        p = self.params
         if ( p.datacol is not None or p.symerrcol is not None
              or p.poserrcol is not None
              or p.negerrcol is not None ):
             print("Warning: ignoring columns as import 2D dataset")
 
         header = hdu.header
-        data = hdu.data
+        data = _fitsArray(hdu.data)
 
         try:
             # try to read WCS for image, and work out x/yrange
@@ -1045,33 +1099,32 @@ class OperationDataImportFITS(OperationDataImportBase):
 
         return datasets.Dataset2D(data, xrange=rangex, yrange=rangey)
 
-    def doImport(self, document):
-        """Do the import."""
-
-        try:
-            import pyfits
-        except ImportError:
-            raise RuntimeError( 'PyFITS is required to import '
-                                  'data from FITS files')
-
-        p = self.params
-        f = pyfits.open( str(p.filename), 'readonly')
-        hdu = f[p.hdu]
+    def _importHDU(self, hdu, p):
+        """Make a dataset from hdu using parameters p."""
 
         try:
             # raise an exception if this isn't a table therefore is an image
             hdu.get_coldefs()
-            ds = self._import1d(hdu)
+            return self._import1d(hdu, p)
 
         except AttributeError:
             naxis = hdu.header.get('NAXIS')
             if naxis == 1:
-                ds = self._import1dimage(hdu)
+                return self._import1dimage(hdu, p)
             elif naxis == 2:
-                ds = self._import2dimage(hdu)
+                return self._import2dimage(hdu, p)
             else:
                 raise RuntimeError("Cannot import images with %i dimensions" % naxis)
-        f.close()
+
+    def doImport(self, document):
+        """Do the import."""
+
+        p = self.params
+        f = _openFITS(p.filename)
+        try:
+            ds = self._importHDU(f[p.hdu], p)
+        finally:
+            f.close()
 
         if p.linked:
             ds.linked = linked.LinkedFileFITS(self.params)
@@ -1082,6 +1135,36 @@ class OperationDataImportFITS(OperationDataImportBase):
         document.setData(p.dsname.strip(), ds)
         self.outdatasets.append(p.dsname)
 
+class OperationDataImportFITSMulti(OperationDataImportFITS):
+    """Import many datasets from a FITS file, opening it once."""
+
+    descr = _('import FITS file')
+
+    def doImport(self, document):
+        """Do the import."""
+
+        p = self.params
+        LF = None
+        if p.linked:
+            LF = linked.LinkedFileFITSMulti(p)
+
+        f = _openFITS(p.filename)
+        try:
+            # the file is opened and each header parsed only once
+            hdus = {}
+            for item in p.items:
+                ip = importparams.ImportParamsFITS(**item)
+                if ip.hdu not in hdus:
+                    hdus[ip.hdu] = f[ip.hdu]
+                ds = self._importHDU(hdus[ip.hdu], ip)
+                ds.linked = LF
+
+                name = p.prefix + ip.dsname.strip() + p.suffix
+                document.setData(name, ds)
+                self.outdatasets.append(name)
+        finally:
+            f.close()
+
 class OperationDataImportPlugin(OperationDataImportBase):
     """Import data using a plugin."""
 
@@ -1090,6 +1173,7 @@ class OperationDataImportPlugin(OperationDataImportBase):
     def doImport(self, document):
         """Do import."""
 
+        document.loadPlugins(registry='importpluginregistry')
         pluginnames = [p.name for p in plugins.importpluginregistry]
         plugin = plugins.importpluginregistry[
             pluginnames.index(self.params.plugin)]
@@ -1273,6 +1357,7 @@ class OperationDatasetSetVal(object):
     """Set a value in the dataset."""
 
     descr = _('change dataset value')
+    describeschanges = True
     
     def __init__(self, datasetname, columnname, row, val):
         """Set row in column columnname to val."""
@@ -1287,19 +1372,22 @@ class OperationDatasetSetVal(object):
         datacol = getattr(ds, self.columnname)
         self.oldval = datacol[self.row]
         datacol[self.row] = self.val
-        ds.changeValues(self.columnname, datacol)
+        ds.changeValues(self.columnname, datacol,
+                        rows=(self.row, self.row+1))
 
     def undo(self, document):
         """Restore the value."""
         ds = document.data[self.datasetname]
         datacol = getattr(ds, self.columnname)
         datacol[self.row] = self.oldval
-        ds.changeValues(self.columnname, datacol)
+        ds.changeValues(self.columnname, datacol,
+                        rows=(self.row, self.row+1))
     
 class OperationDatasetSetVal2D(object):
     """Set a value in a 2D dataset."""
 
     descr = _('change 2D dataset value')
+    describeschanges = True
 
     def __init__(self, datasetname, row, col, val):
         """Set row in column columnname to val."""
@@ -1313,18 +1401,19 @@ class OperationDatasetSetVal2D(object):
         ds = document.data[self.datasetname]
         self.oldval = ds.data[self.row, self.col]
         ds.data[self.row, self.col] = self.val
-        document.modifiedData(ds)
+        document.modifiedData(ds, rows=(self.row, self.row+1))
 
     def undo(self, document):
         """Restore the value."""
         ds = document.data[self.datasetname]
         ds.data[self.row, self.col] = self.oldval
-        document.modifiedData(ds)
+        document.modifiedData(ds, rows=(self.row, self.row+1))
 
 class OperationDatasetDeleteRow(object):
     """Delete a row or several in the dataset."""
 
     descr = _('delete dataset row')
+    describeschanges = True
     
     def __init__(self, datasetname, row, numrows=1):
         """Delete a row in a dataset."""
@@ -1346,6 +1435,7 @@ class OperationDatasetInsertRow(object):
     """Insert a row or several in the dataset."""
 
     descr = _('insert dataset row')
+    describeschanges = True
     
     def __init__(self, datasetname, row, numrows=1):
         """Delete a row in a dataset."""
@@ -1407,6 +1497,12 @@ class OperationMultiple(object):
     def addOperation(self, op):
         """Add an operation to the list of operations."""
         self.operations.append(op)
+
+    @property
+    def describeschanges(self):
+        """Do all the operations tell the document what they change?"""
+        return all([getattr(op, 'describeschanges', False)
+                    for op in self.operations])
         
     def do(self, document):
         """Do the multiple operations."""
@@ -1424,6 +1520,8 @@ class OperationLoadStyleSheet(OperationMultiple):
     """An operation to load a stylesheet."""
     
     descr = _('load stylesheet')
+    # commands in file may change the document directly
+    describeschanges = False
 
     def __init__(self, filename):
         """Load stylesheet with filename."""
@@ -1451,6 +1549,9 @@ class OperationLoadCustom(OperationLoadStyleSheet):
 
 class OperationToolsPlugin(OperationMultiple):
     """An operation to represent what a tools plugin does."""
+
+    # plugins may change the document directly
+    describeschanges = False
     
     def __init__(self, plugin, fields):
         """Use tools plugin, passing fields."""
@@ -22,6 +22,7 @@
 from __future__ import division
 from .. import qtall as qt4
 from .. import setting
+from .. import utils
 
 try:
     from ..helpers.recordpaint import RecordPaintDevice
@@ -60,8 +61,13 @@ class Painter(qt4.QPainter):
     def __enter__(self):
         #print ' '*len(self.helper.widgetstack), self.widget
         self.helper.widgetstack.append(self.widget)
+        self.profiletoken = None
+        if utils.profiler.enabled:
+            self.profiletoken = utils.profiler.start(
+                'draw', self.widget.path)
 
     def __exit__(self, exc_type, exc_value, traceback):
+        utils.profiler.stop(self.profiletoken)
         self.helper.widgetstack.pop()
 
 class DirectPainter(qt4.QPainter):
@@ -69,10 +75,18 @@ class DirectPainter(qt4.QPainter):
     Use save() and restore() around this.
     """
 
+    # widget being painted (set by PaintHelper.painter)
+    widget = None
+
     def __enter__(self):
-        pass
+        # keep a stack of profiling tokens, as widgets are nested
+        tokens = self.__dict__.setdefault('profiletokens', [])
+        if self.widget is None or not utils.profiler.enabled:
+            tokens.append(None)
+        else:
+            tokens.append(utils.profiler.start('draw', self.widget.path))
     def __exit__(self, exc_type, exc_value, traceback):
-        pass
+        utils.profiler.stop(self.profiletokens.pop())
 
 class PaintHelper(object):
     """Helper used when painting widgets.
@@ -108,6 +122,11 @@ class PaintHelper(object):
         # whether to directly render to a painter or make new layers
         self.directpaint = directpaint
 
+        # whether the final output is a bitmap (recorded layers are
+        # always rendered to images)
+        self.rasteroutput = directpaint is None or isinstance(
+            directpaint.device(), (qt4.QImage, qt4.QPixmap))
+
         # state for root widget
         self.rootstate = None
 
@@ -156,6 +175,7 @@ class PaintHelper(object):
         else:
             # only paint to one output painter
             p = self.directpaint
+            p.widget = widget
             # make sure we get the same state each time
             p.restore()
             p.save()
@@ -165,6 +185,7 @@ class PaintHelper(object):
         p.pagesize = self.pagesize
         p.maxsize = max(*self.pagesize)
         p.dpi = self.dpi[1]
+        p.rasteroutput = self.rasteroutput
 
         if clip is not None:
             p.setClipRect(clip)
@@ -607,7 +607,56 @@ class SimpleRead(object):
 class Read2DError(ValueError):
     pass
 
+# characters which mean a line needs to be split by Stream.find_re
+_special_re = re.compile(r'[#!%;\'"`\\]')
+
+def _streamLines(stream):
+    """Yield lists of items on each line of stream.
+
+    This is a faster version of Stream.newLine, which only uses the
+    regular expression when a line has quotes, comments or
+    continuations."""
+
+    stream.flushLine()
+    items = []
+    while True:
+        try:
+            line = stream.readLine()
+        except StopIteration:
+            return
+
+        if _special_re.search(line) is None:
+            items += line.split()
+        else:
+            cmpts = stream.find_re.findall(line)
+            items += [ x for x in cmpts if x[0] not in '#!%;']
+            if items and items[-1] == '\\':
+                # this is a continuation: drop this item and read next line
+                items.pop()
+                continue
+
+        yield items
+        items = []
+
+def _convertItems(items, numcols):
+    """Convert list of text items to a 2D array with numcols columns."""
+    try:
+        vals = N.array(items, dtype=N.float64)
+    except ValueError:
+        # find the item which could not be converted
+        for v in items:
+            try:
+                float(v)
+            except ValueError:
+                raise Read2DError("Could not interpret number '%s'" % v)
+        raise Read2DError("Could not convert data to 2D matrix")
+    return vals.reshape( (len(items)//numcols, numcols) )
+
 class SimpleRead2D(object):
+
+    # number of items to convert to numbers at once
+    blocksize = 65536
+
     def __init__(self, name, params):
         """Read dataset with name given.
         params is a ImportParams2D object
@@ -665,61 +714,53 @@ class SimpleRead2D(object):
             'transpose': self._paramTranspose
             }
 
-        rows = []
+        blocks = []
+        items = []
+        numrows = numcols = 0
         # loop over lines
-        while stream.newLine():
-            cols = stream.allColumns()
-
+        for cols in _streamLines(stream):
             if len(cols) > 0:
                 # check to see whether parameter is set
                 c = cols[0].lower()
                 if c in settings:
                     settings[c](cols)
-                    stream.flushLine()
                     continue
             else:
                 # if there's data and we get to a blank line, finish
-                if len(rows) != 0:
+                if numrows != 0:
                     break
+                continue
 
-            # read columns
-            line = []
-            while True:
-                v = stream.nextColumn()
-                if v is None:
-                    break
-                try:
-                    line.append( float(v) )
-                except ValueError:
-                    raise Read2DError("Could not interpret number '%s'" % v)
-
-            # add row to dataset
-            if len(line) != 0:
-                if self.params.invertcols:
-                    line.reverse()
-                rows.insert(0, line)
+            # all rows should have the same number of columns
+            if numrows == 0:
+                numcols = len(cols)
+            elif len(cols) != numcols:
+                raise Read2DError("Could not convert data to 2D matrix")
 
-        # swap rows if requested
-        if self.params.invertrows:
-            rows.reverse()
+            # convert items to numbers in blocks
+            items += cols
+            numrows += 1
+            if len(items) >= self.blocksize:
+                blocks.append( _convertItems(items, numcols) )
+                items = []
 
         # dodgy formatting probably...
-        if len(rows) == 0:
+        if numrows == 0:
             raise Read2DError("No data could be imported for dataset")
+        if items:
+            blocks.append( _convertItems(items, numcols) )
 
-        # convert the data to a numpy
-        try:
-            self.data = N.array(rows)
-        except ValueError:
-            raise Read2DError("Could not convert data to 2D matrix")
-
-        # obvious check
-        if len(self.data.shape) != 2:
-            raise Read2DError("Dataset was not 2D")
+        data = blocks[0] if len(blocks) == 1 else N.concatenate(blocks)
 
+        # the rows are in reverse-y order, unless inverted
+        if not self.params.invertrows:
+            data = data[::-1]
+        if self.params.invertcols:
+            data = data[:, ::-1]
         # transpose matrix if requested
         if self.params.transpose:
-            self.data = N.transpose(self.data).copy()
+            data = data.T
+        self.data = N.ascontiguousarray(data)
 
     def setInDocument(self, document, linkedfile=None):
         """Set the data in the document.
@@ -41,7 +41,7 @@ class WidgetFactory(object):
         if name is not None and name.find('/') != -1:
             raise ValueError('name cannot contain "/"')
 
-        w = self.regwidgets[widgetname](parent, name=name)
+        w = self.getWidgetClass(widgetname)(parent, name=name)
 
         # set all the passed default settings
         for name, val in citems(optargs):
@@ -57,12 +57,19 @@ class WidgetFactory(object):
         if index != -1:
             del parent.children[-1]
             parent.children.insert(index, w)
+            parent.invalidateChildIndex()
 
         return w
 
     def getWidgetClass(self, name):
         """Get the class for the widget."""
-        return self.regwidgets[name]
+        try:
+            return self.regwidgets[name]
+        except KeyError:
+            # plugins not run yet may add the widget type
+            from .doc import Document
+            Document.loadPlugins()
+            return self.regwidgets[name]
 
     def listWidgets(self):
         """Return an array of the widgets the factory can make."""
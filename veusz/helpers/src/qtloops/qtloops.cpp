@@ -189,6 +189,74 @@ void plotPathsToPainter(QPainter& painter, QPainterPath& path,
     }
 }
 
+void plotImagesToPainter(QPainter& painter, const QImage& sprites,
+			 int spritewidth, const QPoint& origin,
+			 const Numpy1DObj& x, const Numpy1DObj& y,
+			 const Numpy1DObj* index,
+			 const QRectF* clip)
+{
+  const int spriteheight = sprites.height();
+  const QTransform trans(painter.worldTransform());
+
+  // clipping is done in device coordinates, including sprite size
+  QRectF cliprect( QPointF(-32767,-32767), QPointF(32767,32767) );
+  if( clip != 0 )
+    cliprect = trans.mapRect(*clip);
+  cliprect.adjust(-spritewidth, -spriteheight, spritewidth, spriteheight);
+
+  int size = min(x.dim, y.dim);
+  if( index != 0 )
+    size = min(size, index->dim);
+
+  // device area we can draw on
+  const QRect devrect(0, 0, painter.device()->width(),
+		      painter.device()->height());
+
+  // work out where to put each sprite, skipping duplicate points
+  QVector<QPoint> posns;
+  QVector<int> idxs;
+  QRect bounds;
+  QPointF lastpt(-1e6, -1e6);
+  for(int i = 0; i < size; ++i)
+    {
+      const QPointF pt( trans.map(QPointF(x(i), y(i))) );
+      if( cliprect.contains(pt) && ! smallDelta(lastpt, pt) )
+	{
+	  const QPoint topleft( QPoint(qRound(pt.x()), qRound(pt.y()))
+				- origin );
+	  const QRect r( topleft, QSize(spritewidth, spriteheight) );
+	  if( r.intersects(devrect) )
+	    {
+	      posns.append(topleft);
+	      idxs.append( index != 0 ? int((*index)(i)) : 0 );
+	      bounds |= r;
+	    }
+	  lastpt = pt;
+	}
+    }
+  bounds &= devrect;
+  if( posns.isEmpty() || bounds.isEmpty() )
+    return;
+
+  // composite sprites onto a single layer, so only one image is
+  // drawn (or recorded) on the output painter
+  QImage layer(bounds.size(), QImage::Format_ARGB32_Premultiplied);
+  layer.fill(0);
+  {
+    QPainter layerpainter(&layer);
+    const QPoint offset(bounds.topLeft());
+    for(int i = 0; i < posns.size(); ++i)
+      layerpainter.drawImage( posns[i] - offset, sprites,
+			      QRect(idxs[i]*spritewidth, 0,
+				    spritewidth, spriteheight) );
+  }
+
+  painter.save();
+  painter.setWorldTransform(QTransform());
+  painter.drawImage(bounds.topLeft(), layer);
+  painter.restore();
+}
+
 void plotLinesToPainter(QPainter& painter,
 			const Numpy1DObj& x1, const Numpy1DObj& y1,
 			const Numpy1DObj& x2, const Numpy1DObj& y2,
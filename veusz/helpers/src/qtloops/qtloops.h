@@ -28,6 +28,7 @@
 #include <QPainterPath>
 #include <QRectF>
 #include <QImage>
+#include <QPoint>
 
 class QtLoops {
 public:
@@ -53,6 +54,17 @@ void plotPathsToPainter(QPainter& painter, QPainterPath& path,
 			const QRectF* clip = 0,
 			const QImage* colorimg = 0);
 
+// plot sprites from an image to painter at x and y
+// sprites contains sprites of width spritewidth next to each other
+// origin is the position within each sprite of the marker centre
+// if index is not 0, it is an array giving the sprite number to use
+// clip is a clipping rectangle if set
+void plotImagesToPainter(QPainter& painter, const QImage& sprites,
+			 int spritewidth, const QPoint& origin,
+			 const Numpy1DObj& x, const Numpy1DObj& y,
+			 const Numpy1DObj* index = 0,
+			 const QRectF* clip = 0);
+
 void plotLinesToPainter(QPainter& painter,
 			const Numpy1DObj& x1, const Numpy1DObj& y1,
 			const Numpy1DObj& x2, const Numpy1DObj& y2,
@@ -24,7 +24,7 @@ from __future__ import division
 import numpy as N
 from . import field
 
-from ..compat import czip, citems, cstr
+from ..compat import czip, citems, cstr, cbasestr
 from .. import utils
 try:
     from ..helpers import qtloops
@@ -201,28 +201,43 @@ class DatasetPluginHelper(object):
     def __init__(self, doc):
         """Construct helper object to pass to DatasetPlugins."""
         self._doc = doc
+        # names of datasets read, or None if any could be read
+        self._accessed = set()
+
+    def _noteAccess(self, names):
+        """Record datasets read by plugin."""
+        if self._accessed is not None:
+            self._accessed.update(names)
+
+    def _noteAccessAll(self):
+        """Record that plugin may have read any dataset."""
+        self._accessed = None
 
     @property
     def datasets1d(self):
         """Return list of existing 1D numeric datasets"""
+        self._noteAccessAll()
         return [name for name, ds in citems(self._doc.data) if
                 (ds.dimensions == 1 and ds.datatype == 'numeric')]
 
     @property
     def datasets2d(self):
         """Return list of existing 2D numeric datasets"""
+        self._noteAccessAll()
         return [name for name, ds in citems(self._doc.data) if
                 (ds.dimensions == 2 and ds.datatype == 'numeric')]
 
     @property
     def datasetstext(self):
         """Return list of existing 1D text datasets"""
+        self._noteAccessAll()
         return [name for name, ds in citems(self._doc.data) if
                 (ds.dimensions == 1 and ds.datatype == 'text')]
 
     @property
     def datasetsdatetime(self):
         """Return list of existing date-time datesets"""
+        self._noteAccessAll()
         from .. import document
         return [name for name, ds in citems(self._doc.data) if
                 isinstance(ds, document.DatasetDateTime)]
@@ -239,6 +254,8 @@ class DatasetPluginHelper(object):
 
         Returns None if expression could not be evaluated.
         """
+        from .. import document
+        self._noteAccess(document.expressionDatasetNames(expr, part))
         ds = self._doc.evalDatasetExpression(expr, part=part)
         if ds is not None:
             return ds.data
@@ -256,6 +273,7 @@ class DatasetPluginHelper(object):
         dimensions not right: raise a DatasetPluginException
         """
         from .. import document
+        self._noteAccess([name])
         try:
             ds = self._doc.data[name]
         except KeyError:
@@ -290,6 +308,7 @@ class DatasetPluginHelper(object):
         name not found: raise a DatasetPluginException
         """
 
+        self._noteAccess([name])
         try:
             ds = self._doc.data[name]
         except KeyError:
@@ -310,11 +329,17 @@ class DatasetPluginManager(object):
         fields - fields to pass to plugin
         """
         
+        from ..document import dependencies
+
         self.plugin = plugin
         self.document = doc
         self.helper = DatasetPluginHelper(doc)
         self.fields = dict(fields)
-        self.changeset = -1
+        self.raiseerrors = False
+
+        # node in graph of dataset dependencies
+        self.node = dependencies.DependencyNode(
+            self.inputDatasets, self.runPlugin, descr=plugin.name)
 
         self.fixMissingFields()
         self.setupDatasets()
@@ -338,6 +363,27 @@ class DatasetPluginManager(object):
             veuszds.document = self.document
             self.veuszdatasets.append(veuszds)
 
+    def inputDatasets(self):
+        """Return names of datasets read by the plugin, or None if
+        it could read any.
+
+        These are the datasets given in the plugin's dataset fields,
+        plus any read from the helper when the plugin last ran."""
+
+        if self.helper._accessed is None:
+            return None
+
+        names = set(self.helper._accessed)
+        for pluginfield in self.plugin.fields:
+            val = self.fields.get(pluginfield.name)
+            if isinstance(val, cbasestr):
+                val = [val]
+            if isinstance(pluginfield, (field.FieldDataset,
+                                        field.FieldDatasetMulti)):
+                names.update(val or [])
+        names.discard('')
+        return sorted(names)
+
     def nullDatasets(self):
         """Clear out contents of datasets."""
         for ds in self.datasets:
@@ -366,22 +412,28 @@ class DatasetPluginManager(object):
         fileobj.write( 'DatasetPlugin(%s)\n' % (', '.join(args)) )
 
     def update(self, raiseerrors=False):
-        """Update created datasets.
+        """Update created datasets, if the datasets read by the plugin
+        have changed.
 
         if raiseerrors is True, raise an exception if there is an exeception
         when updating the dataset
         """
 
-        if self.document.changeset == self.changeset:
-            return
-        self.changeset = self.document.changeset
+        self.raiseerrors = raiseerrors
+        try:
+            self.node.update(self.document)
+        finally:
+            self.raiseerrors = False
+
+    def runPlugin(self):
+        """Run the plugin with its parameters."""
 
-        # run the plugin with its parameters
+        self.helper._accessed = set()
         try:
             self.plugin.updateDatasets(self.fields, self.helper)
         except DatasetPluginException as ex:
             # this is for immediate notification
-            if raiseerrors:
+            if self.raiseerrors:
                 raise
 
             # otherwise if there's an error, then log and null outputs
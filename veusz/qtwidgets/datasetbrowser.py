@@ -37,6 +37,9 @@ def _(text, disambiguation=None, context="DatasetBrowser"):
     """Translate text."""
     return qt4.QCoreApplication.translate(context, text, disambiguation)
 
+# cache of dataset preview images
+previewcache = utils.LRUCache(128)
+
 def datasetLinkFile(ds):
     """Get a linked filename from a dataset."""
     if ds.linked is None:
@@ -134,7 +137,11 @@ class DatasetNode(TMNode):
         elif c == "size" or (c == 'type' and 'size' not in self.cols):
             text = ds.userPreview()
             # add preview of dataset if possible
-            pix = self.getPreviewPixmap(ds)
+            name = self.data[0]
+            pix = previewcache.get(
+                (id(self.doc), name,
+                 document.dependencies.datasetVersion(self.doc, name)),
+                lambda: self.getPreviewPixmap(ds))
             if pix:
                 text = text.replace("\n", "<br>")
                 text = "<html>%s<br>%s</html>" % (text, utils.pixmapAsHtml(pix))
@@ -201,6 +208,12 @@ class DatasetRelationModel(TreeModel):
         TreeModel.__init__(self, (_("Dataset"), _("Size"), _("Type")))
         self.doc = doc
         self.linkednodes = {}
+        # map dataset names to lists of their nodes in the tree
+        self.dsnodes = {}
+        # map group names to group nodes in the tree
+        self.grpnodes = {}
+        # state of each dataset when its nodes were made
+        self.dsstates = {}
         self.grouping = grouping
         self.filter = ""
         self.readonly = readonly
@@ -208,7 +221,7 @@ class DatasetRelationModel(TreeModel):
         self.filterdtype = filterdtype
         self.refresh()
 
-        self.connect(doc, qt4.SIGNAL("sigModified"), self.refresh)
+        self.connect(doc, qt4.SIGNAL("sigModified"), self.slotDocModified)
 
     def datasetFilterOut(self, ds, node):
         """Should dataset be filtered out by filter options."""
@@ -239,9 +252,7 @@ class DatasetRelationModel(TreeModel):
         """Make tree with no grouping."""
         tree = TMNode( (_("Dataset"), _("Size"), _("Type"), _("File")), None )
         for name, ds in citems(self.doc.data):
-            child = DatasetNode( self.doc, name,
-                                 ("name", "size", "type", "linkfile"),
-                                 None )
+            child = DatasetNode( self.doc, name, self.nonecolitems, None )
 
             # add if not filtered for filtering
             if not self.datasetFilterOut(ds, child):
@@ -271,48 +282,54 @@ class DatasetRelationModel(TreeModel):
 
         return treeFromList(list(grpnodes.values()), coltitles)
 
+    # columns of dataset nodes if not grouped
+    nonecolitems = ("name", "size", "type", "linkfile")
+
+    def groupingInfo(self, grouping):
+        """For a grouping return tuple of column titles, columns of
+        dataset nodes, function of dataset returning its groups and
+        class of group node."""
+
+        def getgrptags(ds):
+            if ds.tags:
+                return sorted(ds.tags)
+            else:
+                return [_("None")]
+
+        return {
+            "filename": ( (_("Dataset"), _("Size"), _("Type")),
+                          ("name", "size", "type"),
+                          lambda ds: (datasetLinkFile(ds),),
+                          FilenameNode ),
+            "size": ( (_("Dataset"), _("Type"), _("Filename")),
+                      ("name", "type", "linkfile"),
+                      lambda ds: (ds.userSize(),),
+                      TMNode ),
+            "type": ( (_("Dataset"), _("Size"), _("Filename")),
+                      ("name", "size", "linkfile"),
+                      lambda ds: (ds.dstype,),
+                      TMNode ),
+            "tags": ( (_("Dataset"), _("Size"), _("Type"), _("Filename")),
+                      ("name", "size", "type", "linkfile"),
+                      getgrptags,
+                      TMNode ),
+            }[grouping]
+
     def makeGrpTreeFilename(self):
         """Make a tree of datasets grouped by linked file."""
-        return self.makeGrpTree(
-            (_("Dataset"), _("Size"), _("Type")),
-            ("name", "size", "type"),
-            lambda ds: (datasetLinkFile(ds),),
-            FilenameNode
-            )
+        return self.makeGrpTree(*self.groupingInfo("filename"))
 
     def makeGrpTreeSize(self):
         """Make a tree of datasets grouped by dataset size."""
-        return self.makeGrpTree(
-            (_("Dataset"), _("Type"), _("Filename")),
-            ("name", "type", "linkfile"),
-            lambda ds: (ds.userSize(),),
-            TMNode
-            )
+        return self.makeGrpTree(*self.groupingInfo("size"))
 
     def makeGrpTreeType(self):
         """Make a tree of datasets grouped by dataset type."""
-        return self.makeGrpTree(
-            (_("Dataset"), _("Size"), _("Filename")),
-            ("name", "size", "linkfile"),
-            lambda ds: (ds.dstype,),
-            TMNode
-            )
+        return self.makeGrpTree(*self.groupingInfo("type"))
 
     def makeGrpTreeTags(self):
         """Make a tree of datasets grouped by tags."""
-
-        def getgrp(ds):
-            if ds.tags:
-                return sorted(ds.tags)
-            else:
-                return [_("None")]
-
-        return self.makeGrpTree(
-            (_("Dataset"), _("Size"), _("Type"), _("Filename")),
-            ("name", "size", "type", "linkfile"),
-            getgrp,
-            TMNode
-            )
+        return self.makeGrpTree(*self.groupingInfo("tags"))
 
     def flags(self, idx):
         """Return model flags for index."""
@@ -336,6 +353,77 @@ class DatasetRelationModel(TreeModel):
             idx, idx)
         return True
 
+    def slotDocModified(self):
+        """Update tree if datasets have been changed."""
+        changes = self.doc.pendingchanges
+        if changes.everything:
+            self.refresh()
+        else:
+            # datasets calculated from changed datasets also change
+            for name in sorted(document.dependencies.changedDatasets(
+                    self.doc, changes.datasets)):
+                self.updateDataset(name)
+
+    def datasetState(self, name):
+        """Value which changes if the dataset in the document changes."""
+        ds = self.doc.data.get(name)
+        return id(ds), document.dependencies.datasetVersion(self.doc, name)
+
+    def updateDataset(self, name):
+        """Update nodes for a single dataset in the tree, rather than
+        remaking the whole tree."""
+
+        state = self.datasetState(name)
+        if self.dsstates.get(name) == state:
+            return
+        self.dsstates[name] = state
+
+        # get new node for dataset and its groups
+        groups = []
+        ds = self.doc.data.get(name)
+        if self.grouping == "none":
+            colitems, grouper, GrpNodeClass = self.nonecolitems, None, None
+        else:
+            colitems, grouper, GrpNodeClass = self.groupingInfo(
+                self.grouping)[1:]
+        if ds is not None:
+            newnode = DatasetNode(self.doc, name, colitems, None)
+            if not self.datasetFilterOut(ds, newnode):
+                groups = [None] if grouper is None else list(grouper(ds))
+
+        # update or remove existing nodes
+        nodes = []
+        for node in self.dsnodes.pop(name, []):
+            grp = None if grouper is None else node.parent.data[0]
+            if grp in groups:
+                groups.remove(grp)
+                if node.data != newnode.data:
+                    self.changeNodeData(node, newnode.data)
+                nodes.append(node)
+            else:
+                parent = node.parent
+                self.removeNode(node)
+                if grouper is not None and not parent.childnodes:
+                    # remove empty group
+                    self.removeNode(parent)
+                    del self.grpnodes[grp]
+
+        # add nodes to any new groups
+        for grp in groups:
+            if grouper is None:
+                parent = self.root
+            elif grp in self.grpnodes:
+                parent = self.grpnodes[grp]
+            else:
+                parent = self.grpnodes[grp] = GrpNodeClass( (grp,), None )
+                self.insertNodeSorted(self.root, parent)
+            node = newnode.cloneTo(None)
+            self.insertNodeSorted(parent, node)
+            nodes.append(node)
+
+        if nodes:
+            self.dsnodes[name] = nodes
+
     def refresh(self):
         """Update tree of datasets when document changes."""
 
@@ -349,6 +437,19 @@ class DatasetRelationModel(TreeModel):
 
         self.syncTree(tree)
 
+        # keep track of where datasets are for incremental updates
+        self.dsnodes = {}
+        self.grpnodes = {}
+        for node in self.root.childnodes:
+            if isinstance(node, DatasetNode):
+                self.dsnodes.setdefault(node.data[0], []).append(node)
+            else:
+                self.grpnodes[node.data[0]] = node
+                for child in node.childnodes:
+                    self.dsnodes.setdefault(child.data[0], []).append(child)
+        self.dsstates = dict( [(name, self.datasetState(name))
+                               for name in self.doc.data] )
+
 class DatasetsNavigatorTree(qt4.QTreeView):
     """Tree view for dataset names."""
 
@@ -0,0 +1,475 @@
+#    Copyright (C) 2014 Jeremy S. Sanders
+#    Email: Jeremy Sanders <jeremy@jeremysanders.net>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""Headless render server.
+
+This keeps a set of worker processes running, each with its own warm
+cache of loaded documents, and renders pages from these documents on
+request over HTTP. This avoids paying the startup, plugin loading and
+document execution cost for every exported image.
+
+Documents are only loaded from inside a document root directory,
+which must be given, as vsz documents can run arbitrary Python code.
+
+Requests are made to /render using POST with a JSON object as the
+body. GET is not accepted, so that other web pages cannot make
+requests using links. Parameters are:
+
+ file: filename of the vsz document, relative to the document root
+   (required)
+ format: output format extension, e.g. png, svg, pdf (default png)
+ page: page number to render, starting from 0 (default 0)
+ dpi: dots per inch for bitmap output (default 100)
+ antialias, quality, backcolor, pdfdpi, svgtextastext, color:
+   as in the Export command
+ datasets: dict mapping dataset names to lists of values,
+   or to dicts of column name (data, serr, nerr, perr) to values.
+   These replace the datasets in the document for this request only.
+
+The encoded image is returned as the body of the response. /stats
+returns cache statistics for each worker as JSON.
+
+If an output cache directory is given, rendered files are also
+cached on disk (see document.ExportCache), so unchanged documents are
+not painted again.
+"""
+
+from __future__ import division, print_function
+import os
+import os.path
+import json
+import optparse
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from collections import OrderedDict
+
+from .compat import ( citems, cvalues, cbasestr, chttpserver,
+                      csocketserver, curlparse )
+
+# mime types of output formats
+mimetypes = {
+    'bmp': 'image/bmp',
+    'eps': 'application/postscript',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'pdf': 'application/pdf',
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'tiff': 'image/tiff',
+    'xpm': 'image/x-xpixmap',
+    'emf': 'image/x-emf',
+    }
+
+# parameters passed directly to Export, with conversion function
+exportparams = {
+    'color': lambda x: x not in (False, 'False', 'false', '0', 0),
+    'antialias': lambda x: x not in (False, 'False', 'false', '0', 0),
+    'quality': int,
+    'backcolor': str,
+    'pdfdpi': float,
+    'svgtextastext': lambda x: x not in (False, 'False', 'false', '0', 0),
+    }
+
+class RenderError(Exception):
+    """Raised if a render request is invalid or fails."""
+    pass
+
+def documentMemory(doc):
+    """Estimate the memory used by the datasets in a document, in bytes.
+
+    Only arrays stored directly on datasets are counted, so that
+    expression and plugin datasets are not evaluated.
+    """
+    total = 0
+    for ds in cvalues(doc.data):
+        attrs = vars(ds)
+        for col in ds.columns:
+            total += getattr(attrs.get(col), 'nbytes', 0)
+    return total
+
+def resolveFilename(root, filename):
+    """Return the real path of filename relative to the root directory.
+
+    RenderError is raised if the file is outside root, including
+    through symbolic links.
+    """
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, filename))
+    if not path.startswith(os.path.join(root, '')):
+        raise RenderError('File %s is outside the document root' % filename)
+    return path
+
+class DocumentCache(object):
+    """A least-recently-used cache of loaded documents.
+
+    Documents are reloaded if the modification time of their file
+    changes. Documents are evicted when more than maxdocs are loaded
+    or when their estimated total memory is greater than maxmemory
+    bytes (the most recently used document is always kept).
+    """
+
+    def __init__(self, root, maxdocs=16, maxmemory=512*1024*1024,
+                 exportcache=None):
+        # documents can only be loaded from inside this directory
+        self.root = root
+        self.maxdocs = maxdocs
+        self.maxmemory = maxmemory
+        # optional on-disk cache of rendered output
+        self.exportcache = exportcache
+        # filename -> (mtime, interpreter, memory)
+        self.docs = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def memory(self):
+        """Total estimated memory of cached documents."""
+        return sum([m for mtime, ci, m in cvalues(self.docs)])
+
+    def get(self, filename):
+        """Get a CommandInterpreter for the document, loading if needed.
+        filename is relative to the document root."""
+
+        from . import document
+
+        filename = resolveFilename(self.root, filename)
+        try:
+            mtime = os.stat(filename).st_mtime
+        except EnvironmentError as e:
+            raise RenderError('Cannot access %s: %s' % (filename, e))
+
+        entry = self.docs.pop(filename, None)
+        if entry is not None and entry[0] == mtime:
+            self.hits += 1
+            self.docs[filename] = entry
+            return entry[1]
+
+        self.misses += 1
+        doc = document.Document()
+        ci = document.CommandInterpreter(doc)
+        ci.Load(filename)
+        self.docs[filename] = (mtime, ci, documentMemory(doc))
+        self.evict()
+        return ci
+
+    def evict(self):
+        """Remove old documents until within limits."""
+        while len(self.docs) > 1 and (
+            len(self.docs) > self.maxdocs or self.memory() > self.maxmemory):
+            self.docs.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """Return a dict of statistics about the cache."""
+        out = {
+            'documents': len(self.docs),
+            'memory': self.memory(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            }
+        if self.exportcache is not None:
+            out['output'] = self.exportcache.stats()
+        return out
+
+def _makeDataset(vals):
+    """Make a dataset from the values passed in a request."""
+    from . import document
+
+    if isinstance(vals, dict):
+        cols = dict([(str(k), v) for k, v in citems(vals)])
+        return document.Dataset(**cols)
+    if vals and all([isinstance(v, cbasestr) for v in vals]):
+        return document.DatasetText(vals)
+    return document.Dataset(data=vals)
+
+def renderRequest(cache, req):
+    """Render the request given, returning the encoded output."""
+
+    from . import document
+
+    fmt = req.get('format', 'png').lower().lstrip('.')
+    if fmt not in mimetypes:
+        raise RenderError('Unsupported format %s' % fmt)
+    if 'file' not in req:
+        raise RenderError('No file given')
+
+    ci = cache.get(req['file'])
+    doc = ci.document
+
+    page = int(req.get('page', 0))
+    if page < 0 or page >= doc.getNumberPages():
+        raise RenderError('Invalid page number %i' % page)
+
+    kwargs = {'bitmapdpi': int(req.get('dpi', 100))}
+    for name, conv in citems(exportparams):
+        if name in req:
+            kwargs[name] = conv(req[name])
+
+    # substitute datasets for this request only
+    op = None
+    if req.get('datasets'):
+        op = document.OperationMultiple(
+            [ document.OperationDatasetSet(name, _makeDataset(vals))
+              for name, vals in sorted(citems(req['datasets'])) ],
+            descr='substitute datasets')
+        doc.applyOperation(op)
+
+    fd, tmpname = tempfile.mkstemp(suffix='.'+fmt, prefix='veusz_render_')
+    os.close(fd)
+    try:
+        document.Export(doc, tmpname, page, cache=cache.exportcache,
+                        **kwargs).export()
+        with open(tmpname, 'rb') as f:
+            return f.read()
+    finally:
+        os.unlink(tmpname)
+        if op is not None:
+            doc.undoOperation()
+            doc.clearHistory()
+
+def _workerMain(conn, root, maxdocs, maxmemory, outputcache):
+    """Main loop of worker process.
+
+    outputcache is None or (directory, maxsize) of export cache.
+    """
+
+    from . import qtall as qt4
+    app = qt4.QApplication([])
+
+    # required to get structures initialised
+    from . import widgets
+    from . import document
+    from .utils import textrender
+
+    exportcache = None
+    if outputcache is not None:
+        exportcache = document.ExportCache(
+            outputcache[0], maxsize=outputcache[1])
+    cache = DocumentCache(root, maxdocs=maxdocs, maxmemory=maxmemory,
+                          exportcache=exportcache)
+    while True:
+        try:
+            req = conn.recv()
+        except EOFError:
+            break
+        if req is None:
+            break
+        elif req == 'stats':
+            stats = cache.stats()
+            stats['text'] = textrender.textCacheStats()
+            conn.send( (True, stats) )
+            continue
+
+        try:
+            out = renderRequest(cache, req)
+        except RenderError as e:
+            conn.send( (False, str(e)) )
+        except Exception:
+            conn.send( (False, traceback.format_exc()) )
+        else:
+            conn.send( (True, out) )
+
+class RenderWorker(object):
+    """Proxy for a worker process in the server.
+
+    If the process dies, it is restarted on the next request."""
+
+    def __init__(self, root, maxdocs, maxmemory, outputcache):
+        self.args = (root, maxdocs, maxmemory, outputcache)
+        self.lock = threading.Lock()
+        self.start()
+
+    def start(self):
+        """Start the worker process."""
+        self.conn, childconn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_workerMain, args=(childconn,)+self.args)
+        self.process.daemon = True
+        self.process.start()
+
+    def call(self, req):
+        """Send request to worker and wait for the reply.
+        Returns (ok, reply or error message)."""
+        with self.lock:
+            try:
+                self.conn.send(req)
+                return self.conn.recv()
+            except (EOFError, EnvironmentError) as e:
+                # the process has died, so start another
+                if self.process.is_alive():
+                    self.process.terminate()
+                self.process.join()
+                self.conn.close()
+                self.start()
+                return (False, 'Worker process failed: %s' % (
+                        str(e) or e.__class__.__name__))
+
+    def close(self):
+        with self.lock:
+            try:
+                self.conn.send(None)
+            except EnvironmentError:
+                pass
+        self.process.join()
+
+class RenderPool(object):
+    """A set of worker processes.
+
+    Requests for a document are always sent to the same worker, so
+    that its loaded copy stays warm.
+    """
+
+    def __init__(self, root, numworkers=None, maxdocs=16,
+                 maxmemory=512*1024*1024, outputcache=None):
+        if not numworkers:
+            numworkers = multiprocessing.cpu_count()
+        self.root = root
+        self.workers = [ RenderWorker(root, maxdocs, maxmemory, outputcache)
+                         for i in range(numworkers) ]
+
+    def render(self, req):
+        """Render request, returning (ok, data or error message)."""
+        try:
+            filename = resolveFilename(self.root, req.get('file', ''))
+        except RenderError as e:
+            return (False, str(e))
+        worker = self.workers[hash(filename) % len(self.workers)]
+        return worker.call(req)
+
+    def stats(self):
+        """Get statistics from each worker."""
+        return [w.call('stats')[1] for w in self.workers]
+
+    def close(self):
+        for w in self.workers:
+            w.close()
+
+class RenderRequestHandler(chttpserver.BaseHTTPRequestHandler):
+    """Handle HTTP requests to the server."""
+
+    def _reply(self, code, ctype, body):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, req):
+        path = curlparse.urlparse(self.path).path
+        if path == '/stats':
+            self._reply(200, 'application/json',
+                        json.dumps(self.server.pool.stats()))
+        elif path == '/render':
+            if self.command != 'POST':
+                self._reply(405, 'text/plain', 'Use POST to render')
+                return
+            ok, out = self.server.pool.render(req)
+            if ok:
+                fmt = req.get('format', 'png').lower().lstrip('.')
+                self._reply(200, mimetypes[fmt], out)
+            else:
+                self._reply(400, 'text/plain', out)
+        else:
+            self._reply(404, 'text/plain', 'Not found')
+
+    def do_GET(self):
+        self._handle({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            req = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(req, dict):
+                raise ValueError('Request should be a JSON object')
+        except ValueError as e:
+            self._reply(400, 'text/plain', 'Invalid request: %s' % e)
+            return
+        self._handle(req)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            chttpserver.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+class RenderServer(csocketserver.ThreadingMixIn, chttpserver.HTTPServer):
+    """Threaded HTTP server passing requests to the worker pool."""
+
+    daemon_threads = True
+
+    def __init__(self, address, pool, quiet=False):
+        chttpserver.HTTPServer.__init__(self, address, RenderRequestHandler)
+        self.pool = pool
+        self.quiet = quiet
+
+def run(args=None):
+    """Run the render server with the command line arguments given."""
+
+    parser = optparse.OptionParser(
+        usage='%prog --render-server [options]')
+    parser.add_option('--render-server', action='store_true',
+                      help=optparse.SUPPRESS_HELP)
+    parser.add_option('--root', metavar='DIR',
+                      help='directory containing the documents which can'
+                      ' be rendered (required)')
+    parser.add_option('--host', default='127.0.0.1',
+                      help='address to listen on [default: %default]')
+    parser.add_option('--port', type='int', default=8090,
+                      help='port to listen on [default: %default]')
+    parser.add_option('--workers', type='int', default=0,
+                      help='number of worker processes [default: cpu count]')
+    parser.add_option('--cache-docs', type='int', default=16,
+                      help='documents to keep loaded per worker'
+                      ' [default: %default]')
+    parser.add_option('--cache-memory', type='float', default=512,
+                      help='dataset memory to keep loaded per worker (MB)'
+                      ' [default: %default]')
+    parser.add_option('--output-cache', metavar='DIR',
+                      help='cache rendered output in this directory')
+    parser.add_option('--output-cache-size', type='float', default=256,
+                      help='maximum size of output cache (MB)'
+                      ' [default: %default]')
+    parser.add_option('--quiet', action='store_true',
+                      help='do not log requests')
+    options, args = parser.parse_args(args)
+    if not options.root or not os.path.isdir(options.root):
+        parser.error('--root should be given a directory')
+
+    outputcache = None
+    if options.output_cache:
+        outputcache = ( os.path.abspath(options.output_cache),
+                        int(options.output_cache_size*1024*1024) )
+
+    pool = RenderPool(os.path.realpath(options.root),
+                      numworkers=options.workers,
+                      maxdocs=options.cache_docs,
+                      maxmemory=int(options.cache_memory*1024*1024),
+                      outputcache=outputcache)
+    server = RenderServer((options.host, options.port), pool,
+                          quiet=options.quiet)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    pool.close()
+
+if __name__ == '__main__':
+    run()
@@ -29,6 +29,7 @@ s.fromText('42')
 from __future__ import division
 import re
 import sys
+import copy
 
 import numpy as N
 
@@ -69,16 +70,62 @@ class Setting(object):
         self.formatting = formatting
         self.hidden = hidden
         self.default = value
-        self.onmodified = qt4.QObject()
+        # object to emit modification signals (made when required)
+        self._onmodified = None
         self._val = None
 
         # calls the set function for the val property
         self.val = value
 
+    def __getattr__(self, name):
+        """Look up attributes not set in a clone in its prototype."""
+        try:
+            proto = self.__dict__['_proto']
+        except KeyError:
+            raise AttributeError(name)
+        return getattr(proto, name)
+
     def isWidget(self):
         """Is this object a widget?"""
         return False
 
+    def _getOnModified(self):
+        if self._onmodified is None:
+            self._onmodified = qt4.QObject()
+        return self._onmodified
+
+    onmodified = property(_getOnModified, None, None,
+                          'Object emitting onModified when changed')
+
+    def clone(self):
+        """Make a lightweight copy of this setting.
+
+        Only the value, default, name and parent are stored in the
+        copy. Other attributes are looked up in this setting, unless
+        they are set in the copy.
+        """
+
+        val, default = self._val, self.default
+        # references cache what they point to, so need new ones
+        if isinstance(val, Reference):
+            newval = Reference(val.value)
+        elif isinstance(val, (list, dict)):
+            newval = copy.deepcopy(val)
+        else:
+            newval = val
+        if default is val:
+            default = newval
+        elif isinstance(default, Reference):
+            default = Reference(default.value)
+        elif isinstance(default, (list, dict)):
+            default = copy.deepcopy(default)
+
+        obj = object.__new__(self.__class__)
+        obj.__dict__.update({
+                '_proto': self, 'name': self.name, 'parent': None,
+                '_val': newval, 'default': default, '_onmodified': None})
+        return obj
+
     def _copyHelper(self, before, after, optional):
         """Help copy an object.
 
@@ -129,7 +176,8 @@ class Setting(object):
             # this also removes the linked value if there is one set
             self._val = self.convertTo(v)
 
-        self.onmodified.emit(qt4.SIGNAL("onModified"), True)
+        if self._onmodified is not None:
+            self._onmodified.emit(qt4.SIGNAL("onModified"), True)
 
     val = property(get, set, None,
                    'Get or modify the value of the setting')
@@ -191,7 +239,8 @@ class Setting(object):
         return None
 
     def readDefaults(self, root, widgetname):
-        """Check whether the user has a default for this setting."""
+        """Check whether the user has a default for this setting.
+        Returns True if a default was found."""
 
         deftext = None
         unnamedpath = '%s/%s' % (root, self.name)
@@ -210,6 +259,8 @@ class Setting(object):
         if deftext is not None:
             self.val = self.fromText(deftext)
             self.default = self.val
+            return True
+        return False
 
     def removeDefault(self):
         """Remove the default setting for this setting."""
@@ -276,7 +327,8 @@ class Setting(object):
 
     def removeOnModified(self, fn):
         """Remove the function from the list of function to be called."""
-        self.onmodified.disconnect(self.onmodified, 0, fn, 0)
+        if self._onmodified is not None:
+            self._onmodified.disconnect(self._onmodified, 0, fn, 0)
 
     def newDefault(self, value):
         """Update the default and the value."""
@@ -1326,8 +1378,20 @@ class DatasetOrStr(Dataset):
         if doc:
             ds = doc.data.get(self.val)
             if ds:
-                return doc.formatValsWithDatatypeToText(
-                    ds.data, ds.displaytype)
+                if ds.displaytype == 'text':
+                    return ds.data
+
+                # keep formatted values until the dataset changes
+                # (the version changes if derived datasets recalculate)
+                from ..document.dependencies import datasetVersion
+                key = ( self.val, datasetVersion(doc, self.val),
+                        ds.displaytype, doc.locale.name() )
+                cache = getattr(self, '_textcache', None)
+                if cache is None or cache[0] != key:
+                    cache = self._textcache = (
+                        key, doc.formatValsWithDatatypeToText(
+                            ds.data, ds.displaytype))
+                return list(cache[1])
         if checknull and not self.val:
             return None
         else:
@@ -1553,12 +1617,27 @@ class WidgetChoice(Str):
         Returns Image object if succeeds or None if fails
         """
 
-        widgets = self.getWidgetList()
-        try:
-            return widgets[self.get()]
-        except KeyError:
+        # find parent of widget which contains setting
+        widget = self.parent
+        while not widget.isWidget() and widget is not None:
+            widget = widget.parent
+        if widget is None or widget.parent is None:
             return None
 
+        # Search a level at a time, as in buildWidgetList, so we can
+        # stop as soon as the widget is found. Widgets of the
+        # requested types are not searched inside.
+        name = self.get()
+        level = [widget.parent]
+        while level:
+            for w in level:
+                child = w.getChild(name)
+                if child is not None and child.typename in self.widgettypes:
+                    return child
+            level = [c for w in level for c in w.children
+                     if c.typename not in self.widgettypes]
+        return None
+
     def makeControl(self, *args):
         """Allows user to choose an image widget or enter a name."""
         return controls.WidgetChoice(self, self.getDocument(), *args)
@@ -39,10 +39,22 @@ defaultValues = {
     'export_background': '#ffffff00',
     'export_SVG_text_as_text': False,
 
+    # on-disk cache of exported files (size in MB)
+    'export_cache': False,
+    'export_cache_dir': '',
+    'export_cache_size': 256,
+
+    # undo history: number of steps and memory limit (MB)
+    'undo_steps': 10,
+    'undo_memory_limit': 512,
+
     # plot options
     'plot_updatepolicy': -1, # update on document changed
     'plot_antialias': True,
     'plot_numthreads': 2,
+    # render other pages when idle and cache them (size in MB)
+    'plot_prefetch': True,
+    'plot_pagecache': 128,
 
     # recent files list
     'main_recentfiles': [],
@@ -190,6 +202,13 @@ class _SettingDB(object):
         """Is the key in the database."""
         return key in self.database
 
+    def hasKeyPrefix(self, prefix):
+        """Is there a key in the database starting with prefix?"""
+        for key in self.database:
+            if key.startswith(prefix):
+                return True
+        return False
+
 # create the SettingDB singleton
 settingdb = _SettingDB()
 
@@ -21,6 +21,7 @@
 from __future__ import division
 from ..compat import citems
 from .reference import Reference
+from .settingdb import settingdb
 
 class Settings(object):
     """A class for holding collections of settings."""
@@ -59,6 +60,25 @@ class Settings(object):
             s.add( self.setdict[name].copy() )
         return s
 
+    def clone(self):
+        """Make a lightweight copy of the settings and its subsettings.
+
+        The copied Setting objects look up attributes which have not
+        been changed in the originals (see Setting.clone).
+        """
+
+        obj = object.__new__(self.__class__)
+        d = obj.__dict__
+        d.update(self.__dict__)
+        d['setdict'] = setdict = {}
+        d['setnames'] = list(self.setnames)
+        d['parent'] = None
+        for name in self.setnames:
+            child = self.setdict[name].clone()
+            child.parent = obj
+            setdict[name] = child
+        return obj
+
     def isWidget(self):
         """Is this object a widget?"""
         return False
@@ -224,11 +244,22 @@ class Settings(object):
         above this one
 
         widgetname is the name of the widget this setting belongs to
+
+        Returns True if any defaults were found
         """
 
         root = '%s/%s' % (root, self.name)
+
+        # quick check whether there are any defaults to look for
+        if ( not settingdb.hasKeyPrefix(root + '/') and
+             not settingdb.hasKeyPrefix('%s_NAME:%s/' % (widgetname, root)) ):
+            return False
+
+        found = False
         for s in list(self.setdict.values()):
-            s.readDefaults(root, widgetname)
+            if s.readDefaults(root, widgetname):
+                found = True
+        return found
 
     def linkToStylesheet(self, _root=None):
         """Link the settings within this Settings to a stylesheet.
@@ -19,6 +19,7 @@
 ###############################################################################
 
 from .version import version
+from .profiler import profiler
 from .textrender import Renderer, FontMetrics
 from .safe_eval import compileChecked, SafeEvalException
 from .fitlm import fitLM
@@ -35,8 +36,10 @@ from .extbrushfilling import *
 try:
     from ..helpers.qtloops import addNumpyToPolygonF, plotPathsToPainter, \
         plotLinesToPainter, plotClippedPolyline, polygonClip, \
-        plotClippedPolygon, plotBoxesToPainter, addNumpyPolygonToPath
+        plotClippedPolygon, plotBoxesToPainter, addNumpyPolygonToPath, \
+        plotImagesToPainter
 except ImportError:
     from .slowfuncs import addNumpyToPolygonF, plotPathsToPainter, \
         plotLinesToPainter, plotClippedPolyline, polygonClip, \
-        plotClippedPolygon, plotBoxesToPainter, addNumpyPolygonToPath
+        plotClippedPolygon, plotBoxesToPainter, addNumpyPolygonToPath, \
+        plotImagesToPainter
@@ -114,6 +114,20 @@ def dateFloatToString(f):
     else:
         return cstr(f)
 
+def dateFloatsToStrings(vals):
+    """Convert an array of date floats to a list of strings.
+
+    This is the same as dateFloatToString for each value, but each
+    distinct value is only converted once."""
+
+    vals = N.asarray(vals, dtype=N.float64)
+    if len(vals) == 0:
+        return []
+    uniq, inverse = N.unique(vals, return_inverse=True)
+    strs = [ floatToDateTime(v).isoformat() if f else cstr(v)
+             for v, f in zip(uniq.tolist(), N.isfinite(uniq).tolist()) ]
+    return [strs[i] for i in inverse.tolist()]
+
 def datetimeToTuple(dt):
     """Return tuple (year,month,day,hour,minute,second,microsecond) from
     datetime object."""
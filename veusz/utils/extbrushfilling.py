@@ -26,6 +26,9 @@ import numpy as N
 from .. import qtall as qt4
 import math
 
+from ..compat import crange
+from .utilfuncs import LRUCache, penKey
+
 try:
     from ..helpers.qtloops import plotLinesToPainter, polygonClip
 except ImportError:
@@ -46,19 +49,9 @@ def dumppath(p):
             i += 3
     print()
 
-def _hatcher(painter, pen, painterpath, spacing, hatchlist):
-    """Draw hatching on painter path given."""
-
-    painter.save()
-    painter.setPen(pen)
-
-    # debugging
-    # dumppath(painterpath)
-
-    painter.setClipPath(painterpath, qt4.Qt.IntersectClip)
-
-    # this is the bounding box of the path
-    bb = painter.clipPath().boundingRect()
+def _hatchLines(bb, spacing, hatchlist):
+    """Yield arrays x1, y1, x2, y2 of the hatching lines for each
+    set of lines in hatchlist, covering the box bb."""
 
     for params in hatchlist:
         # scale values
@@ -97,16 +90,113 @@ def _hatcher(painter, pen, painterpath, spacing, hatchlist):
         idx = N.arange(-numsteps, numsteps)
         x = idx*deltax + startx
         y = idx*deltay + starty
-        x1 = x - scale*linedx
-        x2 = x + scale*linedx
-        y1 = y - scale*linedy
-        y2 = y + scale*linedy
+        yield ( x - scale*linedx, y - scale*linedy,
+                x + scale*linedx, y + scale*linedy )
+
+def _hatcher(painter, pen, painterpath, spacing, hatchlist):
+    """Draw hatching on painter path given."""
+
+    painter.save()
+    painter.setPen(pen)
+
+    # debugging
+    # dumppath(painterpath)
 
+    painter.setClipPath(painterpath, qt4.Qt.IntersectClip)
+
+    # this is the bounding box of the path
+    bb = painter.clipPath().boundingRect()
+
+    for x1, y1, x2, y2 in _hatchLines(bb, spacing, hatchlist):
         # plot lines, clipping to bb
         plotLinesToPainter(painter, x1, y1, x2, y2, bb)
 
     painter.restore()
 
+## cached hatching for bitmap output
+# The device is split into square cells. The hatching for each cell
+# is drawn once into an image, then copied for each filled shape,
+# clipped by the shape.
+
+# size of cells in device pixels
+hatch_cell_size = 128
+# maximum number of cell images to cache
+hatch_cache_size = 512
+
+hatchcache = LRUCache(hatch_cache_size)
+
+def _makeHatchCell(pen, spacing, hatchlist, trans, cellx, celly,
+                   antialias):
+    """Draw the hatching for the cell with device position cellx,
+    celly into an image."""
+
+    size = hatch_cell_size
+    img = qt4.QImage(size, size, qt4.QImage.Format_ARGB32_Premultiplied)
+    img.fill(0)
+
+    painter = qt4.QPainter(img)
+    painter.setRenderHint(qt4.QPainter.Antialiasing, antialias)
+    painter.setWorldTransform(
+        trans * qt4.QTransform.fromTranslate(-cellx, -celly))
+    painter.setPen(pen)
+
+    # box in logical coordinates, expanded so lines just outside
+    # the cell are included
+    bb = trans.inverted()[0].mapRect(
+        qt4.QRectF(cellx, celly, size, size))
+    margin = pen.widthF()*2 + 2
+    bb.adjust(-margin, -margin, margin, margin)
+
+    for x1, y1, x2, y2 in _hatchLines(bb, spacing, hatchlist):
+        plotLinesToPainter(painter, x1, y1, x2, y2, bb, False)
+    painter.end()
+    return img
+
+def _hatcherCached(painter, pen, painterpath, spacing, hatchlist):
+    """Draw hatching on a bitmap painter by copying cached cells.
+
+    Returns False if this is not possible for the painter state, so
+    that _hatcher should be used instead.
+    """
+
+    # only translation and scaling allowed
+    trans = painter.worldTransform()
+    if trans.type() > qt4.QTransform.TxScale:
+        return False
+
+    devbb = trans.mapRect(painterpath.boundingRect())
+    if painter.hasClipping():
+        # only bother drawing cells inside the existing clip region
+        devbb = devbb.intersected(
+            trans.mapRect(painter.clipPath().boundingRect()))
+    if devbb.isEmpty():
+        return True
+
+    size = hatch_cell_size
+    cx1 = int(math.floor(devbb.left() / size))
+    cx2 = int(math.floor(devbb.right() / size))
+    cy1 = int(math.floor(devbb.top() / size))
+    cy2 = int(math.floor(devbb.bottom() / size))
+
+    antialias = painter.testRenderHint(qt4.QPainter.Antialiasing)
+    basekey = ( hatchlist, spacing, penKey(pen), trans.m11(), trans.m22(),
+                trans.dx(), trans.dy(), antialias )
+
+    painter.save()
+    painter.setClipPath(painterpath, qt4.Qt.IntersectClip)
+    # the clip is kept in device coordinates, so images can be drawn
+    # unscaled
+    painter.setWorldTransform(qt4.QTransform())
+    for cy in crange(cy1, cy2+1):
+        for cx in crange(cx1, cx2+1):
+            img = hatchcache.get(
+                basekey + (cx, cy),
+                lambda: _makeHatchCell(pen, spacing, hatchlist, trans,
+                                       cx*size, cy*size, antialias))
+            painter.drawImage(qt4.QPoint(cx*size, cy*size), img)
+    painter.restore()
+    return True
+
 # list of fill styles
 extfillstyles = (
     'solid', 'horizontal', 'vertical', 'cross',
@@ -230,7 +320,10 @@ def brushExtFillPath(painter, extbrush, path, ignorehide=False,
         # do hatching with spacing
         spacing = extbrush.get('patternspacing').convert(painter)
         if spacing > 0:
-            _hatcher(painter, pen, path, spacing, _hatchmap[style])
+            hatchlist = _hatchmap[style]
+            if ( not getattr(painter, 'rasteroutput', False) or
+                 not _hatcherCached(painter, pen, path, spacing, hatchlist) ):
+                _hatcher(painter, pen, path, spacing, hatchlist)
 
         if stroke is not None:
             painter.strokePath(path, stroke)
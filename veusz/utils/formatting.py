@@ -20,6 +20,9 @@ from __future__ import division
 import re
 import math
 
+import numpy as N
+
+from ..compat import czip
 from . import dates
 
 _formaterror = 'FormatError'
@@ -222,3 +225,42 @@ def formatNumber(num, format, locale=None):
         format = format[:m.start()] + out + format[m.end():]
 
     return format
+
+def formatNumbers(vals, format, locale=None):
+    """Format an array of numbers, returning a list of strings.
+
+    This gives the same output as calling formatNumber for each
+    value, but is much faster for the common %Vg and %g formats. Each
+    distinct value is only formatted once.
+    """
+
+    vals = N.asarray(vals, dtype=N.float64)
+    if format not in ('%Vg', '%g') or len(vals) == 0:
+        return [formatNumber(v, format, locale=locale) for v in vals]
+
+    uniq, inverse = N.unique(vals, return_inverse=True)
+
+    if format == '%g':
+        strs = ['%g' % v for v in uniq.tolist()]
+        text = '\n'.join(strs)
+    else:
+        # these switch to scientific notation in formatGeneral
+        # (infinite values are left as inf)
+        absv = N.abs(uniq)
+        sci = ( ((absv >= 1e4) | ((absv < 1e-2) & (absv > 1e-110))) &
+                N.isfinite(uniq) )
+
+        strs = []
+        for v, s in czip(uniq.tolist(), sci.tolist()):
+            if s:
+                strs.append( formatSciNotation(v, '') )
+            else:
+                strs.append( '%.10g' % v )
+        text = '\n'.join(strs).replace('-', u'\u2212')
+
+    # do replacements in one go for speed
+    if locale is not None:
+        text = text.replace('.', locale.decimalPoint())
+    strs = text.split('\n')
+
+    return [strs[i] for i in inverse.tolist()]
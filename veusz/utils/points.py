@@ -19,15 +19,21 @@
 ###############################################################################
 
 from __future__ import division
+import math
+
+from ..compat import cbytes, crange
 from .. import qtall as qt4
 import numpy as N
 
 try:
-    from ..helpers.qtloops import plotPathsToPainter
+    from ..helpers.qtloops import plotPathsToPainter, plotImagesToPainter
 except ImportError:
     from .slowfuncs import plotPathsToPainter
+    # no point using sprites if we have to loop in python
+    plotImagesToPainter = None
 
 from . import colormap
+from .utilfuncs import LRUCache, penKey
 
 """This is the symbol plotting part of Veusz
 
@@ -365,6 +371,147 @@ def getPainterPath(painter, name, size):
     else:
         raise ValueError("Invalid marker name %s" % name)
 
+#######################################################################
+## pre-rendered markers for bitmap output
+
+# use sprites if at least this many markers are plotted
+sprite_min_points = 64
+# maximum number of sprites (i.e. distinct colours) in a single plot
+sprite_max_colors = 256
+# maximum number of sprites to keep in the cache
+sprite_cache_size = 1024
+# sprites are copied to whole pixels, so when antialiasing, sprites
+# are drawn at this many sub-pixel offsets in each direction and the
+# nearest is used
+sprite_phases = 4
+# maximum width of the image holding the sprites for a plot
+sprite_max_width = 32767
+
+spritecache = LRUCache(sprite_cache_size)
+
+def _spriteGeometry(path, pen, sx, sy):
+    """Get sprite size and marker origin inside sprite."""
+    box = qt4.QTransform.fromScale(sx, sy).mapRect(path.boundingRect())
+    if pen.style() == qt4.Qt.NoPen:
+        margin = 0.
+    elif pen.isCosmetic():
+        margin = max(pen.widthF(), 1.)
+    else:
+        # allow for mitred joins
+        margin = pen.widthF()*max(abs(sx), abs(sy))*max(pen.miterLimit(), 1.)
+    margin += 2
+    ox = int(math.ceil(margin - box.left()))
+    oy = int(math.ceil(margin - box.top()))
+    w = int(math.ceil(ox + box.right() + margin))
+    h = int(math.ceil(oy + box.bottom() + margin))
+    return w, h, qt4.QPoint(ox, oy)
+
+def _makeMarkerSprite(path, pen, brush, sx, sy, w, h, origin, antialias):
+    """Render marker to an image, with its centre at origin (a QPointF)."""
+    img = qt4.QImage(w, h, qt4.QImage.Format_ARGB32_Premultiplied)
+    img.fill(0)
+    painter = qt4.QPainter(img)
+    painter.setRenderHint(qt4.QPainter.Antialiasing, antialias)
+    painter.translate(origin.x(), origin.y())
+    painter.scale(sx, sy)
+    painter.setPen(pen)
+    painter.setBrush(brush)
+    painter.drawPath(path)
+    painter.end()
+    return img
+
+def _plotMarkerSprites(painter, path, markername, markersize,
+                       xpos, ypos, clip, colorimg):
+    """Plot markers by copying cached images of them.
+
+    Returns False if this is not possible for the painter state, so
+    that the path should be used instead.
+    """
+
+    if plotImagesToPainter is None:
+        return False
+
+    # only translation and scaling allowed
+    trans = painter.worldTransform()
+    if trans.type() > qt4.QTransform.TxScale:
+        return False
+    sx, sy = trans.m11(), trans.m22()
+
+    pen = painter.pen()
+    brush = painter.brush()
+    if brush.style() not in (qt4.Qt.NoBrush, qt4.Qt.SolidPattern):
+        return False
+
+    # colours of sprites, and which sprite each point uses
+    index = None
+    if colorimg is None:
+        colors = [brush.color().rgba()]
+    else:
+        numpts = min(len(xpos), len(ypos), colorimg.width())
+        bits = colorimg.convertToFormat(qt4.QImage.Format_ARGB32).constBits()
+        pixels = N.frombuffer(cbytes(bits.asstring(numpts*4)),
+                              dtype=N.uint32)
+        colors, index = N.unique(pixels, return_inverse=True)
+        if len(colors) > sprite_max_colors:
+            return False
+        index = index.astype(N.float64)
+        xpos, ypos = xpos[:numpts], ypos[:numpts]
+
+    w, h, origin = _spriteGeometry(path, pen, sx, sy)
+    antialias = painter.testRenderHint(qt4.QPainter.Antialiasing)
+    phases = sprite_phases if antialias else 1
+    numphases = phases*phases
+    if w*len(colors)*numphases > sprite_max_width:
+        return False
+    basekey = ( markername, markersize, penKey(pen), brush.style(), sx, sy,
+                antialias )
+
+    xpos = N.asarray(xpos, dtype=N.float64)
+    ypos = N.asarray(ypos, dtype=N.float64)
+    if phases > 1:
+        # choose sprite drawn nearest to the offset of each point
+        # from the pixel it is rounded to
+        def phase(devpos):
+            frac = N.nan_to_num(devpos - N.floor(devpos+0.5)) + 0.5
+            return N.clip(N.floor(frac*phases), 0, phases-1)
+        pointphase = ( phase(ypos*sy + trans.dy())*phases +
+                       phase(xpos*sx + trans.dx()) )
+        if index is None:
+            index = pointphase
+        else:
+            index = index*numphases + pointphase
+        used = set(N.unique(index).astype(N.int64).tolist())
+    else:
+        used = set(crange(len(colors)))
+
+    # put sprites for each colour (and offset) next to each other in
+    # one image
+    sprites = qt4.QImage(w*len(colors)*numphases, h,
+                         qt4.QImage.Format_ARGB32_Premultiplied)
+    sprites.fill(0)
+    spritepainter = qt4.QPainter(sprites)
+    for i, rgba in enumerate(colors):
+        rgba = int(rgba)
+        b = brush
+        if brush.style() != qt4.Qt.NoBrush:
+            b = qt4.QBrush(qt4.QColor.fromRgba(rgba))
+        for p in crange(numphases):
+            idx = i*numphases + p
+            if idx not in used:
+                continue
+            centre = qt4.QPointF(
+                origin.x() + ((p % phases)+0.5)/phases - 0.5,
+                origin.y() + ((p // phases)+0.5)/phases - 0.5)
+            img = spritecache.get(
+                basekey + (rgba, p),
+                lambda: _makeMarkerSprite(path, pen, b, sx, sy, w, h,
+                                          centre, antialias))
+            spritepainter.drawImage(idx*w, 0, img)
+    spritepainter.end()
+
+    plotImagesToPainter(painter, sprites, w, origin, xpos, ypos, index, clip)
+    return True
+
 #######################################################################
 ## external interfaces
 
@@ -440,8 +587,14 @@ def plotMarkers(painter, xpos, ypos, markername, markersize, scaling=None,
         colorimg = colormap.applyColorMap(
             cmap, 'linear', color2d, 0., 1., trans)
 
-    # this is the fast (C++) or slow (python) helper
-    plotPathsToPainter(painter, path, xpos, ypos, scaling, clip, colorimg)
+    # for bitmap output, draw copies of a pre-rendered marker if
+    # possible, otherwise draw the path at each point
+    if not ( getattr(painter, 'rasteroutput', False) and
+             scaling is None and len(xpos) >= sprite_min_points and
+             _plotMarkerSprites(painter, path, markername, markersize,
+                                xpos, ypos, clip, colorimg) ):
+        # this is the fast (C++) or slow (python) helper
+        plotPathsToPainter(painter, path, xpos, ypos, scaling, clip, colorimg)
 
     painter.restore()
 
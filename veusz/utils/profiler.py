@@ -0,0 +1,167 @@
+#    Copyright (C) 2014 Jeremy S. Sanders
+#    Email: Jeremy Sanders <jeremy@jeremysanders.net>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+###############################################################################
+
+"""Record where time is spent drawing, importing and evaluating.
+
+Events are recorded in categories ('draw', 'dataDraw', 'operation',
+'import', 'expression' and 'dataset') while the profiler is enabled.
+If the tracemalloc module is available, the change in allocated
+memory during each event is also recorded.
+
+Use profiler.record(category, name) as a context manager, or
+profiler.start() and profiler.stop() around the code to time.
+"""
+
+from __future__ import division
+import time
+import json
+import threading
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+class _NullRecord(object):
+    """Context manager which does nothing, used when disabled."""
+    def __enter__(self):
+        pass
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_nullrecord = _NullRecord()
+
+class _Record(object):
+    """Context manager to record an event."""
+    def __init__(self, profiler, category, name):
+        self.profiler = profiler
+        self.category = category
+        self.name = name
+    def __enter__(self):
+        self.token = self.profiler.start(self.category, self.name)
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.stop(self.token)
+
+class Profiler(object):
+    """Record timings and memory allocations of events."""
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.starttime = time.time()
+        self.lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        """Enable or disable profiling. Enabling clears old events."""
+        if enabled and not self.enabled:
+            self.clear()
+            if tracemalloc is not None and not tracemalloc.is_tracing():
+                tracemalloc.start()
+        elif not enabled and self.enabled:
+            if tracemalloc is not None and tracemalloc.is_tracing():
+                tracemalloc.stop()
+        self.enabled = enabled
+
+    def clear(self):
+        """Remove recorded events."""
+        with self.lock:
+            self.events = []
+            self.starttime = time.time()
+
+    def _memory(self):
+        """Return currently allocated memory, if known."""
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0]
+        return None
+
+    def start(self, category, name):
+        """Start recording an event, returning a token for stop().
+        Returns None if disabled."""
+        if not self.enabled:
+            return None
+        return (category, name, time.time(), self._memory())
+
+    def stop(self, token):
+        """Finish recording event started with start()."""
+        if token is None:
+            return
+        category, name, start, startmem = token
+        duration = time.time() - start
+        mem = self._memory()
+        memdelta = None if mem is None or startmem is None else mem-startmem
+        with self.lock:
+            self.events.append( (category, name, start-self.starttime,
+                                 duration, memdelta,
+                                 threading.current_thread().ident) )
+
+    def record(self, category, name):
+        """Return context manager to record event in category."""
+        if not self.enabled:
+            return _nullrecord
+        return _Record(self, category, name)
+
+    def summary(self):
+        """Return list of (category, name, count, total time,
+        maximum time, total memory change), largest total first."""
+
+        totals = {}
+        with self.lock:
+            events = list(self.events)
+        for category, name, start, duration, memdelta, thread in events:
+            key = (category, name)
+            count, total, maxtime, mem = totals.get(key, (0, 0., 0., 0))
+            totals[key] = ( count+1, total+duration, max(maxtime, duration),
+                            mem + (memdelta or 0) )
+
+        out = [ k+v for k, v in totals.items() ]
+        out.sort(key=lambda x: -x[3])
+        return out
+
+    def report(self, maxlines=50):
+        """Return a text report of the events taking most time."""
+
+        lines = [ '%-11s %-40s %6s %10s %10s %10s' % (
+                'Category', 'Name', 'Count', 'Total (s)', 'Max (s)',
+                'Mem (kB)') ]
+        for category, name, count, total, maxtime, mem in (
+            self.summary()[:maxlines]):
+            lines.append( '%-11s %-40s %6i %10.4f %10.4f %10.1f' % (
+                    category, name[:40], count, total, maxtime, mem/1024) )
+        return '\n'.join(lines)
+
+    def writeTrace(self, fileobj):
+        """Write events in Chrome trace event JSON format, which can
+        be loaded by chrome://tracing."""
+
+        with self.lock:
+            events = list(self.events)
+
+        trace = []
+        for category, name, start, duration, memdelta, thread in events:
+            event = { 'name': name, 'cat': category, 'ph': 'X',
+                      'ts': start*1e6, 'dur': duration*1e6,
+                      'pid': 0, 'tid': thread }
+            if memdelta is not None:
+                event['args'] = {'memory': memdelta}
+            trace.append(event)
+
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'},
+                  fileobj)
+
+# the profiler used by the program
+profiler = Profiler()
@@ -115,6 +115,36 @@ def plotPathsToPainter(painter, path, x, y, scaling=None,
             painter.drawPath(path)
             painter.setWorldTransform(origtrans)
 
+def plotImagesToPainter(painter, sprites, spritewidth, origin, x, y,
+                        index=None, clip=None):
+    """Plot sprites from image at array of x, y points."""
+
+    spriteheight = sprites.height()
+    trans = painter.worldTransform()
+
+    if clip is None:
+        clip = qt4.QRectF(qt4.QPointF(-32767,-32767),qt4.QPointF(32767,32767))
+    else:
+        clip = trans.mapRect(qt4.QRectF(clip))
+    clip.adjust(-spritewidth, -spriteheight, spritewidth, spriteheight)
+
+    numpts = min(len(x), len(y))
+    if index is not None:
+        numpts = min(numpts, len(index))
+
+    painter.save()
+    painter.setWorldTransform(qt4.QTransform())
+    for i in crange(numpts):
+        pt = trans.map(qt4.QPointF(x[i], y[i]))
+        if clip.contains(pt):
+            idx = 0 if index is None else int(index[i])
+            painter.drawImage(
+                qt4.QPoint(int(round(pt.x()))-origin.x(),
+                           int(round(pt.y()))-origin.y()),
+                sprites,
+                qt4.QRect(idx*spritewidth, 0, spritewidth, spriteheight))
+    painter.restore()
+
 def plotLinesToPainter(painter, x1, y1, x2, y2, clip=None, autoexpand=True):
     """Plot lines given in numpy arrays to painter."""
     lines = []
@@ -28,6 +28,7 @@ import numpy as N
 from ..compat import cbasestr, cstr
 from .. import qtall as qt4
 from . import points
+from .utilfuncs import LRUCache
 
 mmlsupport = True
 try:
@@ -601,6 +602,8 @@ class RenderState(object):
         self.alignhorz = alignhorz
         self.actually_render = actually_render
         self.maxlines = 1 # maximim number of lines drawn
+        # widths of sub-parts of parts, measured when not rendering
+        self.widths = {}
 
     def fontMetrics(self):
         """Returns font metrics object."""
@@ -648,15 +651,13 @@ class PartText(Part):
 class PartLines(Part):
     """Render multiple lines."""
 
-    def __init__(self, children):
-        Part.__init__(self, children)
-        self.widths = []
-
     def render(self, state):
         """Render multiple lines."""
         # record widths of individual lines
         if not state.actually_render:
-            self.widths = []
+            widths = state.widths[self] = []
+        else:
+            widths = state.widths.get(self, [])
 
         height = state.fontMetrics().height()
         inity = state.y
@@ -666,18 +667,18 @@ class PartLines(Part):
 
         # iterate over lines (reverse as we draw from bottom up)
         for i, part in enumerate(self.children):
-            if state.actually_render and self.widths:
-                xwidth = max(self.widths)
+            if state.actually_render and widths:
+                xwidth = max(widths)
                 # if we're rendering, use max width to justify line
                 if state.alignhorz < 0:
                     # left alignment
                     state.x = initx
                 elif state.alignhorz == 0:
                     # centre alignment
-                    state.x = initx + (xwidth - self.widths[i])*0.5
+                    state.x = initx + (xwidth - widths[i])*0.5
                 elif state.alignhorz > 0:
                     # right alignment
-                    state.x = initx + (xwidth - self.widths[i])
+                    state.x = initx + (xwidth - widths[i])
             else:
                 # if not, just left justify to get widths
                 state.x = initx
@@ -687,13 +688,13 @@ class PartLines(Part):
 
             # record width if we're not rendering
             if not state.actually_render:
-                self.widths.append( state.x - initx )
+                widths.append( state.x - initx )
             # move up a line
             state.y += height
 
         # move on x posn
-        if self.widths:
-            state.x = initx + max(self.widths)
+        if widths:
+            state.x = initx + max(widths)
         else:
             state.x = initx
         state.y = inity
@@ -741,33 +742,35 @@ class PartFrac(Part):
 
         # keep track of width above and below line
         if not state.actually_render:
-            self.widths = []
+            widths = state.widths[self] = []
+        else:
+            widths = state.widths.get(self, [])
 
         initx = state.x
         inity = state.y
 
         # render bottom of fraction
-        if state.actually_render and len(self.widths) == 2:
+        if state.actually_render and len(widths) == 2:
             # centre line
-            state.x = initx + (max(self.widths) - self.widths[0])*0.5
+            state.x = initx + (max(widths) - widths[0])*0.5
         self.children[1].render(state)
         if not state.actually_render:
             # get width if not rendering
-            self.widths.append(state.x - initx)
+            widths.append(state.x - initx)
 
         # render top of fraction
         m = state.fontMetrics()
         state.y -= (m.ascent() + m.descent())
-        if state.actually_render and len(self.widths) == 2:
+        if state.actually_render and len(widths) == 2:
             # centre line
-            state.x = initx + (max(self.widths) - self.widths[1])*0.5
+            state.x = initx + (max(widths) - widths[1])*0.5
         else:
             state.x = initx
         self.children[0].render(state)
         if not state.actually_render:
-            self.widths.append(state.x - initx)
+            widths.append(state.x - initx)
 
-        state.x = initx + max(self.widths)
+        state.x = initx + max(widths)
         state.y = inity
 
         # restore font
@@ -784,7 +787,7 @@ class PartFrac(Part):
 
         painter.drawLine(qt4.QPointF(initx,
                                      inity-height/2.),
-                         qt4.QPointF(initx+max(self.widths),
+                         qt4.QPointF(initx+max(widths),
                                      inity-height/2.))
 
         painter.restore()
@@ -1152,6 +1155,32 @@ def makePartTree(partlist):
     else:
         return PartLines(lines)
 
+## caches of parsed text and of measured layouts
+
+# maximum number of parsed texts to keep
+part_cache_size = 1024
+# maximum number of text layouts to keep
+layout_cache_size = 4096
+
+partcache = LRUCache(part_cache_size)
+layoutcache = LRUCache(layout_cache_size)
+
+def setTextCacheSize(parts=None, layouts=None):
+    """Set the maximum number of parsed texts and layouts cached."""
+    if parts is not None:
+        partcache.maxsize = parts
+    if layouts is not None:
+        layoutcache.maxsize = layouts
+
+def clearTextCache():
+    """Empty the text caches."""
+    partcache.clear()
+    layoutcache.clear()
+
+def textCacheStats():
+    """Return a dict of statistics about the text caches."""
+    return {'parts': partcache.stats(), 'layouts': layoutcache.stats()}
+
 class _Renderer:
     """Different renderer types based on this."""
 
@@ -1234,11 +1263,13 @@ class _Renderer:
         dy is a descent to add, to include in the alignment, if wanted
         """
 
-    def getBounds(self):
-        """Get bounds in standard version."""
+    def _getRotatedBox(self):
+        """Get the box around the text, rotated by the angle.
 
-        if self.calcbounds is not None:
-            return self.calcbounds
+        Returns (x, y, bounds), where x and y are the position of the
+        start of the text relative to the centre of the box and bounds
+        is (minx, miny, maxx, maxy) of the rotated box.
+        """
 
         totalwidth, totalheight, dy = self._getWidthHeight()
 
@@ -1258,29 +1289,38 @@ class _Renderer:
 
         # calculate bounding box
         newbound = (newx.min(), newy.min(), newx.max(), newy.max())
+        return newx[0], newy[0], newbound
+
+    def getBounds(self):
+        """Get bounds in standard version."""
+
+        if self.calcbounds is not None:
+            return self.calcbounds
+
+        startx, starty, newbound = self._getRotatedBox()
 
         # use rotated bounding box to find position of start text posn
         if self.alignhorz < 0:
             xr = ( self.x, self.x+(newbound[2]-newbound[0]) )
-            self.xi += (newx[0] - newbound[0])
+            self.xi += (startx - newbound[0])
         elif self.alignhorz > 0:
             xr = ( self.x-(newbound[2]-newbound[0]), self.x )
-            self.xi += (newx[0] - newbound[2])
+            self.xi += (startx - newbound[2])
         else:
             xr = ( self.x+newbound[0], self.x+newbound[2] )
-            self.xi += newx[0]
+            self.xi += startx
 
         # y alignment
         # adjust y by these values to ensure proper alignment
         if self.alignvert < 0:
             yr = ( self.y + (newbound[1]-newbound[3]), self.y )
-            self.yi += (newy[0] - newbound[3])
+            self.yi += (starty - newbound[3])
         elif self.alignvert > 0:
             yr = ( self.y, self.y + (newbound[3]-newbound[1]) )
-            self.yi += (newy[0] - newbound[1])
+            self.yi += (starty - newbound[1])
         else:
             yr = ( self.y+newbound[1], self.y+newbound[3] )
-            self.yi += newy[0]
+            self.yi += starty
 
         self.calcbounds = [xr[0], yr[0], xr[1], yr[1]]
         return self.calcbounds
@@ -1289,9 +1329,33 @@ class _StdRenderer(_Renderer):
     """Standard rendering class."""
 
     def _initText(self, text):
-        # make internal tree
-        partlist = makePartList(text)
-        self.parttree = makePartTree(partlist)
+        # make internal tree (this is not modified when rendering, so
+        # can be shared between renderers)
+        self.text = text
+        self.parttree = partcache.get(
+            text, lambda: makePartTree(makePartList(text)))
+        self.widths = {}
+
+    def _layoutKey(self):
+        """Key identifying the layout of the text on the device."""
+        device = self.painter.device()
+        return ( self.text, self.font.key(), device.devType(),
+                 device.logicalDpiX(), device.logicalDpiY(),
+                 getattr(self.painter, 'scaling', None), self.alignvert,
+                 self.usefullheight, self.angle )
+
+    def _getRotatedBox(self):
+        """Get rotated box, using the cached layout if possible."""
+
+        def makelayout():
+            box = _Renderer._getRotatedBox(self)
+            return box, self.parttree, self.widths
+
+        # the tree is kept with the layout as the widths are indexed
+        # by its parts
+        box, self.parttree, self.widths = layoutcache.get(
+            self._layoutKey(), makelayout)
+        return box
 
     def _getWidthHeight(self):
         """Get size of box around text."""
@@ -1324,6 +1388,7 @@ class _StdRenderer(_Renderer):
         # work out width
         self.parttree.render(state)
         totalwidth = state.x
+        self.widths = state.widths
         # add number of lines for height
         totalheight += fm.height()*(state.maxlines-1)
 
@@ -1338,6 +1403,7 @@ class _StdRenderer(_Renderer):
         state = RenderState(self.font, self.painter,
                             self.xi, self.yi,
                             self.alignhorz)
+        state.widths = self.widths
 
         # if the text is rotated, change the coordinate frame
         if self.angle != 0:
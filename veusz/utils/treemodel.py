@@ -255,6 +255,56 @@ class TreeModel(qt4.QAbstractItemModel):
 
             i += 1
 
+    def nodeIndex(self, node):
+        """Return model index of node in the tree."""
+        if node is None or node is self.root:
+            return qt4.QModelIndex()
+        row = node.parent.childnodes.index(node)
+        return self.createIndex(row, 0, node._idx)
+
+    def _addNodeIndices(self, node):
+        """Give node and its children indices in self.nodes."""
+        node._idx = self.nodeindex
+        self.nodeindex += 1
+        self.nodes[node._idx] = node
+        for c in node.childnodes:
+            self._addNodeIndices(c)
+
+    def _removeNodeIndices(self, node):
+        """Remove node and its children from self.nodes."""
+        self.nodes.pop(node._idx, None)
+        for c in node.childnodes:
+            self._removeNodeIndices(c)
+
+    def insertNodeSorted(self, parent, node):
+        """Insert node as a child of parent node in the tree, keeping
+        the children sorted, and tell any views."""
+        cdata = [c.data for c in parent.childnodes]
+        row = bisect.bisect_left(cdata, node.data)
+        self.beginInsertRows(self.nodeIndex(parent), row, row)
+        node.parent = parent
+        parent.childnodes.insert(row, node)
+        self._addNodeIndices(node)
+        self.endInsertRows()
+
+    def removeNode(self, node):
+        """Remove node from the tree, and tell any views."""
+        parent = node.parent
+        row = parent.childnodes.index(node)
+        self.beginRemoveRows(self.nodeIndex(parent), row, row)
+        del parent.childnodes[row]
+        self._removeNodeIndices(node)
+        self.endRemoveRows()
+
+    def changeNodeData(self, node, data):
+        """Update data for node, keeping position in tree."""
+        node.data = data
+        self.nodes[node._idx] = node
+        idx = self.nodeIndex(node)
+        self.emit(qt4.SIGNAL('dataChanged(const QModelIndex &, '
+                             'const QModelIndex &)'),
+                  idx, idx.sibling(idx.row(), len(data)-1))
+
     def syncTree(self, newroot):
         """Syncronise the displayed tree with the given tree new."""
 
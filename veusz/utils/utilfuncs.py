@@ -27,7 +27,7 @@ import os.path
 import threading
 import codecs
 import csv
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 from ..compat import citems, cstr, CStringIO, cbasestr, cpy3, cbytes
 from .. import qtall as qt4
@@ -490,6 +490,114 @@ def topological_sort(dependency_pairs):
     cyclic = [n for n, heads in citems(num_heads) if heads]
     return ordered, cyclic
 
+def strongly_connected_components(dependency_pairs):
+    """Find the cycles in a list of (head, tail) pairs.
+
+    This uses Tarjan's algorithm (non recursively) and is linear in
+    the number of pairs. Returns a list of the components which
+    contain cycles, each component being a list of nodes. Nodes
+    which are not in a cycle are not returned.
+    """
+
+    tails = defaultdict(list)
+    for h, t in dependency_pairs:
+        tails[h].append(t)
+
+    index = {}
+    lowlink = {}
+    onstack = set()
+    stack = []
+    components = []
+    counter = 0
+
+    for root in list(tails):
+        if root in index:
+            continue
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        onstack.add(root)
+        work = [(root, iter(tails[root]))]
+
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    onstack.add(child)
+                    work.append( (child, iter(tails.get(child, ()))) )
+                    break
+                elif child in onstack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                # finished with this node
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    comp = []
+                    while True:
+                        n = stack.pop()
+                        onstack.discard(n)
+                        comp.append(n)
+                        if n == node:
+                            break
+                    if len(comp) > 1 or node in tails.get(node, ()):
+                        components.append(comp)
+
+    return components
+
 def isiternostr(i):
     """Is this iterator, but not a string?"""
     return hasattr(i, '__iter__') and not isinstance(i, cbasestr)
+
+class LRUCache(object):
+    """Least-recently-used cache holding up to maxsize items.
+
+    If given, onevict(key, item) is called for items removed to keep
+    the cache within maxsize."""
+
+    def __init__(self, maxsize, onevict=None):
+        self.maxsize = maxsize
+        self.onevict = onevict
+        self.items = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key, makefunc):
+        """Get item with key, calling makefunc() to make it if it is
+        not in the cache."""
+        try:
+            item = self.items.pop(key)
+            self.hits += 1
+        except KeyError:
+            item = makefunc()
+            self.misses += 1
+        self.items[key] = item
+        while len(self.items) > self.maxsize:
+            oldkey, olditem = self.items.popitem(last=False)
+            if self.onevict is not None:
+                self.onevict(oldkey, olditem)
+        return item
+
+    def clear(self):
+        self.items.clear()
+
+    def removeIf(self, pred):
+        """Remove items whose key k gives True for pred(k)."""
+        for key in [k for k in self.items if pred(k)]:
+            del self.items[key]
+
+    def stats(self):
+        """Return a dict of statistics about the cache."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.items)}
+
+def penKey(pen):
+    """Hashable representation of a QPen."""
+    return ( pen.style(), pen.color().rgba(), pen.widthF(),
+             pen.isCosmetic(), pen.capStyle(), pen.joinStyle(),
+             pen.miterLimit(), tuple(pen.dashPattern())
+             if pen.style() == qt4.Qt.CustomDashLine else None )
@@ -129,17 +129,26 @@ def convertArgsUnicode(args):
             out.append(a)
     return out
 
-def initImports():
-    '''Do imports and start up DBUS/SAMP.'''
+def initImports(gui):
+    '''Do imports needed before starting.
+
+    The user interface is only imported if a window will be shown.'''
     from veusz import setting
     from veusz import widgets
+    from veusz import document
+    if gui:
+        from veusz.windows import mainwindow
 
 class ImportThread(qt4.QThread):
     '''Do import of main code within another thread.
     Main application runs when this is done
     '''
+    def __init__(self, gui):
+        qt4.QThread.__init__(self)
+        self.gui = gui
+
     def run(self):
-        initImports()
+        initImports(self.gui)
 
 class AppRunner(qt4.QObject):
     '''Object to run application. We have to do this to get an
@@ -164,7 +173,7 @@ class AppRunner(qt4.QObject):
             trans.load(options.translation)
             qt4.qApp.installTranslator(trans)
 
-        self.thread = ImportThread()
+        self.thread = ImportThread(not options.export)
         self.connect( self.thread, qt4.SIGNAL('finished()'),
                       self.slotStartApplication )
         self.thread.start()
@@ -175,9 +184,11 @@ class AppRunner(qt4.QObject):
         options = self.options
         args = self.args
 
-        from veusz.utils import vzdbus, vzsamp
-        vzdbus.setup()
-        vzsamp.setup()
+        if not options.export:
+            # not needed when exporting, and slow to import
+            from veusz.utils import vzdbus, vzsamp
+            vzdbus.setup()
+            vzsamp.setup()
 
         from veusz import document
         from veusz import setting
@@ -226,6 +237,13 @@ def run():
         runremote()
         return
 
+    # headless render server does not need a QApplication here, as
+    # each worker process makes its own
+    if len(sys.argv) >= 2 and sys.argv[1] == '--render-server':
+        from veusz.render_server import run as runserver
+        runserver(sys.argv[1:])
+        return
+
     # this function is spaghetti-like and has nasty code paths.
     # the idea is to postpone the imports until the splash screen
     # is shown
@@ -255,6 +273,9 @@ def run():
                       ' output image file, exiting when finished')
     parser.add_option('--embed-remote', action='store_true',
                       help=optparse.SUPPRESS_HELP)
+    parser.add_option('--render-server', action='store_true',
+                      help='run a headless render server (this must be the'
+                      ' first option, see --render-server --help)')
     parser.add_option('--plugin', action='append', metavar='FILE',
                       help='load the plugin from the file given for '
                       'the session')
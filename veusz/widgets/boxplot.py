@@ -22,7 +22,7 @@ from __future__ import division
 import math
 import numpy as N
 
-from ..compat import crange, czip
+from ..compat import crange, czip, citems
 from .. import qtall as qt4
 from .. import setting
 from .. import document
@@ -48,6 +48,33 @@ def percentile(sortedds, perc):
     interpol = (1-frac)*sortedds[index] + frac*sortedds[indexplus1]
     return interpol
 
+def percentiles(data, percs):
+    """Get the list of percentiles percs of data.
+
+    This only partially sorts data, in place, if numpy supports it."""
+
+    num = data.shape[0]
+    indices = set()
+    for perc in percs:
+        index = int(perc * 0.01 * (num-1))
+        indices.update( (index, min(index+1, num-1)) )
+
+    if hasattr(data, 'partition'):
+        # values at indices are the same as if data were sorted
+        data.partition(sorted(indices))
+    else:
+        data.sort()
+    return [percentile(data, perc) for perc in percs]
+
+# maximum number of values used to calculate approximate statistics
+approx_sample_size = 100000
+
+# percentiles needed for each whisker mode
+_whiskerpercs = {
+    '9/91 percentile': [9, 91],
+    '2/98 percentile': [2, 98],
+    }
+
 def swapline(painter, x1, y1, x2, y2, swap):
     """Draw line, swapping x and y coordinates if swap is True."""
     if swap:
@@ -65,45 +92,57 @@ def swapbox(painter, x1, y1, x2, y2, swap):
 class _Stats(object):
     """Store statistics about box."""
 
-    def calculate(self, data, whiskermode):
-        """Calculate statistics for data."""
+    def calculate(self, data, whiskermode, approximate=False):
+        """Calculate statistics for data.
+
+        If approximate is set, percentiles of large datasets are
+        estimated from a random sample of the values."""
+
         cleaned = data[ N.isfinite(data) ]
-        cleaned.sort()
 
         if len(cleaned) == 0:
             self.median = self.botquart = self.topquart = self.mean = \
                 self.botwhisker = self.topwhisker = N.nan
+            self.outliers = N.array([])
             return
 
-        self.median = percentile(cleaned, 50)
-        self.botquart = percentile(cleaned, 25)
-        self.topquart = percentile(cleaned, 75)
+        if approximate and len(cleaned) > approx_sample_size:
+            # fixed seed so that plots do not change when redrawn
+            rand = N.random.RandomState(len(cleaned))
+            sample = cleaned[ rand.randint(0, len(cleaned),
+                                           approx_sample_size) ]
+        else:
+            sample = cleaned
+
+        if ( whiskermode not in ('min/max', '1.5IQR', '1 stddev') and
+             whiskermode not in _whiskerpercs ):
+            raise RuntimeError("Invalid whisker mode")
+
+        percs = percentiles(sample, [50, 25, 75] +
+                            _whiskerpercs.get(whiskermode, []))
+        self.median, self.botquart, self.topquart = percs[:3]
         self.mean = N.mean(cleaned)
         
         if whiskermode == 'min/max':
             self.botwhisker = cleaned.min()
             self.topwhisker = cleaned.max()
         elif whiskermode == '1.5IQR':
+            # whiskers are the largest values below the limits (or the
+            # extreme values if there are none)
             iqr = self.topquart - self.botquart
-            eltop = N.searchsorted(cleaned, self.topquart+1.5*iqr)-1
-            self.topwhisker = cleaned[eltop]
-            elbot = max(N.searchsorted(cleaned, self.botquart-1.5*iqr)-1, 0)
-            self.botwhisker = cleaned[elbot]
+            below = cleaned[cleaned < self.topquart+1.5*iqr]
+            self.topwhisker = below.max() if len(below) else cleaned.max()
+            below = cleaned[cleaned < self.botquart-1.5*iqr]
+            self.botwhisker = below.max() if len(below) else cleaned.min()
         elif whiskermode == '1 stddev':
             stddev = N.std(cleaned)
             self.topwhisker = self.mean+stddev
             self.botwhisker = self.mean-stddev
-        elif whiskermode == '9/91 percentile':
-            self.topwhisker = percentile(cleaned, 91)
-            self.botwhisker = percentile(cleaned, 9)
-        elif whiskermode == '2/98 percentile':
-            self.topwhisker = percentile(cleaned, 98)
-            self.botwhisker = percentile(cleaned, 2)
         else:
-            raise RuntimeError("Invalid whisker mode")
+            self.botwhisker, self.topwhisker = percs[3:]
 
-        self.outliers = cleaned[ (cleaned < self.botwhisker) |
-                                 (cleaned > self.topwhisker) ]
+        self.outliers = N.sort( cleaned[ (cleaned < self.botwhisker) |
+                                         (cleaned > self.topwhisker) ] )
 
 class BoxPlot(GenericPlotter):
     """Plot bar charts."""
@@ -118,12 +157,19 @@ class BoxPlot(GenericPlotter):
         if type(self) == BoxPlot:
             self.readDefaults()
 
+        # statistics calculated for datasets
+        self.statscache = {}
+
     @classmethod
     def addSettings(klass, s):
         """Construct list of settings."""
         GenericPlotter.addSettings(s)
 
         s.remove('key')
+        s.add( setting.Bool('approximate', False,
+                            descr = _('Estimate percentiles of large '
+                                      'datasets from a random sample'),
+                            usertext=_('Approximate')), 0 )
         s.add( setting.Choice('whiskermode', 
                               ('min/max',
                                '1.5IQR',
@@ -184,7 +230,8 @@ class BoxPlot(GenericPlotter):
                                   descr = _('Calculate statistics from datasets'
                                             ' rather than given manually'),
                                   usertext = _('Calculate'),
-                                  settingstrue=('whiskermode', 'values'),
+                                  settingstrue=('whiskermode', 'values',
+                                                'approximate'),
                                   settingsfalse=('boxmin', 'whiskermin',
                                                  'boxmax', 'whiskermax',
                                                  'mean', 'median')), 0 )
@@ -439,12 +486,27 @@ class BoxPlot(GenericPlotter):
         width = width * s.fillfraction
 
         if s.calculate:
-            # calculated boxes
+            # calculated boxes, reusing statistics if datasets unchanged
+            names = dict( [(id(ds), name) for name, ds in citems(doc.data)] )
+            statscache = {}
             for vals, plotpos in czip(values, plotposns):
-                stats = _Stats()
-                stats.calculate(vals.data, s.whiskermode)
+                name = names.get(id(vals))
+                key = stats = None
+                if name is not None:
+                    # the version changes if derived datasets recalculate
+                    key = ( name,
+                            document.dependencies.datasetVersion(doc, name),
+                            s.whiskermode, s.approximate )
+                    stats = self.statscache.get(key)
+                if stats is None:
+                    stats = _Stats()
+                    stats.calculate(vals.data, s.whiskermode,
+                                    approximate=s.approximate)
+                if key is not None:
+                    statscache[key] = stats
                 self.plotBox(painter, axes, plotpos, widgetposn, width,
                              clip, stats)
+            self.statscache = statscache
         else:
             # manually given boxes
             vals = [d.data for d in datasets] + [plotposns]
@@ -49,6 +49,19 @@ def _resolveLinkedAxis(axis):
             return None
     return axis
 
+def _componentEdges(components, pairs):
+    """Return lists of the pairs which lie inside each component."""
+    compidx = {}
+    for i, comp in enumerate(components):
+        for node in comp:
+            compidx[node] = i
+    out = [[] for c in components]
+    for p in pairs:
+        i = compidx.get(p[0])
+        if i is not None and compidx.get(p[1]) == i:
+            out[i].append(p)
+    return out
+
 class AxisDependHelper(object):
     """A class to work out the dependency of widgets on axes and vice
     versa, in terms of ranges of the axes.
@@ -157,24 +170,43 @@ class AxisDependHelper(object):
         for c in widget.children:
             self.recursivePlotterSearch(c)
 
-    def breakCycles(self, origcyclic):
-        """Remove cycles if possible."""
+    def breakCycles(self):
+        """Remove cycles if possible.
+
+        The cycles are found as strongly connected components of the
+        dependency graph. In each component, the last dependency where
+        an axis depends on a plotter is removed (or the last
+        dependency if there is none of these). Only the edges in that
+        component are searched again, so this scales to documents
+        with many plotters.
+
+        Returns a list of the removed pairs.
+        """
 
-        numcyclic = len(origcyclic)
-        best = -1
+        removed = []
+        todo = _componentEdges(
+            utils.strongly_connected_components(self.pairs), self.pairs)
+        while todo:
+            edges = todo.pop()
 
-        for i in crange(len(self.pairs)):
-            if not self.pairs[i][0][0].isaxis:
-                p = self.pairs[:i] + self.pairs[i+1:]
-                ordered, cyclic = utils.topological_sort(p)
-                if len(cyclic) <= numcyclic:
-                    numcyclic = len(cyclic)
+            best = len(edges)-1
+            for i in crange(len(edges)-1, -1, -1):
+                if not edges[i][0][0].isaxis:
                     best = i
+                    break
 
-        # delete best, or last one if none better found
-        p = self.pairs[best]
-        del self.pairs[best]
+            p = edges.pop(best)
+            removed.append(p)
+            todo += _componentEdges(
+                utils.strongly_connected_components(edges), edges)
 
+        for p in removed:
+            self.removePair(p)
+        return removed
+
+    def removePair(self, p):
+        """Remove a dependency pair."""
+        self.pairs.remove(p)
         try:
             idx = self.deps[p[1]].index(p[0])
             del self.deps[p[1]][idx]
@@ -235,7 +267,7 @@ class AxisDependHelper(object):
                 if axis in self.ranges:
                     self._updateAxisAutoRange(axis)
 
-    def processDepends(self):
+    def processDepends(self, cache=None):
         """Go through dependencies of widget.
         If the dependency has no dependency itself, then update the
         axis with the widget or vice versa
@@ -246,14 +278,24 @@ class AxisDependHelper(object):
           If the widget has a dependency on a widget which doesn't
           have a dependency itself, update range from that
           widget. Then delete that depency from the dependency list.
+
+        cache is an optional dict used to keep the ordering between
+        calls. It is reused if the dependency pairs are unchanged.
         """
 
-        # get ordered list, breaking cycles
-        while True:
+        key = tuple(self.pairs)
+        if cache is not None and cache.get('key') == key:
+            for p in cache['removed']:
+                self.removePair(p)
+            ordered = cache['ordered']
+        else:
+            # get ordered list, breaking cycles
+            removed = self.breakCycles()
             ordered, cyclic = utils.topological_sort(self.pairs)
-            if not cyclic:
-                break
-            self.breakCycles(cyclic)
+            if cache is not None:
+                cache['key'] = key
+                cache['removed'] = removed
+                cache['ordered'] = ordered
 
         # iterate over widgets in order
         for dep in ordered:
@@ -264,13 +306,13 @@ class AxisDependHelper(object):
                 dep = (self.axis_to_axislinked[dep[0]], None)
                 self.processWidgetDeps(dep)
 
-    def findAxisRanges(self):
+    def findAxisRanges(self, cache=None):
         """Find the ranges from the plotters and set the axis ranges.
 
         Follows the dependencies calculated above.
         """
 
-        self.processDepends()
+        self.processDepends(cache=cache)
 
         # set any remaining ranges
         for axis in list(self.ranges.keys()):
@@ -288,6 +330,9 @@ class Page(widget.Widget):
         widget.Widget.__init__(self, parent, name=name)
         if type(self) == Page:
             self.readDefaults()
+
+        # axis dependency ordering kept between redraws
+        self.dependcache = {}
  
     @classmethod
     def addSettings(klass, s):
@@ -332,7 +377,7 @@ class Page(widget.Widget):
         # find ranges of axes
         axisdependhelper = AxisDependHelper()
         axisdependhelper.recursivePlotterSearch(self)
-        axisdependhelper.findAxisRanges()
+        axisdependhelper.findAxisRanges(cache=self.dependcache)
 
         # store axis->plotter mappings in painthelper
         painthelper.axisplottermap.update(axisdependhelper.axis_plotter_map)
@@ -26,6 +26,7 @@ from .. import qtall as qt4
 import numpy as N
 
 from .. import setting
+from .. import utils
 
 from . import widget
 
@@ -169,7 +170,11 @@ class GenericPlotter(widget.Widget):
         cliprect = self.clipAxesBounds(axes, posn)
         painter = painthelper.painter(self, posn, clip=cliprect)
         with painter:
-            self.dataDraw(painter, axes, posn, cliprect)
+            if utils.profiler.enabled:
+                with utils.profiler.record('dataDraw', self.path):
+                    self.dataDraw(painter, axes, posn, cliprect)
+            else:
+                self.dataDraw(painter, axes, posn, cliprect)
         return posn
 
     def dataDraw(self, painter, axes, posn, cliprect):
@@ -627,8 +627,9 @@ class PointPlotter(GenericPlotter):
         painter.restore()
 
     def drawLabels(self, painter, xplotter, yplotter,
-                   textvals, markersize):
-        """Draw labels for the points."""
+                   textvals, markersize, clip=None):
+        """Draw labels for the points.
+        If clip is given, labels which cannot be inside it are skipped."""
 
         s = self.settings
         lab = s.get('Label')
@@ -645,9 +646,24 @@ class PointPlotter(GenericPlotter):
         font = lab.makeQFont(painter)
         angle = lab.angle
 
+        xpts, ypts = xplotter+deltax, yplotter+deltay
+        if clip is not None and len(textvals) > 0:
+            # labels cannot extend further than this from their
+            # positions, as each character is smaller
+            fm = utils.FontMetrics(font, painter.device())
+            maxlen = max([len(t) for t in textvals])
+            margin = maxlen * max(fm.maxWidth(), fm.height())
+
+            visible = N.nonzero(
+                (xpts > clip.left()-margin) & (xpts < clip.right()+margin) &
+                (ypts > clip.top()-margin) & (ypts < clip.bottom()+margin)
+                )[0]
+            visible = visible[visible < len(textvals)]
+            xpts, ypts = xpts[visible], ypts[visible]
+            textvals = [textvals[i] for i in visible]
+
         # iterate over each point and plot each label
-        for x, y, t in czip(xplotter+deltax, yplotter+deltay,
-                            textvals):
+        for x, y, t in czip(xpts, ypts, textvals):
             utils.Renderer( painter, font, x, y, t,
                             alignhorz, alignvert, angle ).render()
 
@@ -816,7 +832,7 @@ class PointPlotter(GenericPlotter):
             # finally plot any labels
             if tvals and not s.Label.hide:
                 self.drawLabels(painter, xplotter, yplotter,
-                                tvals, markersize)
+                                tvals, markersize, clip=cliprect)
 
 # allow the factory to instantiate an x,y plotter
 document.thefactory.register( PointPlotter )
@@ -146,8 +146,7 @@ class Root(widget.Widget):
                 newsett = setting.Settings(name=klass.typename,
                                            usertext = klass.typename,
                                            pixmap="button_%s" % klass.typename)
-                classset = setting.Settings('temp')
-                klass.addSettings(classset)
+                classset = klass.getSettingsPrototype()
 
                 # copy formatting settings to stylesheet
                 for name in classset.setnames:
@@ -159,7 +158,7 @@ class Root(widget.Widget):
                     # skip non formatting settings
                     #if hasattr(sett, 'formatting') and not sett.formatting:
                     #    continue
-                    newsett.add( sett.copy() )
+                    newsett.add( sett.clone() )
             
                 stylesheet.add(newsett)
 
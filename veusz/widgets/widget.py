@@ -54,6 +54,15 @@ class Action(object):
         self.descr = descr
         self.usertext = usertext
 
+def _copyStylesheetLinks(src, dest):
+    """Copy stylesheet links in the settings src to settings dest."""
+    for name in dest.setnames:
+        s, d = src.setdict[name], dest.setdict[name]
+        if isinstance(d, setting.Settings):
+            _copyStylesheetLinks(s, d)
+        elif s.isReference() and s.default is s.getReference():
+            d._val = d.default = setting.Reference(s.default.value)
+
 class Widget(object):
     """ Fundamental plotting widget interface."""
 
@@ -73,6 +82,9 @@ class Widget(object):
         self.parent = parent
         self.document = None
 
+        # index of children by name (built when required)
+        self._childindex = None
+
         if not self.isAllowedParent(parent):
             raise RuntimeError("Widget parent is of incorrect type")
 
@@ -88,13 +100,15 @@ class Widget(object):
         # store child widgets
         self.children = []
         
-        # settings for widget
-        self.settings = setting.Settings( 'Widget_' + self.typename,
-                                          setnsmode='widgetsettings' )
+        # settings for widget, copied from prototype for widget type
+        proto = self.__class__.__dict__.get('_settingslinked')
+        # whether the settings already link to the stylesheet
+        self._stylesheetlinked = proto is not None
+        if proto is None:
+            proto = self.getSettingsPrototype()
+        self.settings = proto.clone()
         self.settings.parent = self
 
-        self.addSettings(self.settings)
-
         # actions for widget
         self.actions = []
 
@@ -103,6 +117,22 @@ class Widget(object):
         """Get types of widgets this can be a child of."""
         return ()
 
+    @classmethod
+    def getSettingsPrototype(klass):
+        """Get the prototype settings for this widget type.
+
+        This is built once using addSettings. Widgets get lightweight
+        clones of it, which only store values which change.
+        """
+        try:
+            return klass.__dict__['_settingsproto']
+        except KeyError:
+            s = setting.Settings( 'Widget_' + klass.typename,
+                                  setnsmode='widgetsettings' )
+            klass.addSettings(s)
+            klass._settingsproto = s
+            return s
+
     @classmethod
     def addSettings(klass, s):
         """Add items to settings s."""
@@ -121,6 +151,26 @@ class Widget(object):
         sigh."""
         return self.document
 
+    def _getName(self):
+        return self._name
+
+    def _setName(self, name):
+        self._name = name
+        if self.parent is not None:
+            self.parent.invalidateChildIndex()
+
+    name = property(_getName, _setName, None,
+                    'Name of widget')
+
+    def invalidateChildIndex(self):
+        """Mark the index of children by name as out of date.
+
+        This should be called if the children are added, removed,
+        reordered or renamed."""
+        self._childindex = None
+        if self.document is not None:
+            self.document.pathcache.clear()
+
     def rename(self, name):
         """Change name of self."""
 
@@ -131,9 +181,9 @@ class Widget(object):
             raise ValueError('Names cannot contain "/"')
 
         # check whether name already exists in siblings
-        for i in self.parent.children:
-            if i != self and i.name == name:
-                raise ValueError('New name "%s" already exists' % name)
+        existing = self.parent.getChild(name)
+        if existing is not None and existing is not self:
+            raise ValueError('New name "%s" already exists' % name)
 
         self.name = name
 
@@ -180,6 +230,7 @@ class Widget(object):
         index is a position to place the new child
         """
         self.children.insert(index, child)
+        self.invalidateChildIndex()
 
     def createUniqueName(self, prefix):
         """Create a name using the prefix which hasn't been used before."""
@@ -230,10 +281,12 @@ class Widget(object):
 
     def getChild(self, name):
         """Return a child with a name."""
-        for i in self.children:
-            if i.name == name:
-                return i
-        return None
+        index = self._childindex
+        if index is None:
+            # reversed so the first child with a name is used
+            index = self._childindex = dict(
+                [(c.name, c) for c in reversed(self.children)] )
+        return index.get(name)
 
     def hasChild(self, name):
         """Return whether there is a child with a name."""
@@ -254,6 +307,7 @@ class Widget(object):
 
         if i < nc:
             self.children.pop(i)
+            self.invalidateChildIndex()
         else:
             raise ValueError("Cannot remove graph '%s' - does not exist" % name)
 
@@ -337,9 +391,26 @@ class Widget(object):
         """Read the default settings.
         Also set settings to stylesheet
         """
-        self.settings.readDefaults('', self.name)
+        changed = self.settings.readDefaults('', self.name)
+        if self._stylesheetlinked and not changed:
+            # settings were cloned with the stylesheet links present
+            return
+
         self.settings.linkToStylesheet()
 
+        # Keep a linked prototype, so that later widgets of this type
+        # do not need to look up the stylesheet. This is only safe if
+        # this widget is in a document and has no user defaults.
+        klass = self.__class__
+        if '_settingslinked' not in klass.__dict__ and not changed:
+            root = self
+            while root.parent is not None:
+                root = root.parent
+            if root.typename == 'document' and root is not self:
+                linked = self.getSettingsPrototype().clone()
+                _copyStylesheetLinks(self.settings, linked)
+                klass._settingslinked = linked
+
     def buildFlatWidgetList(self, thelist):
         """Return a built up list of the widgets in the tree."""
 
@@ -373,6 +444,7 @@ class Widget(object):
 
         # remove the widget from its current location
         c.pop(oldindex)
+        self.invalidateChildIndex()
 
         # build a list of places widgets can be placed (slots)
         slots = []
@@ -398,12 +470,14 @@ class Widget(object):
         # we failed to find a new parent
         if ourindex < 0 or ourindex >= len(slots):
             c.insert(oldindex, w)
+            self.invalidateChildIndex()
             return False
         else:
             newparent, newindex = slots[ourindex]
             existingname = w.name in newparent.childnames
             newparent.children.insert(newindex, w)
             w.parent = newparent
+            newparent.invalidateChildIndex()
 
             # require a new name because of a clash
             if existingname:
@@ -592,6 +592,7 @@ class MainWindow(qt4.QMainWindow):
             ]
 
         # load dataset plugins and create menu
+        self.document.loadPlugins(registry='datasetpluginregistry')
         datapluginsmenu = self.definePlugins( plugins.datasetpluginregistry,
                                               self.vzactions, 'data.ops' )
 
@@ -612,6 +613,7 @@ class MainWindow(qt4.QMainWindow):
             ]
 
         # load tools plugins and create menu
+        self.document.loadPlugins(registry='toolspluginregistry')
         toolsmenu = self.definePlugins( plugins.toolspluginregistry,
                                         self.vzactions, 'tools' )
 
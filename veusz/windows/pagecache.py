@@ -0,0 +1,171 @@
+#    Copyright (C) 2014 Jeremy S. Sanders
+#    Email: Jeremy Sanders <jeremy@jeremysanders.net>
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License along
+#    with this program; if not, write to the Free Software Foundation, Inc.,
+#    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+##############################################################################
+
+"""A memory-limited cache of rendered pages and thumbnails.
+
+Each image is stored with the changeset of the document it was
+rendered at, and is only returned while the document is at that
+changeset. When the document sends the changes made (sigChanges),
+images of pages using the changed widgets, settings or datasets are
+removed and the other images are marked as up to date.
+"""
+
+from __future__ import division
+from collections import OrderedDict
+
+from ..compat import citems, cbasestr
+from .. import setting
+from .. import document
+
+def _settingsDependencies(settings, datasets, paths):
+    """Add the names of datasets used by settings to datasets, and
+    the paths of settings referenced to paths."""
+
+    for s in settings.getSettingList():
+        if s.isReference():
+            try:
+                paths.add(s.getReference().resolve(s).path)
+            except Exception:
+                pass
+        elif isinstance(s, (setting.Dataset, setting.Datasets)):
+            vals = s.val
+            if isinstance(vals, cbasestr):
+                vals = [vals]
+            elif not isinstance(vals, (list, tuple)):
+                continue
+            for val in vals:
+                if isinstance(val, cbasestr):
+                    datasets.update(document.expressionDatasetNames(val))
+
+    for s in settings.getSettingsList():
+        _settingsDependencies(s, datasets, paths)
+
+def pageDependencies(page):
+    """Return (set of dataset names, set of setting paths) used by
+    widgets on page, outside of the page itself."""
+
+    datasets = set()
+    paths = set()
+    widgets = [page]
+    while widgets:
+        w = widgets.pop()
+        _settingsDependencies(w.settings, datasets, paths)
+        widgets += w.children
+    return datasets, paths
+
+class _Entry(object):
+    """An image in the cache."""
+
+    def __init__(self, page, changeset, image, helper):
+        self.page = page
+        self.pagepath = page.path
+        self.changeset = changeset
+        self.image = image
+        self.helper = helper
+        self.datasets, self.paths = pageDependencies(page)
+        self.size = image.byteCount()
+
+class PageImageCache(object):
+    """Images of pages, keyed by the kind of image ('page' or
+    'thumbnail'), page number and the parameters used to render
+    them."""
+
+    def __init__(self, document, maxsize):
+        self.document = document
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, kind, pagenum, params):
+        """Return the entry for the page if it is up to date, or None.
+        The entry has image and helper (the PaintHelper) attributes."""
+
+        key = (kind, pagenum, params)
+        entry = self.entries.get(key)
+        if ( entry is None or
+             entry.changeset != self.document.changeset or
+             entry.page is not self.document.basewidget.getPage(pagenum) ):
+            return None
+
+        # mark as recently used
+        del self.entries[key]
+        self.entries[key] = entry
+        return entry
+
+    def add(self, kind, pagenum, params, changeset, image, helper=None):
+        """Add image of page rendered at document changeset."""
+
+        page = self.document.basewidget.getPage(pagenum)
+        if changeset != self.document.changeset or page is None:
+            # already out of date
+            return
+
+        key = (kind, pagenum, params)
+        self.remove(key)
+        entry = self.entries[key] = _Entry(page, changeset, image, helper)
+        self.size += entry.size
+
+        while self.size > self.maxsize and self.entries:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        """Remove the entry with key, if it exists."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def clear(self):
+        """Remove all the images."""
+        self.entries.clear()
+        self.size = 0
+
+    def setMaxSize(self, maxsize):
+        """Change the maximum size of the cache in bytes."""
+        self.maxsize = maxsize
+        while self.size > self.maxsize and self.entries:
+            self.remove(next(iter(self.entries)))
+
+    def slotChanges(self, changes):
+        """Remove images affected by the DocumentChanges given."""
+
+        if changes.everything:
+            self.clear()
+            return
+
+        datasets = document.dependencies.changedDatasets(
+            self.document, changes.datasets)
+        pagepaths = [ p.path for p in self.document.basewidget.children ]
+        def onpage(path, pagepath):
+            return path == pagepath or path.startswith(pagepath + '/')
+
+        # changed settings not on any page (e.g. stylesheet or document
+        # settings) affect every page
+        paths = changes.settings | changes.widgets
+        for path in paths:
+            if not any([onpage(path, pp) for pp in pagepaths]):
+                self.clear()
+                return
+
+        changeset = self.document.changeset
+        for key, entry in list(citems(self.entries)):
+            if ( entry.datasets & datasets or
+                 entry.paths & paths or
+                 any([onpage(path, entry.pagepath) for path in paths]) ):
+                self.remove(key)
+            else:
+                entry.changeset = changeset
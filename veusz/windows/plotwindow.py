@@ -32,6 +32,7 @@ from ..dialogs import exceptiondialog
 from .. import document
 from .. import utils
 from .. import widgets
+from . import pagecache
 
 def _(text, disambiguation=None, context='PlotWindow'):
     """Translate text."""
@@ -66,7 +67,11 @@ class PickerCrosshairItem( qt4.QGraphicsPathItem ):
         self.hide()
 
 class RenderControl(qt4.QObject):
-    """Object for rendering plots in a separate thread."""
+    """Object for rendering plots in a separate thread.
+
+    Prefetch jobs (pages not being shown) are only rendered if there
+    are no other jobs waiting.
+    """
 
     def __init__(self, plotwindow):
         """Start up numthreads rendering threads."""
@@ -76,6 +81,7 @@ class RenderControl(qt4.QObject):
         self.threads = []
         self.exit = False
         self.latestjobs = []
+        self.prefetchjobs = []
         self.latestaddedjob = -1
         self.latestdrawnjob = -1
         self.plotwindow = plotwindow
@@ -111,45 +117,73 @@ class RenderControl(qt4.QObject):
         """Exit threads started."""
         self.updateNumberThreads(num=0)
 
+    def renderImage(self, helper):
+        """Return an image of the page painted in the helper."""
+        img = qt4.QImage(helper.pagesize[0], helper.pagesize[1],
+                         qt4.QImage.Format_ARGB32_Premultiplied)
+        img.fill( setting.settingdb.color('page').rgb() )
+
+        painter = qt4.QPainter(img)
+        aa = self.plotwindow.antialias
+        painter.setRenderHint(qt4.QPainter.Antialiasing, aa)
+        painter.setRenderHint(qt4.QPainter.TextAntialiasing, aa)
+        helper.renderToPainter(painter)
+        painter.end()
+        return img
+
     def processNextJob(self):
         """Take a job from the queue and process it.
 
-        emits renderfinished(jobid, img, painthelper)
-        when done, if job has not been superseded
+        emits renderfinished(jobid, img, painthelper, info)
+        when done, if job has not been superseded, or
+        prefetchfinished(info, img, painthelper) for prefetch jobs
         """
 
         self.mutex.lock()
-        jobid, helper = self.latestjobs[-1]
-        del self.latestjobs[-1]
+        if self.latestjobs:
+            jobid, helper, info = self.latestjobs.pop()
+            prefetch = False
+        elif self.prefetchjobs:
+            helper, info = self.prefetchjobs.pop(0)
+            prefetch = True
+        else:
+            # jobs were removed
+            self.mutex.unlock()
+            return
         lastadded = self.latestaddedjob
         self.mutex.unlock()
 
+        if prefetch:
+            img = self.renderImage(helper)
+            self.emit( qt4.SIGNAL("prefetchfinished"), info, img, helper )
+            return
+
         # don't process jobs which have been superseded
         if lastadded == jobid:
-            img = qt4.QImage(helper.pagesize[0], helper.pagesize[1],
-                             qt4.QImage.Format_ARGB32_Premultiplied)
-            img.fill( setting.settingdb.color('page').rgb() )
-
-            painter = qt4.QPainter(img)
-            aa = self.plotwindow.antialias
-            painter.setRenderHint(qt4.QPainter.Antialiasing, aa)
-            painter.setRenderHint(qt4.QPainter.TextAntialiasing, aa)
-            helper.renderToPainter(painter)
-            painter.end()
+            img = self.renderImage(helper)
 
             self.mutex.lock()
             # just throw away result if it older than the latest one
             if jobid > self.latestdrawnjob:
                 self.emit( qt4.SIGNAL("renderfinished"),
-                              jobid, img, helper )
+                              jobid, img, helper, info )
                 self.latestdrawnjob = jobid
             self.mutex.unlock()
 
         # tell any listeners that a job has been processed
         self.plotwindow.emit( qt4.SIGNAL("queuechange"), -1 )
 
-    def addJob(self, helper):
-        """Process drawing job in PaintHelper given."""
+    def supersedeJobs(self):
+        """Throw away the results of jobs added so far, as the page
+        has been shown another way."""
+        self.mutex.lock()
+        self.latestaddedjob += 1
+        self.latestdrawnjob = self.latestaddedjob
+        self.mutex.unlock()
+
+    def addJob(self, helper, info=None):
+        """Process drawing job in PaintHelper given.
+        info is passed to the renderfinished signal."""
 
         # indicate that there is a new item to be processed to listeners
         self.plotwindow.emit( qt4.SIGNAL("queuechange"), 1 )
@@ -157,7 +191,7 @@ class RenderControl(qt4.QObject):
         # add the job to the queue
         self.mutex.lock()
         self.latestaddedjob += 1
-        self.latestjobs.append( (self.latestaddedjob, helper) )
+        self.latestjobs.append( (self.latestaddedjob, helper, info) )
         self.mutex.unlock()
 
         if self.threads:
@@ -167,6 +201,32 @@ class RenderControl(qt4.QObject):
             # process job in current thread if multithreading disabled
             self.processNextJob()
 
+    def addPrefetchJob(self, helper, info):
+        """Render a page which is not being shown, when there are no
+        other jobs. Emits prefetchfinished(info, img, helper)."""
+
+        self.mutex.lock()
+        self.prefetchjobs.append( (helper, info) )
+        self.mutex.unlock()
+
+        if self.threads:
+            self.sem.release(1)
+        else:
+            self.processNextJob()
+
+    def clearPrefetchJobs(self):
+        """Remove prefetch jobs which are waiting."""
+        self.mutex.lock()
+        del self.prefetchjobs[:]
+        self.mutex.unlock()
+
+    def numPrefetchJobs(self):
+        """Return number of prefetch jobs waiting."""
+        self.mutex.lock()
+        num = len(self.prefetchjobs)
+        self.mutex.unlock()
+        return num
+
 class RenderThread( qt4.QThread ):
     """A thread for processing rendering jobs.
     This is controlled by a RenderControl object
@@ -193,7 +253,21 @@ class RenderThread( qt4.QThread ):
                 traceback.print_exc(file=sys.stderr)
 
 class PlotWindow( qt4.QGraphicsView ):
-    """Class to show the plot(s) in a scrollable window."""
+    """Class to show the plot(s) in a scrollable window.
+
+    When idle, neighbouring pages and thumbnails of pages are
+    rendered in the background and kept in a cache.
+
+    Emits: sigThumbnailReady(pagenum) when a thumbnail requested by
+             getThumbnail() has been rendered
+    """
+
+    # pages either side of the current one to render in the background
+    prefetchpages = 2
+    # size of thumbnails of pages in pixels
+    thumbnailsize = 128
+    # delay in ms after an update before rendering in the background
+    prefetchdelay = 250
 
     # how often the document can update
     updateintervals = (
@@ -273,6 +347,27 @@ class PlotWindow( qt4.QGraphicsView ):
         self.rendercontrol = RenderControl(self)
         self.connect(self.rendercontrol, qt4.SIGNAL("renderfinished"),
         self.slotRenderFinished)
+        self.connect(self.rendercontrol, qt4.SIGNAL("prefetchfinished"),
+                     self.slotPrefetchFinished)
+
+        # rendered pages and thumbnails
+        self.pagecache = pagecache.PageImageCache(
+            document, setting.settingdb['plot_pagecache']*1024*1024)
+        self.connect(self.document, qt4.SIGNAL("sigChanges"),
+                     self.pagecache.slotChanges)
+        self.connect(self.document, qt4.SIGNAL("sigWiped"),
+                     self.pagecache.clear)
+
+        # render other pages in the background when idle
+        self.prefetchtimer = qt4.QTimer(self)
+        self.prefetchtimer.setSingleShot(True)
+        self.connect( self.prefetchtimer, qt4.SIGNAL('timeout()'),
+                      self.slotPrefetch )
+        # keys of pages waiting to be rendered in the background
+        self.prefetchqueued = set()
+        # keys of pages which could not be painted, at changeset
+        self.prefetchfailed = set()
+        self.prefetchfailedchangeset = -1
 
         # mode for clicking
         self.clickmode = 'select'
@@ -319,7 +414,10 @@ class PlotWindow( qt4.QGraphicsView ):
 
     def hideEvent(self, event):
         """Window closing, so exit rendering threads."""
+        self.prefetchtimer.stop()
         self.rendercontrol.exitThreads()
+        self.rendercontrol.clearPrefetchJobs()
+        self.prefetchqueued.clear()
         qt4.QGraphicsView.hideEvent(self, event)
 
     def sizeHint(self):
@@ -889,12 +987,24 @@ class PlotWindow( qt4.QGraphicsView ):
                                    self.pagenumber )
             self.oldpagenumber = self.pagenumber
 
+            params = self.prefetchParams('page')
+            cached = None
             if self.pagenumber >= 0:
+                cached = self.pagecache.get('page', self.pagenumber, params)
+
+            if cached is not None:
+                # already rendered in the background
+                self.rendercontrol.supersedeJobs()
+                self.painthelper = cached.helper
+                self.showImage(cached.image)
+
+            elif self.pagenumber >= 0:
                 size = self.document.pageSize(
                     self.pagenumber, scaling=self.zoomfactor)
 
                 # draw the data into the buffer
                 # errors cause an exception window to pop up
+                info = (self.pagenumber, params, self.document.changeset)
                 try:
                     phelper = document.PaintHelper(
                         size, scaling=self.zoomfactor, dpi=self.dpi)
@@ -905,10 +1015,11 @@ class PlotWindow( qt4.QGraphicsView ):
                     d = exceptiondialog.ExceptionDialog(sys.exc_info(), self)
                     self.oldzoom = self.zoomfactor
                     self.docchangeset = self.document.changeset
+                    info = None
                     d.exec_()
 
                 self.painthelper = phelper
-                self.rendercontrol.addJob(phelper)
+                self.rendercontrol.addJob(phelper, info=info)
             else:
                 self.painthelper = None
                 self.pagenumber = 0
@@ -925,18 +1036,133 @@ class PlotWindow( qt4.QGraphicsView ):
             self.oldzoom = self.zoomfactor
             self.docchangeset = self.document.changeset
 
-    def slotRenderFinished(self, jobid, img, helper):
-        """Update image on display if rendering (usually in other
-        thread) finished."""
+            self.startPrefetch()
+
+    def showImage(self, img):
+        """Show the image of the page."""
         bufferpixmap = qt4.QPixmap.fromImage(img)
         self.setSceneRect(0, 0, bufferpixmap.width(), bufferpixmap.height())
         self.pixmapitem.setPixmap(bufferpixmap)
 
+    def slotRenderFinished(self, jobid, img, helper, info):
+        """Update image on display if rendering (usually in other
+        thread) finished."""
+        self.showImage(img)
+
+        if info is not None:
+            pagenum, params, changeset = info
+            self.pagecache.add('page', pagenum, params, changeset,
+                               img, helper)
+
+    def prefetchParams(self, kind):
+        """Return parameters used to render a page or thumbnail."""
+        if kind == 'page':
+            return (self.zoomfactor, self.dpi, self.antialias)
+        else:
+            return (self.thumbnailsize, self.dpi, self.antialias)
+
+    def startPrefetch(self):
+        """Start rendering other pages in the background when idle."""
+        if ( setting.settingdb['plot_prefetch'] and self.interval != 0 and
+             self.isVisible() ):
+            self.prefetchtimer.start(self.prefetchdelay)
+
+    def nextPrefetch(self):
+        """Return (kind, page number) of the next page or thumbnail
+        to render in the background, or None if there are none."""
+
+        numpages = self.document.getNumberPages()
+        if self.prefetchfailedchangeset != self.document.changeset:
+            self.prefetchfailedchangeset = self.document.changeset
+            self.prefetchfailed.clear()
+
+        def needed(kind, pagenum):
+            key = (kind, pagenum, self.prefetchParams(kind))
+            return ( 0 <= pagenum < numpages and
+                     key not in self.prefetchqueued and
+                     key not in self.prefetchfailed and
+                     self.pagecache.get(*key) is None )
+
+        for delta in crange(1, self.prefetchpages+1):
+            for pagenum in (self.pagenumber+delta, self.pagenumber-delta):
+                if needed('page', pagenum):
+                    return ('page', pagenum)
+
+        # thumbnails nearest the current page first
+        for pagenum in sorted(crange(numpages),
+                              key=lambda p: abs(p-self.pagenumber)):
+            if needed('thumbnail', pagenum):
+                return ('thumbnail', pagenum)
+        return None
+
+    def slotPrefetch(self):
+        """Paint the next page or thumbnail to render in the
+        background, passing it to the rendering threads."""
+
+        # don't get ahead of the rendering threads
+        if ( self.rendercontrol.numPrefetchJobs() >
+             len(self.rendercontrol.threads) ):
+            return
+
+        item = self.nextPrefetch()
+        if item is None:
+            return
+        kind, pagenum = item
+        params = self.prefetchParams(kind)
+        key = (kind, pagenum, params)
+
+        if kind == 'page':
+            scaling = self.zoomfactor
+        else:
+            pagesize = self.document.pageSize(pagenum)
+            scaling = self.thumbnailsize / max(pagesize[0], pagesize[1], 1)
+        size = self.document.pageSize(pagenum, scaling=scaling)
+
+        try:
+            helper = document.PaintHelper(size, scaling=scaling,
+                                          dpi=self.dpi)
+            self.document.paintTo(helper, pagenum)
+        except Exception:
+            # the error is shown if the page is viewed
+            self.prefetchfailed.add(key)
+        else:
+            self.prefetchqueued.add(key)
+            self.rendercontrol.addPrefetchJob(
+                helper, (kind, pagenum, params, self.document.changeset))
+
+        self.startPrefetch()
+
+    def slotPrefetchFinished(self, info, img, helper):
+        """A page or thumbnail has been rendered in the background."""
+        kind, pagenum, params, changeset = info
+        self.prefetchqueued.discard( (kind, pagenum, params) )
+        self.pagecache.add(kind, pagenum, params, changeset, img,
+                           helper if kind == 'page' else None)
+        if kind == 'thumbnail':
+            self.emit( qt4.SIGNAL("sigThumbnailReady"), pagenum )
+        self.startPrefetch()
+
+    def getThumbnail(self, pagenum):
+        """Return a QImage thumbnail of the page, or None if it has not
+        been rendered yet. If not, it is rendered in the background and
+        sigThumbnailReady(pagenum) is emitted when it is ready."""
+        entry = self.pagecache.get(
+            'thumbnail', pagenum, self.prefetchParams('thumbnail'))
+        if entry is None:
+            self.startPrefetch()
+            return None
+        return entry.image
+
     def updatePlotSettings(self):
         """Update plot window settings from settings."""
         self.setTimeout(setting.settingdb['plot_updatepolicy'])
         self.antialias = setting.settingdb['plot_antialias']
         self.rendercontrol.updateNumberThreads()
+        self.rendercontrol.clearPrefetchJobs()
+        self.prefetchqueued.clear()
+        self.pagecache.clear()
+        self.pagecache.setMaxSize(
+            setting.settingdb['plot_pagecache']*1024*1024)
         self.actionForceUpdate()
 
     def contextMenuEvent(self, event):
@@ -984,6 +1210,7 @@ class PlotWindow( qt4.QGraphicsView ):
     def actionForceUpdate(self):
         """Force an update for the graph."""
         self.docchangeset = -100
+        self.pagecache.clear()
         self.checkPlotUpdate()
 
     def slotFullScreen(self):
@@ -49,6 +49,13 @@ class WidgetTreeModel(qt4.QAbstractItemModel):
 
     def slotDocumentModified(self):
         """The document has been changed."""
+
+        # only names, types and hidden status of widgets are shown
+        changes = self.document.pendingchanges
+        if ( not changes.everything and
+             not [s for s in changes.settings if s.endswith('/hide')] ):
+            return
+
         if not self.suspendmodified:
             # needs to be suspended within insert/delete row operations
             self.emit( qt4.SIGNAL('layoutChanged()') )